@@ -0,0 +1,114 @@
+"""
+Benchmark: GET /tasks/?view=year — ORM + task_to_dict (before) vs column projection + orjson (after),
+и отдельно summary=true (дневные корзины; ответ другого объёма, с before/after не сравнивается).
+
+Запуск из папки backend:
+    python benchmarks/bench_tasks_year.py [tasks=20000] [repeats=5]
+
+Работает на временной SQLite-базе, рабочую taskflow.db не трогает.
+
+Пример (20000 задач, best of 5; машина шумная, разброс между прогонами ~30%):
+    before     2474.0 ms          8,084 rows/sec      10651 KiB
+    after       478.8 ms         41,769 rows/sec      10651 KiB
+    summary      95.7 ms        209,029 rows/sec         64 KiB
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Task, UserProfile
+from routers.tasks import tasks_view, summarize_window, task_to_dict, view_range
+from services.serialization import FastJSONResponse
+
+
+def seed(db, n: int, year: int):
+    db.add(UserProfile(id=1, name="Bench"))
+    start = datetime(year, 1, 1, 8)
+    rnd = random.Random(42)
+    db.bulk_save_objects([
+        Task(
+            user_id=1,
+            title=f"Task {i}",
+            description="Описание задачи " * 4,
+            category=rnd.choice(["work", "study", "health", "personal"]),
+            priority=rnd.choice(["critical", "high", "medium", "low"]),
+            status=rnd.choice(["pending", "completed"]),
+            start_datetime=start + timedelta(minutes=rnd.randrange(365 * 24 * 60)),
+            duration_minutes=rnd.choice([15, 30, 60, 90]),
+            subtasks=[{"title": "sub", "done": False}] * rnd.randrange(4),
+            attached_files=[{"name": "file.txt", "size": 1024}] * 3,
+        )
+        for i in range(n)
+    ])
+    db.commit()
+
+
+def legacy_year_view(db, target: date) -> bytes:
+    """Путь до оптимизации: полные ORM-объекты, task_to_dict, jsonable_encoder + json."""
+    start, end = view_range("year", target)
+    tasks = db.query(Task).filter(
+        Task.user_id == 1, Task.start_datetime >= start, Task.start_datetime < end,
+    ).all()
+    tasks.sort(key=lambda t: t.start_datetime)
+    content = {"tasks": [task_to_dict(t) for t in tasks], "undated": [], "view": "year", "date": str(target)}
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast_year_view(db, target: date) -> bytes:
+    return FastJSONResponse(tasks_view(db, 1, "year", target)).body
+
+
+def summary_year_view(db, target: date) -> bytes:
+    """GET /tasks/?view=year&summary=true — дневные корзины вместо задач (другой объём ответа)."""
+    start, end = view_range("year", target)
+    return FastJSONResponse({
+        "days": summarize_window(db, 1, start, end, None, None, False), "view": "year", "date": str(target),
+    }).body
+
+
+def measure(label: str, fn, Session, target: date, rows: int, repeats: int):
+    best = float("inf")
+    for _ in range(repeats):
+        db = Session()
+        try:
+            t0 = time.perf_counter()
+            body = fn(db, target)
+            best = min(best, time.perf_counter() - t0)
+        finally:
+            db.close()
+    print(f"{label:<8} {best * 1000:8.1f} ms   {rows / best:12,.0f} rows/sec   {len(body) / 1024:8.0f} KiB")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    year = date.today().year
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine, autoflush=False)
+        db = Session()
+        seed(db, n, year)
+        db.close()
+
+        print(f"GET /tasks/?view=year, {n} tasks, best of {repeats}")
+        target = date(year, 6, 1)
+        measure("before", legacy_year_view, Session, target, n, repeats)
+        measure("after", fast_year_view, Session, target, n, repeats)
+        measure("summary", summary_year_view, Session, target, n, repeats)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
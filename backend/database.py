@@ -1,20 +1,129 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, Float, JSON, ForeignKey
+from sqlalchemy import create_engine, event, make_url, Table, Column, Integer, String, Text, Boolean, DateTime, Float, JSON, ForeignKey, Index, func, literal_column, text, select
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql.functions import FunctionElement
 from datetime import datetime, timezone
+from dotenv import load_dotenv
 import enum
 import os
 
-# Абсолютный путь к БД — всегда рядом с database.py
+load_dotenv()
+
+# ─── ENGINE ───────────────────────────────────────────────────────────────────
+# DATABASE_URL из окружения/.env; по умолчанию — SQLite рядом с database.py.
+# Относительный путь SQLite (sqlite:///./taskflow.db) тоже считается от BASE_DIR,
+# а не от текущей папки процесса.
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'taskflow.db')}"
+DEFAULT_DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'taskflow.db')}"
+
+# Пул для серверных СУБД (PostgreSQL, MySQL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Профиль SQLite: WAL — читатели не ждут писателя; synchronous=NORMAL — fsync только
+# на чекпойнтах WAL (безопасно при сбое процесса); mmap и кэш страниц — меньше syscalls;
+# busy_timeout — писатели ждут блокировку, а не падают с "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    "mmap_size=268435456",     # 256 МБ
+    "cache_size=-65536",       # 64 МБ (отрицательное — в КиБ)
+    "temp_store=MEMORY",
+)
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "mysql": "mysql+aiomysql"}
+
+
+def resolve_url(raw: str) -> URL:
+    url = make_url(raw)
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:" \
+            and not os.path.isabs(url.database):
+        url = url.set(database=os.path.normpath(os.path.join(BASE_DIR, url.database)))
+    return url
+
+
+def async_url(url: URL) -> URL:
+    """Тот же адрес с асинхронным драйвером (aiosqlite / asyncpg / aiomysql)."""
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+
+def engine_options(url: URL) -> dict:
+    if url.get_backend_name() == "sqlite":
+        return {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def build_engine(url: URL, use_async: bool = False):
+    """Движок по URL: настройки пула для серверных СУБД, PRAGMA-профиль для SQLite."""
+    options = engine_options(url)
+    try:
+        new_engine = create_async_engine(url, **options) if use_async else create_engine(url, **options)
+    except ImportError as e:
+        # Драйверы PostgreSQL/MySQL не входят в requirements.txt — ставятся под выбранную СУБД
+        raise RuntimeError(
+            f"[DB] Для {url.drivername} не установлен драйвер (модуль '{e.name}') — "
+            f"см. драйверы СУБД в requirements.txt"
+        ) from e
+    if url.get_backend_name() == "sqlite":
+        event.listen(new_engine.sync_engine if use_async else new_engine, "connect", _apply_sqlite_pragmas)
+    return new_engine
+
 
-print(f"[DB] База данных: {os.path.join(BASE_DIR, 'taskflow.db')}")
+DATABASE_URL = resolve_url(os.getenv("DATABASE_URL") or DEFAULT_DATABASE_URL)
+ASYNC_DATABASE_URL = resolve_url(os.getenv("ASYNC_DATABASE_URL")) if os.getenv("ASYNC_DATABASE_URL") \
+    else async_url(DATABASE_URL)
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+print(f"[DB] База данных: {DATABASE_URL.render_as_string(hide_password=True)}")
+
+engine = build_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Async-доступ для async def эндпоинтов (чат, голос, WebSocket) — через aiosqlite,
+# без блокирующих вызовов в event loop. Класс синхронной сессии — тот же, что у
+# SessionLocal, поэтому хуки сессии (события, счётчики, кэши, серии) работают и здесь.
+# expire_on_commit=False: после commit атрибуты не перечитываются лениво (в async это ошибка).
+# Движок создаётся при первом async-запросе: без asyncpg/aiomysql приложение
+# всё равно стартует, а async-эндпоинты падают с понятной ошибкой о драйвере.
+AsyncSessionLocal = async_sessionmaker(
+    class_=AsyncSession, sync_session_class=SessionLocal.class_,
+    autoflush=False, expire_on_commit=False,
+)
+_async_engine = None
+
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = build_engine(ASYNC_DATABASE_URL, use_async=True)
+    return _async_engine
+
+
+async def dispose_async_engine():
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
 
 def get_db():
     db = SessionLocal()
@@ -24,6 +133,26 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal(bind=get_async_engine()) as db:
+        yield db
+
+
+def remember_bulk_users(state, model, key: str):
+    """
+    Хук do_orm_execute: перед query.update()/delete() по model кладёт в session.info[key]
+    user_id затронутых строк — хуки after_bulk_* пересобирают производные данные только им.
+    """
+    if not (state.is_update or state.is_delete) or state.bind_mapper is None or state.bind_mapper.class_ is not model:
+        return
+    query = select(model.user_id).distinct()
+    if state.statement.whereclause is not None:
+        query = query.where(state.statement.whereclause)
+    # сначала запрос: он может открыть транзакцию, а её хуки — почистить session.info
+    users = state.session.execute(query).scalars().all()
+    state.session.info.setdefault(key, set()).update(users)
+
+
 class PriorityEnum(str, enum.Enum):
     critical = "critical"
     high = "high"
@@ -113,6 +242,50 @@ class Task(Base):
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
 
     user = relationship("UserProfile", back_populates="tasks")
+    occurrences = relationship("TaskOccurrence", cascade="all, delete-orphan")
+
+    # Составные индексы под выборки GET /tasks/ (окно вида, дедлайны, статусы)
+    __table_args__ = (
+        Index("ix_tasks_user_start", "user_id", "start_datetime"),
+        Index("ix_tasks_user_deadline", "user_id", "deadline"),
+        Index("ix_tasks_user_status", "user_id", "status"),
+        Index("ix_tasks_user_created", "user_id", "created_at", "id"),
+    )
+
+
+# ─── OVERDUE RULE: SQL-выражения и частичные индексы ─────────────────────────
+# Правило просрочки целиком — в services/overdue_rule.py. Здесь только выражения,
+# которые должны буквально совпадать в индексах и запросах (литералы, не параметры,
+# иначе SQLite не применит частичный/экспрессионный индекс).
+TASK_NOT_COMPLETED = Task.status != literal_column("'completed'")
+
+
+class minutes_after(FunctionElement):
+    """start + N минут в диалекте базы: datetime(start, '+N minutes') в SQLite, + interval иначе."""
+    type = DateTime()
+    name = "minutes_after"
+    inherit_cache = True
+
+
+@compiles(minutes_after)
+def _minutes_after_interval(element, compiler, **kw):
+    start, minutes = element.clauses
+    return f"({compiler.process(start, **kw)} + {compiler.process(minutes, **kw)} * INTERVAL '1 minute')"
+
+
+@compiles(minutes_after, "sqlite")
+def _minutes_after_sqlite(element, compiler, **kw):
+    start, minutes = element.clauses
+    return f"datetime({compiler.process(start, **kw)}, '+' || {compiler.process(minutes, **kw)} || ' minutes')"
+
+
+TASK_DURATION_END = minutes_after(Task.start_datetime, Task.duration_minutes)
+Index("ix_tasks_open_deadline", Task.user_id, Task.deadline,
+      sqlite_where=TASK_NOT_COMPLETED, postgresql_where=TASK_NOT_COMPLETED)
+Index("ix_tasks_open_end", Task.user_id, Task.end_datetime,
+      sqlite_where=TASK_NOT_COMPLETED, postgresql_where=TASK_NOT_COMPLETED)
+Index("ix_tasks_open_duration_end", Task.user_id, TASK_DURATION_END,
+      sqlite_where=TASK_NOT_COMPLETED, postgresql_where=TASK_NOT_COMPLETED)
 
 
 class ChatMessage(Base):
@@ -129,6 +302,10 @@ class ChatMessage(Base):
 
     user = relationship("UserProfile", back_populates="chat_messages")
 
+    __table_args__ = (
+        Index("ix_chat_messages_user_created", "user_id", "created_at", "id"),
+    )
+
 
 class AIMemory(Base):
     __tablename__ = "ai_memories"
@@ -144,6 +321,68 @@ class AIMemory(Base):
 
     user = relationship("UserProfile", back_populates="ai_memories")
 
+    __table_args__ = (
+        Index("ix_ai_memories_user_created", "user_id", "created_at", "id"),
+    )
+
+
+class TaskOccurrence(Base):
+    """Разреженные переопределения вхождений повторяющейся задачи (выполнено / перенесено / пропущено)."""
+    __tablename__ = "task_occurrences"
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("tasks.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("user_profiles.id"), default=1)
+    occurrence_date = Column(String(10), nullable=False)   # исходная дата вхождения по правилу
+    status = Column(String(20), nullable=True)
+    start_datetime = Column(DateTime, nullable=True)       # если вхождение перенесли
+    completed_at = Column(DateTime, nullable=True)
+    skipped = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("ux_task_occurrences_task_date", "task_id", "occurrence_date", unique=True),
+        Index("ix_task_occurrences_user_start", "user_id", "start_datetime"),
+    )
+
+
+class TaskChange(Base):
+    """Append-only журнал изменений задач. id служит версией для дельта-синхронизации."""
+    __tablename__ = "task_changes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("user_profiles.id"), default=1)
+    task_id = Column(Integer, nullable=False)
+    op = Column(String(10), default="upsert")   # upsert | delete | archive
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("ix_task_changes_user_id", "user_id", "id"),
+    )
+
+
+class DataVersion(Base):
+    """Версия данных пользователя для кэшей (services/cache.py): растёт в той же транзакции, что и правка."""
+    __tablename__ = "data_versions"
+
+    user_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class TaskCounter(Base):
+    """Материализованные счётчики задач пользователя по статусу / категории / приоритету."""
+    __tablename__ = "task_counters"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("user_profiles.id"), default=1)
+    dimension = Column(String(20), nullable=False)   # status | category | priority
+    key = Column(String(50), nullable=False)
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("ux_task_counters_user_dim_key", "user_id", "dimension", "key", unique=True),
+    )
+
 
 class DailyStats(Base):
     __tablename__ = "daily_stats"
@@ -161,23 +400,110 @@ class DailyStats(Base):
     all_done = Column(Boolean, default=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        Index("ux_daily_stats_user_date", "user_id", "date", unique=True),
+    )
 
-def create_tables():
-    Base.metadata.create_all(bind=engine)
-    db = SessionLocal()
+
+class StreakRun(Base):
+    """Непрерывная серия дней с all_done: [start_date, end_date] включительно."""
+    __tablename__ = "streak_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("user_profiles.id"), default=1)
+    start_date = Column(String(10), nullable=False)
+    end_date = Column(String(10), nullable=False)
+
+    __table_args__ = (
+        Index("ix_streak_runs_user_end", "user_id", "end_date"),
+        Index("ix_streak_runs_user_start", "user_id", "start_date"),
+    )
+
+
+class UserStreak(Base):
+    """Самая длинная серия пользователя (текущая — последняя строка streak_runs)."""
+    __tablename__ = "user_streaks"
+
+    user_id = Column(Integer, ForeignKey("user_profiles.id"), primary_key=True)
+    longest = Column(Integer, default=0)
+    longest_start = Column(String(10), nullable=True)
+    longest_end = Column(String(10), nullable=True)
+
+
+# ─── ARCHIVE (cold) ───────────────────────────────────────────────────────────
+# Те же колонки, что у горячих таблиц, плюс archived_at. id сохраняется — ссылки
+# в task_changes и у клиентов остаются валидны. Переносит services/archive.py.
+
+def archive_table(source: Table, name: str, *indexes) -> Table:
+    columns = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in source.columns]
+    return Table(name, Base.metadata, *columns, Column("archived_at", DateTime), *indexes)
+
+
+class TaskArchive(Base):
+    """Выполненные задачи старше ARCHIVE_TASKS_AFTER_DAYS."""
+    __table__ = archive_table(
+        Task.__table__, "tasks_archive",
+        Index("ix_tasks_archive_user_start", "user_id", "start_datetime"),
+        Index("ix_tasks_archive_user_deadline", "user_id", "deadline"),
+        Index("ix_tasks_archive_user_created", "user_id", "created_at", "id"),
+    )
+
+
+class ChatMessageArchive(Base):
+    """Сообщения чата старше ARCHIVE_CHAT_AFTER_DAYS."""
+    __table__ = archive_table(
+        ChatMessage.__table__, "chat_messages_archive",
+        Index("ix_chat_messages_archive_user_created", "user_id", "created_at", "id"),
+    )
+
+
+def create_indexes(bind=None):
+    """create_all не добавляет новые индексы в уже существующие таблицы — досоздаём."""
+    # IF NOT EXISTS вместо checkfirst: рефлексия не видит экспрессионные индексы
+    with (bind or engine).begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def dedupe_daily_stats(bind=None):
+    """Уникальный (user_id, date) не создастся поверх дублей — оставляем последнюю строку дня."""
+    with (bind or engine).begin() as conn:
+        conn.execute(text(
+            "DELETE FROM daily_stats WHERE id NOT IN "
+            "(SELECT MAX(id) FROM daily_stats GROUP BY user_id, date)"
+        ))
+
+
+def ensure_user(bind=None, user_id: int = None) -> bool:
+    """Профиль пользователя (user_id=None — любой первый). True, если профиль создан."""
+    db = SessionLocal(bind=bind or engine)
     try:
-        user = db.query(UserProfile).first()
-        if not user:
-            default_user = UserProfile(
-                name="User",
-                max_daily_hours=8.0,
-                wake_time="08:00",
-                sleep_time="23:00",
-                ai_memory="{}",
-                preferences={},
-            )
-            db.add(default_user)
-            db.commit()
-            print("[DB] Создан пользователь по умолчанию")
+        query = db.query(UserProfile)
+        if user_id is not None:
+            query = query.filter(UserProfile.id == user_id)
+        if query.first():
+            return False
+        db.add(UserProfile(
+            id=user_id,
+            name="User",
+            max_daily_hours=8.0,
+            wake_time="08:00",
+            sleep_time="23:00",
+            ai_memory="{}",
+            preferences={},
+        ))
+        db.commit()
+        return True
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def create_tables(bind=None, user_id: int = None):
+    """Схема, индексы и профиль — для основной базы или нового шарда пользователя."""
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    dedupe_daily_stats(bind)
+    create_indexes(bind)
+    if ensure_user(bind, user_id):
+        print("[DB] Создан пользователь по умолчанию" if user_id is None else f"[DB] Создан пользователь {user_id}")
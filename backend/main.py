@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
@@ -7,16 +8,32 @@ import os
 # Загружаем .env ДО импорта всего остального
 load_dotenv()
 
-from database import create_tables
+from database import create_tables, engine, dispose_async_engine
 from routers.tasks import router as tasks_router
 from routers.ai_agent import router as ai_router
+from routers.dashboard import router as dashboard_router
+from routers.export import router as export_router
 from routers.profile_stats import profile_router, stats_router
+from services.overdue_scheduler import overdue_scheduler
+from services.pagination import CURSOR_HEADERS
+from services.counters import ensure_task_counters
+from services.streaks import ensure_streaks
+from services.shards import shard_directory
+from services.archive import archiver
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_tables()
+    ensure_task_counters(engine)
+    ensure_streaks(engine)
+    overdue_scheduler.start()
+    archiver.start()
     yield
+    archiver.stop()
+    overdue_scheduler.stop()
+    shard_directory.dispose_all()
+    await dispose_async_engine()
 
 
 app = FastAPI(
@@ -32,11 +49,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=CURSOR_HEADERS,
 )
+# Сжимаем крупные ответы (месяц/год, история) — мелкие отдаются как есть
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 app.include_router(tasks_router)
+app.include_router(dashboard_router)
 app.include_router(ai_router)
 app.include_router(profile_router)
 app.include_router(stats_router)
+app.include_router(export_router)
 
 
 @app.get("/")
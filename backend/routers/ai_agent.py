@@ -1,90 +1,93 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Query, Response
+from typing import Optional
 from sqlalchemy.orm import Session
-from database import get_db, ChatMessage
-from services.agent import process_message, save_message
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import ChatMessage, ChatMessageArchive
+from services.agent import process_message
 from services.transcribe import transcribe_audio
+from services.pagination import keyset_page, copy_cursor_headers
+from services.serialization import FastJSONResponse, rows_to_dicts
+from services.shards import get_user_db, get_user_async_db, current_user_id, shard_directory
+from services.archive import chat_source
 import json
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
 
-def msg_to_dict(m: ChatMessage) -> dict:
-    return {
-        "id": m.id,
-        "role": m.role,
-        "content": m.content,
-        "message_type": m.message_type,
-        # Сохраняем meta как metadata — единый ключ для фронта
-        "metadata": m.meta or {},
-        "created_at": m.created_at.isoformat(),
-    }
+# Колонки истории чата (meta отдаётся как metadata — единый ключ для фронта)
+def msg_columns(model=ChatMessage) -> tuple:
+    return (
+        model.id, model.role, model.content, model.message_type,
+        model.meta.label("metadata"), model.created_at,
+    )
 
 
 @router.get("/history")
-def get_history(db: Session = Depends(get_db)):
-    msgs = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.user_id == 1)
-        .order_by(ChatMessage.created_at.asc())
-        .all()
-    )
-    return [msg_to_dict(m) for m in msgs]
+def get_history(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    include_archived: bool = False,
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    """
+    Последние сообщения по возрастанию; before/after — курсоры из заголовков X-Cursor-*.
+    include_archived — листать дальше в архив чата.
+    """
+    model = chat_source(include_archived)
+    query = db.query(*msg_columns(model)).filter(model.user_id == user_id)
+    rows = keyset_page(query, model, limit, before, after, response=response)
+    msgs = rows_to_dicts(rows, defaults={"metadata": {}})
+    return copy_cursor_headers(response, FastJSONResponse(msgs))
 
 
 @router.post("/chat")
-async def chat(message: str = Form(...), db: Session = Depends(get_db)):
+async def chat(message: str = Form(...), db: AsyncSession = Depends(get_user_async_db),
+               user_id: int = Depends(current_user_id)):
     """
-    Правильный порядок:
-    1. Сохраняем сообщение пользователя в БД
-    2. Агент читает историю из БД (включая только что сохранённое)
-       — process_message НЕ добавляет сообщение ещё раз
-    3. Сохраняем ответ ИИ в БД
-    4. Возвращаем результат
+    Один ход агента — одна транзакция (services/agent.process_message):
+    агент читает историю и добавляет к ней это сообщение, а после ответа ИИ
+    сообщение пользователя, изменения задач и ответ сохраняются одним коммитом.
     """
-    save_message(db, "user", message, user_id=1, msg_type="text")
-    result = await process_message(db, user_id=1)
-    ai_text = result.get("message") or "Готово."
-    save_message(db, "assistant", ai_text, user_id=1, msg_type="text", meta=result)
-    return result
+    return await process_message(db, message, user_id=user_id, msg_type="text")
 
 
 @router.post("/voice")
-async def voice_chat(audio: UploadFile = File(...), db: Session = Depends(get_db)):
+async def voice_chat(audio: UploadFile = File(...), db: AsyncSession = Depends(get_user_async_db),
+                     user_id: int = Depends(current_user_id)):
     audio_bytes = await audio.read()
     transcript = await transcribe_audio(audio_bytes, audio.filename or "audio.webm")
-    save_message(db, "user", transcript, user_id=1, msg_type="voice")
-    result = await process_message(db, user_id=1)
-    ai_text = result.get("message") or "Готово."
-    save_message(db, "assistant", ai_text, user_id=1, msg_type="text", meta=result)
+    result = await process_message(db, transcript, user_id=user_id, msg_type="voice")
     result["transcript"] = transcript
     return result
 
 
 @router.post("/upload-file")
-async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_file(file: UploadFile = File(...), db: AsyncSession = Depends(get_user_async_db),
+                      user_id: int = Depends(current_user_id)):
     content = await file.read()
     try:
         text = content.decode("utf-8")
     except Exception:
         text = content.decode("latin-1", errors="replace")
     prompt = f"Я загрузил файл '{file.filename}'. Извлеки все задачи:\n\n{text[:4000]}"
-    save_message(db, "user", prompt, user_id=1, msg_type="file")
-    result = await process_message(db, user_id=1)
-    ai_text = result.get("message") or "Готово."
-    save_message(db, "assistant", ai_text, user_id=1, msg_type="text", meta=result)
+    result = await process_message(db, prompt, user_id=user_id, msg_type="file")
     result["filename"] = file.filename
     return result
 
 
 @router.delete("/history")
-def clear_history(db: Session = Depends(get_db)):
-    db.query(ChatMessage).filter(ChatMessage.user_id == 1).delete()
+def clear_history(db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    db.query(ChatMessage).filter(ChatMessage.user_id == user_id).delete()
+    db.query(ChatMessageArchive).filter(ChatMessageArchive.user_id == user_id).delete()
     db.commit()
     return {"ok": True}
 
 
 @router.websocket("/ws")
-async def websocket_chat(websocket: WebSocket, db: Session = Depends(get_db)):
+async def websocket_chat(websocket: WebSocket, user_id: int = Depends(current_user_id)):
     await websocket.accept()
     try:
         while True:
@@ -98,11 +101,10 @@ async def websocket_chat(websocket: WebSocket, db: Session = Depends(get_db)):
             message = payload.get("message", "")
             if not message: continue
 
-            # Рекомендуется обернуть в транзакцию
-            save_message(db, "user", message, user_id=1)
-            result = await process_message(db, user_id=1)
-            ai_text = result.get("message") or "Готово."
-            save_message(db, "assistant", ai_text, user_id=1, meta=result)
+            # Своя короткая сессия на каждое сообщение — соединение не держит
+            # identity map и транзакцию всё время жизни сокета
+            async with shard_directory.async_session(user_id) as db:
+                result = await process_message(db, message, user_id=user_id)
             
             await websocket.send_text(json.dumps(result))
     except WebSocketDisconnect:
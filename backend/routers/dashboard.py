@@ -0,0 +1,124 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_
+from datetime import datetime, date, timedelta
+from typing import Optional
+from database import Task
+from routers.tasks import TASK_COLUMNS, task_rows_to_dicts, view_range
+from services.load_analyzer import day_load, select_overdue, build_tips, max_daily_minutes
+from services.recurrence import is_series, expand_series, occurrence_to_dict, day_window
+from services.serialization import FastJSONResponse
+from services.shards import get_user_db, current_user_id
+
+router = APIRouter(prefix="/dashboard", tags=["dashboard"])
+
+UNDATED_LIMIT = 100   # первая страница /tasks/undated
+
+
+# ─── SNAPSHOT ─────────────────────────────────────────────────────────────────
+
+def load_snapshot(db: Session, user_id: int, start: datetime, end: datetime) -> list:
+    """
+    Все задачи, нужные главной странице, одним запросом: открытые целиком,
+    выполненные — только попавшие в окно вида, плюс мастера серий.
+    """
+    return db.query(*TASK_COLUMNS).filter(
+        Task.user_id == user_id,
+        or_(
+            Task.status != "completed",
+            and_(Task.start_datetime >= start, Task.start_datetime < end),
+            and_(Task.start_datetime.is_(None), Task.deadline >= start, Task.deadline < end),
+            Task.is_recurring == True,  # noqa: E712
+        ),
+    ).all()
+
+
+def build_view(db: Session, user_id: int, rows: list, start: datetime, end: datetime) -> tuple[list, list]:
+    """То же, что GET /tasks/ (без фильтров), но из готового снимка."""
+    scheduled, undated = [], []
+    for t in rows:
+        if is_series(t):
+            continue
+        if t.start_datetime:
+            if start <= t.start_datetime < end or t.status == "overdue":
+                scheduled.append(t)
+        elif t.deadline:
+            if start <= t.deadline < end or t.status == "overdue":
+                scheduled.append(t)
+        elif t.status == "overdue":
+            scheduled.append(t)
+        elif t.status != "completed":
+            undated.append(t)
+
+    tasks = task_rows_to_dicts(scheduled)
+    occurrences = expand_series(db, user_id, start, end, masters=rows)
+    series = {occ.task.id: task_rows_to_dicts([occ.task])[0] for occ in occurrences}
+    tasks += [occurrence_to_dict(occ, series[occ.task.id]) for occ in occurrences]
+    tasks.sort(key=lambda t: t["start_datetime"] or t["deadline"] or datetime.max)
+    return tasks, task_rows_to_dicts(undated)
+
+
+def day_tasks_by_date(db: Session, user_id: int, rows: list, days: list[date]) -> dict:
+    """{day: открытые задачи дня} — как в calculate_day_load, для нескольких дней подряд."""
+    start, _ = day_window(days[0])
+    _, end = day_window(days[-1])
+    result = {d: [] for d in days}
+    for t in rows:
+        if t.status != "completed" and t.start_datetime and start <= t.start_datetime < end and not is_series(t):
+            result[t.start_datetime.date()].append(t)
+    for occ in expand_series(db, user_id, start, end, masters=rows):
+        if occ.status != "completed":
+            result[occ.start_datetime.date()].append(occ.task)
+    return result
+
+
+# ─── ENDPOINTS ────────────────────────────────────────────────────────────────
+
+@router.get("/")
+def get_dashboard(
+    view: str = Query("day"),
+    date_str: Optional[str] = Query(None),
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    """
+    Снимок главной страницы: список вида, undated, unsorted, overdue,
+    загрузка на сегодня/завтра и советы. Вместо пяти эндпоинтов и ~10 полных
+    выборок — один запрос задач, профиль и переопределения серий.
+    """
+    target_date = date.fromisoformat(date_str) if date_str else date.today()
+    start, end = view_range(view, target_date)
+
+    rows = load_snapshot(db, user_id, start, end)
+    open_rows = [t for t in rows if t.status != "completed"]
+
+    tasks, view_undated = build_view(db, user_id, rows, start, end)
+
+    undated = sorted(
+        (t for t in open_rows if t.start_datetime is None and t.deadline is None),
+        key=lambda t: (t.created_at, t.id), reverse=True,
+    )[:UNDATED_LIMIT]
+    unsorted = [t for t in open_rows if t.category == "unsorted"]
+    overdue = select_overdue(open_rows)
+
+    today = date.today()
+    tomorrow = today + timedelta(days=1)
+    max_minutes = max_daily_minutes(db, user_id)
+    by_day = day_tasks_by_date(db, user_id, rows, [today, tomorrow])
+    load = day_load(by_day[today], today, max_minutes)
+    tomorrow_load = day_load(by_day[tomorrow], tomorrow, max_minutes)
+
+    return FastJSONResponse({
+        "view": {
+            "tasks": tasks,
+            "undated": view_undated,
+            "view": view,
+            "date": str(target_date),
+        },
+        "undated": task_rows_to_dicts(undated),
+        "unsorted": task_rows_to_dicts(unsorted),
+        "overdue": task_rows_to_dicts(overdue),
+        "load": load,
+        "tomorrow_load": tomorrow_load,
+        "tips": build_tips(load, tomorrow_load, overdue),
+    })
@@ -0,0 +1,33 @@
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from services.exporter import DATASETS, FORMATS, stream_export
+from services.shards import current_user_id
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+
+@router.get("/{dataset}")
+def export_dataset(dataset: str, fmt: str = Query("ndjson", alias="format"),
+                   include_archived: bool = False, user_id: int = Depends(current_user_id)):
+    """
+    Потоковая выгрузка: dataset — tasks | chat | memories | stats,
+    format — ndjson | csv | ics (ics только для задач).
+    include_archived — добавить архивные задачи / сообщения чата.
+    """
+    if dataset not in DATASETS:
+        raise HTTPException(404, f"Unknown dataset '{dataset}'")
+    if fmt not in FORMATS:
+        raise HTTPException(400, f"Unsupported format '{fmt}'")
+    if fmt == "ics" and dataset != "tasks":
+        raise HTTPException(400, "iCalendar export is available for tasks only")
+
+    media_type, ext = FORMATS[fmt]
+    filename = f"taskflow-{dataset}-{date.today():%Y%m%d}.{ext}"
+    return StreamingResponse(
+        stream_export(dataset, fmt, user_id=user_id, include_archived=include_archived),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import date, timedelta
 from typing import Optional
 from pydantic import BaseModel
-from database import get_db, UserProfile, AIMemory, DailyStats, Task
+from database import UserProfile, AIMemory, DailyStats, Task
+from services.pagination import keyset_page
+from services.overdue_rule import overdue_clause
+from services.stats_backfill import backfill_daily_stats
+from services.counters import read_task_counters
+from services.streaks import read_streak
+from services.shards import get_user_db, current_user_id
 
 profile_router = APIRouter(prefix="/profile", tags=["profile"])
 stats_router = APIRouter(prefix="/stats", tags=["stats"])
@@ -45,16 +51,16 @@ def profile_to_dict(u: UserProfile) -> dict:
 
 
 @profile_router.get("/")
-def get_profile(db: Session = Depends(get_db)):
-    user = db.query(UserProfile).filter(UserProfile.id == 1).first()
+def get_profile(db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    user = db.query(UserProfile).filter(UserProfile.id == user_id).first()
     if not user:
         raise HTTPException(404, "Profile not found")
     return profile_to_dict(user)
 
 
 @profile_router.patch("/")
-def update_profile(updates: ProfileUpdate, db: Session = Depends(get_db)):
-    user = db.query(UserProfile).filter(UserProfile.id == 1).first()
+def update_profile(updates: ProfileUpdate, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    user = db.query(UserProfile).filter(UserProfile.id == user_id).first()
     if not user:
         raise HTTPException(404, "Profile not found")
     for field, value in updates.dict(exclude_none=True).items():
@@ -65,14 +71,22 @@ def update_profile(updates: ProfileUpdate, db: Session = Depends(get_db)):
 
 
 @profile_router.get("/memories")
-def get_memories(db: Session = Depends(get_db)):
-    mems = db.query(AIMemory).filter(AIMemory.user_id == 1).all()
+def get_memories(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    query = db.query(AIMemory).filter(AIMemory.user_id == user_id)
+    mems = keyset_page(query, AIMemory, limit, before, after, response=response)
     return [{"id": m.id, "key": m.key, "value": m.value, "type": m.memory_type} for m in mems]
 
 
 @profile_router.delete("/memories/{mem_id}")
-def delete_memory(mem_id: int, db: Session = Depends(get_db)):
-    mem = db.query(AIMemory).filter(AIMemory.id == mem_id, AIMemory.user_id == 1).first()
+def delete_memory(mem_id: int, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    mem = db.query(AIMemory).filter(AIMemory.id == mem_id, AIMemory.user_id == user_id).first()
     if not mem:
         raise HTTPException(404, "Memory not found")
     db.delete(mem)
@@ -82,55 +96,34 @@ def delete_memory(mem_id: int, db: Session = Depends(get_db)):
 
 # ─── STATISTICS ──────────────────────────────────────────────────────────────
 
-def calculate_streak(db: Session, user_id: int) -> int:
-    # Запрашиваем статистику за последние 90 дней одним махом
-    cutoff = date.today() - timedelta(days=90)
-    stats = db.query(DailyStats).filter(
-        DailyStats.user_id == user_id,
-        DailyStats.date >= str(cutoff)
-    ).order_by(DailyStats.date.desc()).all()
-
-    streak = 0
-    check_date = date.today()
-    
-    # Превращаем в словарь для быстрого поиска
-    stats_dict = {s.date: s.all_done for s in stats}
-    
-    while stats_dict.get(str(check_date)):
-        streak += 1
-        check_date -= timedelta(days=1)
-    return streak
-
 @stats_router.get("/overview")
-def get_overview(db: Session = Depends(get_db)):
-    user_id = 1
-    all_tasks = db.query(Task).filter(Task.user_id == user_id).all()
-    completed = [t for t in all_tasks if t.status == "completed"]
-    overdue_list = [t for t in all_tasks if t.status not in ("completed",) and t.deadline and t.deadline.date() < date.today()]
-
-    # Category breakdown
-    from collections import Counter
-    cat_counts = Counter(t.category for t in all_tasks)
-    prio_counts = Counter(t.priority for t in all_tasks)
+def get_overview(db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    counters = read_task_counters(db, user_id)
+    by_status = counters["status"]
+    total = sum(by_status.values())
+    completed = by_status.get("completed", 0)
+    # Просрочка — по единому правилу (range scan по открытым задачам, не по всей истории)
+    overdue_count = db.query(func.count(Task.id)).filter(Task.user_id == user_id, overdue_clause()).scalar()
 
-    streak = calculate_streak(db, user_id)
+    streak = read_streak(db, user_id)
 
     return {
-        "total_tasks": len(all_tasks),
-        "completed": len(completed),
-        "overdue": len(overdue_list),
-        "pending": len([t for t in all_tasks if t.status == "pending"]),
-        "completion_rate": round(len(completed) / len(all_tasks) * 100) if all_tasks else 0,
-        "streak_days": streak,
-        "by_category": dict(cat_counts),
-        "by_priority": dict(prio_counts),
+        "total_tasks": total,
+        "completed": completed,
+        "overdue": overdue_count,
+        "pending": by_status.get("pending", 0),
+        "completion_rate": round(completed / total * 100) if total else 0,
+        "streak_days": streak["current"],
+        "streak_start": streak["current_start"],
+        "longest_streak": streak["longest"],
+        "by_category": counters["category"],
+        "by_priority": counters["priority"],
     }
 
 
 @stats_router.get("/daily")
-def get_daily_stats(days: int = 30, db: Session = Depends(get_db)):
+def get_daily_stats(days: int = 30, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
     """Last N days of daily stats."""
-    user_id = 1
     cutoff = date.today() - timedelta(days=days)
     stats = (
         db.query(DailyStats)
@@ -153,14 +146,35 @@ def get_daily_stats(days: int = 30, db: Session = Depends(get_db)):
     ]
 
 
+@stats_router.post("/backfill")
+def backfill_stats(
+    date_from: date = Query(..., alias="from"),
+    date_to: Optional[date] = Query(None, alias="to", description="Включительно; по умолчанию — сегодня"),
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    """Пересчёт DailyStats за диапазон (то же, что python -m services.stats_backfill)."""
+    start = date_from
+    end = date_to or date.today()
+    if end < start:
+        raise HTTPException(400, "'to' must not be before 'from'")
+    if (end - start).days > 366 * 10:
+        raise HTTPException(400, "Range is limited to ten years")
+    return backfill_daily_stats(db, start, end, user_id=user_id)
+
+
 @stats_router.get("/heatmap")
-def get_heatmap(year: int = None, db: Session = Depends(get_db)):
+def get_heatmap(year: int = None, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
     """GitHub-style heatmap data for a year."""
     if not year:
         year = date.today().year
     stats = (
         db.query(DailyStats)
-        .filter(DailyStats.user_id == 1, DailyStats.date.startswith(str(year)))
+        .filter(
+            DailyStats.user_id == user_id,
+            DailyStats.date >= f"{year}-01-01",
+            DailyStats.date < f"{year + 1}-01-01",
+        )
         .all()
     )
     return {
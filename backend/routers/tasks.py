@@ -1,11 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, func
 from datetime import datetime, date, timedelta
 from typing import Optional, List
+import asyncio
+import json
 from pydantic import BaseModel
-from database import get_db, Task, DailyStats
-from services.load_analyzer import update_daily_stats, generate_tips, get_overdue_tasks, calculate_day_load
+from database import Task, TaskArchive, TaskOccurrence, DailyStats
+from services.load_analyzer import (
+    generate_tips, get_overdue_tasks, calculate_day_load, calculate_range_load,
+    apply_stats_delta, apply_stats_deltas, task_stats_snapshot, recompute_days,
+)
+from services.overdue_scheduler import overdue_scheduler
+from services.overdue_rule import is_past_due
+from services.pagination import keyset_page, copy_cursor_headers
+from services.changelog import record_task_changes, record_task_deletes, changes_since, current_version
+from services.events import event_broker
+from services.serialization import FastJSONResponse, rows_to_dicts
+from services.schedule_index import interval_index, free_slots, task_span, task_minutes
+from services.cache import derived_cache
+from services.rebalancer import propose_rebalance
+from services.shards import get_user_db, current_user_id, open_session
+from services.archive import task_source
+from services.recurrence import (
+    is_series, expand_series, occurrence_to_dict, find_occurrence_start, resolve_occurrence,
+)
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
@@ -39,45 +59,26 @@ class TaskUpdate(BaseModel):
     subtasks: Optional[List[dict]] = None
 
 
-def is_task_overdue(task: Task) -> bool:
-    """
-    Задача просрочена если:
-    - start_datetime + duration_minutes < сейчас, ИЛИ
-    - deadline < сейчас
-    И задача не выполнена.
-    """
-    if task.status == "completed":
-        return False
+class TaskBulkUpdate(TaskUpdate):
+    id: int
 
-    now = datetime.now()
 
-    # Главное правило: начало + длительность уже прошли
-    if task.start_datetime and task.duration_minutes:
-        end_time = task.start_datetime + timedelta(minutes=task.duration_minutes)
-        if end_time < now:
-            return True
+class TaskPostpone(BaseModel):
+    id: int
+    new_date: str
 
-    # Дедлайн прошёл
-    if task.deadline and task.deadline < now:
-        return True
 
-    return False
+class OccurrenceUpdate(BaseModel):
+    status: Optional[str] = None
+    start_datetime: Optional[datetime] = None
+    skipped: Optional[bool] = None
 
 
-def auto_update_status(task: Task) -> bool:
-    """Обновляет статус задачи если она просрочена. Возвращает True если изменился."""
-    if task.status in ("completed", "postponed"):
-        return False
-    if is_task_overdue(task):
-        if task.status != "overdue":
-            task.status = "overdue"
-            return True
-    else:
-        # Если задача была overdue но теперь нет (например перенесли) — вернуть pending
-        if task.status == "overdue":
-            task.status = "pending"
-            return True
-    return False
+class TaskBulkPatch(BaseModel):
+    update: List[TaskBulkUpdate] = []
+    complete: List[int] = []
+    postpone: List[TaskPostpone] = []
+    delete: List[int] = []
 
 
 def task_to_dict(t: Task) -> dict:
@@ -103,21 +104,28 @@ def task_to_dict(t: Task) -> dict:
     }
 
 
-# ─── ENDPOINTS ────────────────────────────────────────────────────────────────
+# Колонки, которые отдаёт task_to_dict — для column-projected списков
+# (без attached_files и служебных полей, без гидрации ORM-объектов)
+TASK_COLUMNS = (
+    Task.id, Task.title, Task.description, Task.category, Task.priority, Task.status,
+    Task.duration_minutes, Task.start_datetime, Task.end_datetime, Task.deadline,
+    Task.urgency_score, Task.ai_generated, Task.ai_notes, Task.subtasks,
+    Task.is_recurring, Task.recurrence_rule, Task.completed_at, Task.created_at,
+)
+
+
+def task_columns(model=Task) -> tuple:
+    """TASK_COLUMNS той же модели или псевдомодели с архивом (services/archive.task_source)."""
+    return TASK_COLUMNS if model is Task else tuple(getattr(model, c.key) for c in TASK_COLUMNS)
 
-@router.get("/")
-def get_tasks(
-    view: str = Query("day"),
-    date_str: Optional[str] = Query(None),
-    category: Optional[str] = None,
-    status: Optional[str] = None,
-    db: Session = Depends(get_db),
-):
-    user_id = 1
-    target_date = date.fromisoformat(date_str) if date_str else date.today()
-    today_start = datetime.combine(date.today(), datetime.min.time())
 
-    # Build date range for the view
+def task_rows_to_dicts(rows) -> list[dict]:
+    """То же, что task_to_dict, но для Row из запроса по TASK_COLUMNS."""
+    return rows_to_dicts(rows, defaults={"subtasks": []})
+
+
+def view_range(view: str, target_date: date) -> tuple[datetime, datetime]:
+    """Build date range [start, end) for the calendar view."""
     if view == "day":
         start = datetime.combine(target_date, datetime.min.time())
         end = start + timedelta(days=1)
@@ -137,116 +145,315 @@ def get_tasks(
     else:
         start = datetime.combine(target_date, datetime.min.time())
         end = start + timedelta(days=1)
+    return start, end
+
+
+def task_in_view(t: Task, start: datetime, end: datetime) -> bool:
+    """Попадает ли задача в выдачу GET /tasks/ для окна [start, end)."""
+    if t.start_datetime:
+        return start <= t.start_datetime < end or t.status == "overdue"
+    if t.deadline:
+        return start <= t.deadline < end or t.status == "overdue"
+    return t.status != "completed"
+
 
-    base_query = db.query(Task).filter(Task.user_id == user_id)
+def render_feed_events(events: list, start: datetime, end: datetime, user_id: int) -> list:
+    """
+    Готовит пачку событий для подписчика: подставляет актуальные задачи
+    (один IN-запрос), задачи вне окна превращает в evict, статистику фильтрует по окну.
+    """
+    latest = {}
+    for e in events:
+        if e["type"] == "task":
+            latest[e["id"]] = e
+    upsert_ids = [tid for tid, e in latest.items() if e["op"] == "upsert"]
+
+    tasks = {}
+    if upsert_ids:
+        db = open_session(user_id)
+        try:
+            tasks = {t.id: t for t in db.query(Task).filter(Task.user_id == user_id, Task.id.in_(upsert_ids))}
+            rendered = {tid: task_to_dict(t) for tid, t in tasks.items()}
+        finally:
+            db.close()
+
+    out = []
+    for tid, e in latest.items():
+        if e["op"] == "delete":
+            out.append(e)
+        elif tid in tasks:
+            if task_in_view(tasks[tid], start, end):
+                out.append({**e, "task": rendered[tid]})
+            else:
+                out.append({**e, "op": "evict"})
+    for e in events:
+        if e["type"] == "stats":
+            if start.date() <= date.fromisoformat(e["date"]) < end.date():
+                out.append(e)
+        elif e["type"] != "task" and e not in out:
+            out.append(e)
+    return out
+
+
+def summarize_window(db: Session, user_id: int, start: datetime, end: datetime,
+                     category: Optional[str] = None, status: Optional[str] = None,
+                     include_archived: bool = False) -> list[dict]:
+    """
+    Компактные дневные корзины для сетки месяца/года: один GROUP BY по
+    (день, статус, приоритет) вместо полных задач. День задачи — как в get_tasks:
+    start_datetime, а без него — deadline. Вхождения серий добавляются поверх.
+    include_archived — считать и выполненные задачи из архива.
+    """
+    T = task_source(include_archived)
+    day = func.date(func.coalesce(T.start_datetime, T.deadline)).label("day")
+    query = db.query(
+        day, T.status, T.priority,
+        func.count(T.id), func.sum(func.coalesce(T.duration_minutes, 30)),
+    ).filter(
+        T.user_id == user_id,
+        or_(
+            and_(T.start_datetime >= start, T.start_datetime < end),
+            and_(T.start_datetime.is_(None), T.deadline >= start, T.deadline < end),
+        ),
+        # серии считаются по вхождениям ниже
+        or_(T.is_recurring.isnot(True), T.recurrence_rule.is_(None)),
+    )
     if category:
-        base_query = base_query.filter(Task.category == category)
+        query = query.filter(T.category == category)
     if status:
-        base_query = base_query.filter(Task.status == status)
+        query = query.filter(T.status == status)
+    rows = query.group_by(day, T.status, T.priority).all()
+
+    for occ in expand_series(db, user_id, start, end, category=category):
+        if not status or occ.status == status:
+            rows.append((str(occ.start_datetime.date()), occ.status, occ.task.priority,
+                         1, occ.task.duration_minutes or 30))
+
+    buckets = {}
+    for day_str, task_status, priority, count, minutes in rows:
+        b = buckets.setdefault(str(day_str), {
+            "date": str(day_str), "total": 0, "by_status": {}, "by_priority": {},
+            "planned_minutes": 0, "has_overdue": False,
+        })
+        b["total"] += count
+        b["by_status"][task_status] = b["by_status"].get(task_status, 0) + count
+        b["by_priority"][priority] = b["by_priority"].get(priority, 0) + count
+        b["planned_minutes"] += int(minutes or 0)
+        b["has_overdue"] = b["has_overdue"] or task_status == "overdue"
+    return [buckets[k] for k in sorted(buckets)]
 
-    all_tasks = base_query.all()
 
-    # Автоматически обновляем статусы просроченных задач
-    changed = False
-    for task in all_tasks:
-        if auto_update_status(task):
-            task.updated_at = datetime.now()
-            changed = True
-    if changed:
-        db.commit()
+# ─── ENDPOINTS ────────────────────────────────────────────────────────────────
 
-    # 1. Tasks that START within the period
+def tasks_view(
+    db: Session,
+    user_id: int,
+    view: str,
+    target_date: date,
+    category: Optional[str] = None,
+    status: Optional[str] = None,
+    include_archived: bool = False,
+) -> dict:
+    """Тело GET /tasks/ без summary — обычная функция без Query/Depends (её зовут и бенчмарки)."""
+    start, end = view_range(view, target_date)
+
+    def filtered(model):
+        query = db.query(*task_columns(model)).filter(model.user_id == user_id)
+        if category:
+            query = query.filter(model.category == category)
+        if status:
+            query = query.filter(model.status == status)
+        return query
+
+    base_query = filtered(Task)
+    # Окно периода может захватить архив; просроченные и undated в архиве не бывают
+    T = task_source(include_archived)
+    window_query = filtered(T) if include_archived else base_query
+
+    # 1. Tasks that START within the period (серии разворачиваются отдельно, ниже)
     in_period = [
-        t for t in all_tasks
-        if t.start_datetime and start <= t.start_datetime < end
+        t for t in window_query.filter(
+            T.start_datetime >= start,
+            T.start_datetime < end,
+        ).all()
+        if not is_series(t)
     ]
 
     # 2. Tasks with deadline in period but no start_datetime
-    deadline_only = [
-        t for t in all_tasks
-        if t.deadline
-        and not t.start_datetime
-        and start <= t.deadline < end
-    ]
+    deadline_only = window_query.filter(
+        T.start_datetime.is_(None),
+        T.deadline >= start,
+        T.deadline < end,
+    ).all()
 
     # 3. Overdue tasks not already in period — показываем в текущем виде
     in_period_ids = {t.id for t in in_period} | {t.id for t in deadline_only}
     overdue_floating = [
-        t for t in all_tasks
-        if t.status == "overdue"
-        and t.id not in in_period_ids
+        t for t in base_query.filter(Task.status == "overdue").all()
+        if t.id not in in_period_ids and not is_series(t)
     ]
 
     # Combine scheduled tasks
-    scheduled_ids = in_period_ids | {t.id for t in overdue_floating}
-    scheduled = in_period + deadline_only + overdue_floating
+    scheduled = task_rows_to_dicts(in_period + deadline_only + overdue_floating)
 
-    # 4. Undated tasks: no start_datetime, no deadline, not completed
-    undated = [
-        t for t in all_tasks
-        if not t.start_datetime
-        and not t.deadline
-        and t.status not in ("completed",)
-        and t.id not in scheduled_ids
+    # Вхождения повторяющихся задач — генерируются только внутри окна
+    occurrences = [
+        occ for occ in expand_series(db, user_id, start, end, category=category)
+        if not status or occ.status == status
     ]
+    series = {occ.task.id: task_to_dict(occ.task) for occ in occurrences}
+    scheduled += [occurrence_to_dict(occ, series[occ.task.id]) for occ in occurrences]
+
+    # 4. Undated tasks: no start_datetime, no deadline, not completed
+    #    (просроченные без дат уже попали в overdue_floating)
+    undated = base_query.filter(
+        Task.start_datetime.is_(None),
+        Task.deadline.is_(None),
+        Task.status.notin_(("completed", "overdue")),
+    ).all()
 
     scheduled.sort(key=lambda t: (
-        t.start_datetime or t.deadline or datetime.max
+        t["start_datetime"] or t["deadline"] or datetime.max
     ))
 
     return {
-        "tasks": [task_to_dict(t) for t in scheduled],
-        "undated": [task_to_dict(t) for t in undated],
+        "tasks": scheduled,
+        "undated": task_rows_to_dicts(undated),
         "view": view,
         "date": str(target_date),
     }
 
 
+@router.get("/")
+def get_tasks(
+    view: str = Query("day"),
+    date_str: Optional[str] = Query(None),
+    category: Optional[str] = None,
+    status: Optional[str] = None,
+    summary: bool = Query(False, description="Только дневные корзины (для month/year)"),
+    include_archived: bool = Query(False, description="Добавить выполненные задачи из архива"),
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    target_date = date.fromisoformat(date_str) if date_str else date.today()
+
+    if summary:
+        start, end = view_range(view, target_date)
+        return FastJSONResponse({
+            "days": summarize_window(db, user_id, start, end, category, status, include_archived),
+            "view": view,
+            "date": str(target_date),
+        })
+    return FastJSONResponse(tasks_view(db, user_id, view, target_date, category, status, include_archived))
+
+
 @router.get("/undated")
-def get_undated(db: Session = Depends(get_db)):
-    tasks = db.query(Task).filter(
-        Task.user_id == 1,
+def get_undated(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    query = db.query(*TASK_COLUMNS).filter(
+        Task.user_id == user_id,
         Task.start_datetime.is_(None),
         Task.deadline.is_(None),
         Task.status != "completed",
-    ).order_by(Task.created_at.desc()).all()
-    return [task_to_dict(t) for t in tasks]
+    )
+    rows = keyset_page(query, Task, limit, before, after, newest_first=True, response=response)
+    return copy_cursor_headers(response, FastJSONResponse(task_rows_to_dicts(rows)))
 
 
 @router.get("/unsorted")
-def get_unsorted(db: Session = Depends(get_db)):
-    tasks = db.query(Task).filter(
-        Task.user_id == 1,
+def get_unsorted(db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    rows = db.query(*TASK_COLUMNS).filter(
+        Task.user_id == user_id,
         Task.category == "unsorted",
         Task.status != "completed",
     ).all()
-    return [task_to_dict(t) for t in tasks]
+    return FastJSONResponse(task_rows_to_dicts(rows))
 
 
 @router.get("/overdue")
-def get_overdue(db: Session = Depends(get_db)):
-    tasks = get_overdue_tasks(db, user_id=1)
+def get_overdue(db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    tasks = get_overdue_tasks(db, user_id=user_id)
     return [task_to_dict(t) for t in tasks]
 
 
 @router.get("/tips")
-def get_tips(db: Session = Depends(get_db)):
-    tips = generate_tips(db, user_id=1)
-    today = date.today()
-    load = calculate_day_load(db, today, user_id=1)
-    return {"tips": tips, "load": load}
+def get_tips(db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    def compute():
+        load = calculate_day_load(db, date.today(), user_id=user_id)
+        return {"tips": generate_tips(db, user_id=user_id, load=load), "load": load}
+    return derived_cache.get_or_compute(db, user_id, ("tips",), compute)
+
+
+@router.get("/load")
+def get_load_range(
+    date_from: str = Query(..., alias="from"),
+    date_to: str = Query(..., alias="to", description="Включительно"),
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    if end < start:
+        raise HTTPException(400, "'to' must not be before 'from'")
+    if (end - start).days > 366:
+        raise HTTPException(400, "Range is limited to one year")
+    return derived_cache.get_or_compute(db, user_id, ("load", start, end), lambda: calculate_range_load(db, start, end, user_id=user_id))
 
 
 @router.get("/load/{date_str}")
-def get_load(date_str: str, db: Session = Depends(get_db)):
+def get_load(date_str: str, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
     target = date.fromisoformat(date_str)
-    return calculate_day_load(db, target, user_id=1)
+    return derived_cache.get_or_compute(db, user_id, ("load", target), lambda: calculate_day_load(db, target, user_id=user_id))
 
 
-@router.post("/")
-def create_task(task_in: TaskCreate, db: Session = Depends(get_db)):
+@router.get("/conflicts")
+def get_conflicts(
+    date_from: Optional[str] = Query(None, description="По умолчанию — сегодня"),
+    date_to: Optional[str] = Query(None, description="Не включительно; по умолчанию — +30 дней"),
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    """
+    Пересекающиеся по времени открытые задачи и вхождения серий. occurrence_dates —
+    параллельно task_ids: дата вхождения серии или null для обычной задачи.
+    """
+    start = datetime.combine(date.fromisoformat(date_from) if date_from else date.today(), datetime.min.time())
+    end = datetime.combine(date.fromisoformat(date_to), datetime.min.time()) if date_to else start + timedelta(days=30)
+    if end <= start:
+        raise HTTPException(400, "date_to must be after date_from")
+
+    pairs = interval_index.conflicts(db, user_id, start, end)
+    ids = {key[0] for a, b, _, _ in pairs for key in (a, b)}
+    rows = db.query(*TASK_COLUMNS).filter(Task.user_id == user_id, Task.id.in_(ids)).all() if ids else []
+    return FastJSONResponse({
+        "conflicts": [
+            {"task_ids": [a[0], b[0]], "occurrence_dates": [a[1] or None, b[1] or None],
+             "start": s, "end": e, "minutes": int((e - s).total_seconds() // 60)}
+            for a, b, s, e in pairs
+        ],
+        "tasks": task_rows_to_dicts(rows),
+    })
+
+
+@router.get("/free-slots")
+def get_free_slots(
+    date_str: Optional[str] = Query(None, alias="date"),
+    min_minutes: int = Query(30, ge=5, le=24 * 60),
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    target = date.fromisoformat(date_str) if date_str else date.today()
+    return FastJSONResponse(free_slots(db, target, min_minutes, user_id=user_id))
+
+
+def build_task(task_in: TaskCreate, user_id: int) -> Task:
     task = Task(
-        user_id=1,
+        user_id=user_id,
         title=task_in.title,
         description=task_in.description,
         category=task_in.category,
@@ -267,80 +474,317 @@ def create_task(task_in: TaskCreate, db: Session = Depends(get_db)):
         task.end_datetime = task.start_datetime + timedelta(minutes=task_in.duration_minutes)
 
     # Проверяем сразу при создании
-    task.status = "overdue" if is_task_overdue(task) else "pending"
+    task.status = "overdue" if is_past_due(task) else "pending"
+    return task
+
+
+def apply_task_update(task: Task, updates: TaskUpdate):
+    for field, value in updates.dict(exclude_none=True, exclude={"id"}).items():
+        setattr(task, field, value)
+
+    # Если статус явно не передан — пересчитываем автоматически
+    if updates.status is None:
+        task.status = "overdue" if is_past_due(task) else (task.status if task.status != "overdue" else "pending")
+    elif updates.status in ("pending", "in_progress"):
+        task.completed_at = None
+
+    task.updated_at = datetime.now()
+
+
+def mark_completed(task: Task):
+    task.status = "completed"
+    task.completed_at = datetime.now()
+    task.updated_at = datetime.now()
 
+
+def postpone(task: Task, new_dt: datetime):
+    if task.start_datetime:
+        duration = task.duration_minutes or 60
+        task.start_datetime = new_dt
+        task.end_datetime = new_dt + timedelta(minutes=duration)
+    if task.deadline:
+        task.deadline = new_dt
+    task.status = "postponed"
+    task.updated_at = datetime.now()
+
+
+def load_tasks(db: Session, task_ids, user_id: int) -> dict:
+    """Загружает задачи одним IN-запросом; 404 если хотя бы одной нет."""
+    ids = set(task_ids)
+    if not ids:
+        return {}
+    tasks = {t.id: t for t in db.query(Task).filter(Task.id.in_(ids), Task.user_id == user_id).all()}
+    missing = ids - tasks.keys()
+    if missing:
+        raise HTTPException(404, f"Tasks not found: {sorted(missing)}")
+    return tasks
+
+
+@router.post("/")
+def create_task(task_in: TaskCreate, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    task = build_task(task_in, user_id)
     db.add(task)
+    apply_stats_delta(db, None, task_stats_snapshot(task), user_id=user_id)
+    record_task_changes(db, [task], user_id=user_id)
     db.commit()
     db.refresh(task)
-    update_daily_stats(db, user_id=1)
+    overdue_scheduler.schedule(task)
     return task_to_dict(task)
 
 
+@router.post("/bulk")
+def create_tasks_bulk(tasks_in: List[TaskCreate], db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    """Создаёт пачку задач в одной транзакции."""
+    tasks = [build_task(t, user_id) for t in tasks_in]
+    db.add_all(tasks)
+    apply_stats_deltas(db, [(None, task_stats_snapshot(t)) for t in tasks], user_id=user_id)
+    record_task_changes(db, tasks, user_id=user_id)
+    # Объекты уже актуальны — не перечитываем каждую задачу после коммита
+    db.expire_on_commit = False
+    db.commit()
+    for task in tasks:
+        overdue_scheduler.schedule(task)
+    return [task_to_dict(t) for t in tasks]
+
+
+@router.patch("/bulk")
+def patch_tasks_bulk(batch: TaskBulkPatch, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    """
+    Пакетные update / complete / postpone / delete в одной транзакции
+    с одним обновлением DailyStats. Если хоть одной задачи нет — не применяется ничего.
+    """
+    postpone_dates = {p.id: datetime.fromisoformat(p.new_date) for p in batch.postpone}
+    tasks = load_tasks(
+        db,
+        [u.id for u in batch.update] + batch.complete + list(postpone_dates) + batch.delete,
+        user_id=user_id,
+    )
+    before = {tid: task_stats_snapshot(t) for tid, t in tasks.items()}
+
+    for upd in batch.update:
+        apply_task_update(tasks[upd.id], upd)
+    for tid in batch.complete:
+        mark_completed(tasks[tid])
+    for tid, new_dt in postpone_dates.items():
+        postpone(tasks[tid], new_dt)
+
+    deleted = set(batch.delete)
+    for tid in deleted:
+        db.delete(tasks[tid])
+
+    apply_stats_deltas(
+        db,
+        [(before[tid], None if tid in deleted else task_stats_snapshot(t)) for tid, t in tasks.items()],
+        user_id=user_id,
+    )
+    kept = [t for tid, t in tasks.items() if tid not in deleted]
+    record_task_changes(db, kept, user_id=user_id)
+    record_task_deletes(db, sorted(deleted), user_id=user_id)
+    db.expire_on_commit = False
+    db.commit()
+
+    for task in kept:
+        overdue_scheduler.schedule(task)
+    return {
+        "tasks": [task_to_dict(t) for t in kept],
+        "deleted": sorted(deleted),
+    }
+
+
+@router.post("/rebalance")
+def rebalance_tasks(
+    date_from: Optional[str] = Query(None, alias="from", description="По умолчанию — сегодня"),
+    date_to: Optional[str] = Query(None, alias="to", description="Включительно; по умолчанию — +6 дней"),
+    apply: bool = Query(False, description="false — только предложить план"),
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    """
+    Разгружает перегруженные дни и переставляет просроченные задачи в свободное
+    время (services/rebalancer.py). Без apply возвращает план; с apply=true
+    применяет все переносы одной транзакцией.
+    """
+    start = date.fromisoformat(date_from) if date_from else date.today()
+    end = date.fromisoformat(date_to) if date_to else start + timedelta(days=6)
+    if end < start:
+        raise HTTPException(400, "'to' must not be before 'from'")
+    if (end - start).days > 92:
+        raise HTTPException(400, "Range is limited to 93 days")
+
+    plan = propose_rebalance(db, start, end, user_id=user_id)
+    moves = [
+        {
+            "id": t.id, "title": t.title, "priority": t.priority, "reason": reason,
+            "from": t.start_datetime, "to": new_start, "minutes": task_minutes(t),
+        }
+        for t, new_start, reason in plan["moves"]
+    ]
+
+    if apply and plan["moves"]:
+        pairs = []
+        for task, new_start, _ in plan["moves"]:
+            before = task_stats_snapshot(task)
+            # Та же длина, под которую планировщик резервировал промежуток
+            span = task_span(task)
+            if task.end_datetime:
+                task.end_datetime = new_start + span
+            task.start_datetime = new_start
+            task.status = "overdue" if is_past_due(task) else "pending"
+            task.updated_at = datetime.now()
+            pairs.append((before, task_stats_snapshot(task)))
+        moved = [t for t, _, _ in plan["moves"]]
+        apply_stats_deltas(db, pairs, user_id=user_id)
+        record_task_changes(db, moved, user_id=user_id)
+        db.expire_on_commit = False
+        db.commit()
+        for task in moved:
+            overdue_scheduler.schedule(task)
+
+    return FastJSONResponse({
+        "applied": bool(apply and plan["moves"]),
+        "moves": moves,
+        "unplaced": [{"id": t.id, "title": t.title} for t in plan["unplaced"]],
+        "days": [
+            {"date": str(d.day), "max_minutes": d.limit,
+             "planned_before": d.planned_before, "planned_after": d.planned_after}
+            for d in sorted(plan["days"].values(), key=lambda d: d.day)
+        ],
+    })
+
+
+@router.get("/changes")
+def get_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=5000),
+    db: Session = Depends(get_user_db),
+    user_id: int = Depends(current_user_id),
+):
+    """
+    Дельта-синхронизация. since=0 — полный снимок задач и текущая версия;
+    дальше клиент передаёт полученную version и забирает только изменения.
+    """
+    if since == 0:
+        version = current_version(db, user_id=user_id)
+        tasks = db.query(Task).filter(Task.user_id == user_id).all()
+        return {"version": version, "tasks": [task_to_dict(t) for t in tasks], "deleted": [], "has_more": False}
+
+    changes = changes_since(db, since, user_id=user_id, limit=limit)
+    changes["tasks"] = [task_to_dict(t) for t in changes["tasks"]]
+    return changes
+
+
 @router.get("/{task_id}")
-def get_task(task_id: int, db: Session = Depends(get_db)):
-    task = db.query(Task).filter(Task.id == task_id, Task.user_id == 1).first()
+def get_task(task_id: int, include_archived: bool = False,
+             db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    task = db.query(Task).filter(Task.id == task_id, Task.user_id == user_id).first()
+    if not task and include_archived:
+        task = db.query(TaskArchive).filter(TaskArchive.id == task_id, TaskArchive.user_id == user_id).first()
     if not task:
         raise HTTPException(404, "Task not found")
     return task_to_dict(task)
 
 
 @router.patch("/{task_id}")
-def update_task(task_id: int, updates: TaskUpdate, db: Session = Depends(get_db)):
-    task = db.query(Task).filter(Task.id == task_id, Task.user_id == 1).first()
+def update_task(task_id: int, updates: TaskUpdate, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    task = db.query(Task).filter(Task.id == task_id, Task.user_id == user_id).first()
     if not task:
         raise HTTPException(404, "Task not found")
-
-    for field, value in updates.dict(exclude_none=True).items():
-        setattr(task, field, value)
-
-    # Если статус явно не передан — пересчитываем автоматически
-    if updates.status is None:
-        task.status = "overdue" if is_task_overdue(task) else (task.status if task.status != "overdue" else "pending")
-    elif updates.status in ("pending", "in_progress"):
-        task.completed_at = None
-
-    task.updated_at = datetime.now()
+    before = task_stats_snapshot(task)
+    apply_task_update(task, updates)
+    apply_stats_delta(db, before, task_stats_snapshot(task), user_id=user_id)
+    record_task_changes(db, [task], user_id=user_id)
     db.commit()
     db.refresh(task)
-    update_daily_stats(db, user_id=1)
+    overdue_scheduler.schedule(task)
     return task_to_dict(task)
 
 
 @router.post("/{task_id}/complete")
-def complete_task(task_id: int, db: Session = Depends(get_db)):
-    task = db.query(Task).filter(Task.id == task_id, Task.user_id == 1).first()
+def complete_task(task_id: int, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    task = db.query(Task).filter(Task.id == task_id, Task.user_id == user_id).first()
     if not task:
         raise HTTPException(404, "Task not found")
-    task.status = "completed"
-    task.completed_at = datetime.now()
-    task.updated_at = datetime.now()
+    before = task_stats_snapshot(task)
+    mark_completed(task)
+    apply_stats_delta(db, before, task_stats_snapshot(task), user_id=user_id)
+    record_task_changes(db, [task], user_id=user_id)
     db.commit()
-    update_daily_stats(db, user_id=1)
     return {"ok": True, "task_id": task_id}
 
 
 @router.post("/{task_id}/postpone")
-def postpone_task(task_id: int, new_date: str, db: Session = Depends(get_db)):
-    task = db.query(Task).filter(Task.id == task_id, Task.user_id == 1).first()
+def postpone_task(task_id: int, new_date: str, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    task = db.query(Task).filter(Task.id == task_id, Task.user_id == user_id).first()
     if not task:
         raise HTTPException(404, "Task not found")
-    new_dt = datetime.fromisoformat(new_date)
-    if task.start_datetime:
-        duration = task.duration_minutes or 60
-        task.start_datetime = new_dt
-        task.end_datetime = new_dt + timedelta(minutes=duration)
-    if task.deadline:
-        task.deadline = new_dt
-    task.status = "postponed"
-    task.updated_at = datetime.now()
+    before = task_stats_snapshot(task)
+    postpone(task, datetime.fromisoformat(new_date))
+    apply_stats_delta(db, before, task_stats_snapshot(task), user_id=user_id)
+    record_task_changes(db, [task], user_id=user_id)
     db.commit()
-    update_daily_stats(db, user_id=1)
     return task_to_dict(task)
 
 
+def update_occurrence_override(db: Session, task_id: int, occurrence_date: str, updates: OccurrenceUpdate,
+                               user_id: int) -> dict:
+    """Создаёт/меняет разреженное переопределение одного вхождения серии."""
+    task = db.query(Task).filter(Task.id == task_id, Task.user_id == user_id).first()
+    if not task:
+        raise HTTPException(404, "Task not found")
+    if not is_series(task):
+        raise HTTPException(400, "Task is not recurring")
+    try:
+        occ_start = find_occurrence_start(task, date.fromisoformat(occurrence_date))
+    except ValueError:
+        raise HTTPException(400, "Invalid occurrence date")
+    if occ_start is None:
+        raise HTTPException(404, "Occurrence not found")
+
+    ov = db.query(TaskOccurrence).filter(
+        TaskOccurrence.task_id == task_id,
+        TaskOccurrence.occurrence_date == occurrence_date,
+    ).first()
+    if not ov:
+        ov = TaskOccurrence(task_id=task_id, user_id=user_id, occurrence_date=occurrence_date)
+        db.add(ov)
+    old_day = str((ov.start_datetime or occ_start).date())
+
+    for field, value in updates.dict(exclude_none=True).items():
+        setattr(ov, field, value)
+    if updates.status == "completed" and not ov.completed_at:
+        ov.completed_at = datetime.now()
+    elif updates.status in ("pending", "in_progress"):
+        ov.completed_at = None
+    ov.updated_at = datetime.now()
+
+    recompute_days(db, user_id, {old_day, str((ov.start_datetime or occ_start).date())})
+    record_task_changes(db, [task], user_id=user_id)
+    db.commit()
+
+    occ = resolve_occurrence(task, occ_start, ov)
+    if occ is None:
+        return {"ok": True, "skipped": True}
+    return occurrence_to_dict(occ, task_to_dict(task))
+
+
+@router.patch("/{task_id}/occurrences/{occurrence_date}")
+def update_occurrence(task_id: int, occurrence_date: str, updates: OccurrenceUpdate,
+                      db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    """Перенос / статус / пропуск одного вхождения повторяющейся задачи."""
+    return FastJSONResponse(update_occurrence_override(db, task_id, occurrence_date, updates, user_id))
+
+
+@router.post("/{task_id}/occurrences/{occurrence_date}/complete")
+def complete_occurrence(task_id: int, occurrence_date: str,
+                        db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    return FastJSONResponse(
+        update_occurrence_override(db, task_id, occurrence_date, OccurrenceUpdate(status="completed"), user_id)
+    )
+
+
 @router.patch("/{task_id}/subtasks/{sub_idx}")
-def toggle_subtask(task_id: int, sub_idx: int, db: Session = Depends(get_db)):
-    task = db.query(Task).filter(Task.id == task_id, Task.user_id == 1).first()
+def toggle_subtask(task_id: int, sub_idx: int, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    task = db.query(Task).filter(Task.id == task_id, Task.user_id == user_id).first()
     if not task:
         raise HTTPException(404, "Task not found")
     subs = list(task.subtasks or [])
@@ -349,16 +793,63 @@ def toggle_subtask(task_id: int, sub_idx: int, db: Session = Depends(get_db)):
     subs[sub_idx]["done"] = not subs[sub_idx]["done"]
     task.subtasks = subs
     task.updated_at = datetime.now()
+    record_task_changes(db, [task], user_id=user_id)
     db.commit()
     return task_to_dict(task)
 
 
 @router.delete("/{task_id}")
-def delete_task(task_id: int, db: Session = Depends(get_db)):
-    task = db.query(Task).filter(Task.id == task_id, Task.user_id == 1).first()
+def delete_task(task_id: int, db: Session = Depends(get_user_db), user_id: int = Depends(current_user_id)):
+    task = db.query(Task).filter(Task.id == task_id, Task.user_id == user_id).first()
     if not task:
         raise HTTPException(404, "Task not found")
+    before = task_stats_snapshot(task)
     db.delete(task)
+    apply_stats_delta(db, before, None, user_id=user_id)
+    record_task_deletes(db, [task_id], user_id=user_id)
     db.commit()
-    update_daily_stats(db, user_id=1)
-    return {"ok": True}
\ No newline at end of file
+    return {"ok": True}
+
+@router.websocket("/ws")
+async def task_feed(websocket: WebSocket, view: str = "day", date_str: Optional[str] = None,
+                    user_id: int = Depends(current_user_id)):
+    """
+    Push-канал изменений задач, статистики и советов.
+    Окно подписки — как у GET /tasks/ (view + date_str); сменить его можно
+    сообщением {"view": "...", "date_str": "..."}.
+    """
+    await websocket.accept()
+    start, end = view_range(view, date.fromisoformat(date_str) if date_str else date.today())
+    sub = event_broker.subscribe(user_id=user_id)
+    await websocket.send_text(json.dumps({"events": [
+        {"type": "subscribed", "from": start.isoformat(), "to": end.isoformat()},
+    ]}))
+
+    receiver = asyncio.ensure_future(websocket.receive_text())
+    batch = asyncio.ensure_future(sub.next_batch())
+    try:
+        while True:
+            done, _ = await asyncio.wait({receiver, batch}, return_when=asyncio.FIRST_COMPLETED)
+
+            if receiver in done:
+                try:
+                    payload = json.loads(receiver.result())
+                    target = date.fromisoformat(payload["date_str"]) if payload.get("date_str") else date.today()
+                    start, end = view_range(payload.get("view", view), target)
+                    ack = {"type": "subscribed", "from": start.isoformat(), "to": end.isoformat()}
+                except (json.JSONDecodeError, ValueError, AttributeError):
+                    ack = {"type": "error", "error": "Invalid subscription"}
+                await websocket.send_text(json.dumps({"events": [ack]}))
+                receiver = asyncio.ensure_future(websocket.receive_text())
+
+            if batch in done:
+                events = await run_in_threadpool(render_feed_events, batch.result(), start, end, user_id)
+                if events:
+                    await websocket.send_text(json.dumps({"events": events}))
+                batch = asyncio.ensure_future(sub.next_batch())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        batch.cancel()
+        event_broker.unsubscribe(sub)
@@ -1,14 +1,21 @@
 """
 AI Agent — TaskFlow. Supports Anthropic Claude + Ollama (Qwen, Llama, etc.)
 """
-import json, re, os
+import asyncio, json, re, os
 import httpx
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 load_dotenv()
 
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from database import Task, UserProfile, AIMemory, ChatMessage
+from database import Task, TaskOccurrence, UserProfile, AIMemory, ChatMessage
+from services.overdue_scheduler import overdue_scheduler
+from services.load_analyzer import apply_stats_deltas, task_stats_snapshot
+from services.changelog import record_task_changes, record_task_deletes
+from services.schedule_index import free_slots
+from services.overdue_rule import is_past_due
 
 
 # ─── MODEL BACKEND ────────────────────────────────────────────────────────────
@@ -104,6 +111,12 @@ def build_system_prompt(db: Session, user_id: int = 1) -> str:
     else:
         task_lines = "  (нет активных задач)\n"
 
+    slot_lines = ""
+    for day in (datetime.now().date(), datetime.now().date() + timedelta(days=1)):
+        slots = free_slots(db, day, min_minutes=30, user_id=user_id)["slots"]
+        spans = ", ".join(f'{s["start"]:%H:%M}-{s["end"]:%H:%M}' for s in slots) or "нет"
+        slot_lines += f"  {day}: {spans}\n"
+
     all_ids = [t["id"] for t in active]
     delete_example = json.dumps(all_ids) if all_ids else "[1, 2, 3]"
 
@@ -114,6 +127,7 @@ def build_system_prompt(db: Session, user_id: int = 1) -> str:
         f"Завтра: {tomorrow}\n\n"
         "ПРОФИЛЬ: " + json.dumps(user_ctx, ensure_ascii=False) + "\n\n"
         "АКТИВНЫЕ ЗАДАЧИ (используй эти ID):\n" + task_lines +
+        "\nСВОБОДНОЕ ВРЕМЯ (ставь новые задачи сюда):\n" + slot_lines +
         f"\nЕСЛИ ПОПРОСЯТ УДАЛИТЬ ВСЕ — используй tasks_to_delete: {delete_example}\n"
         "\nПАМЯТЬ: " + user_mem + "\n"
         "══════════════════════════\n"
@@ -173,47 +187,75 @@ def get_all_active_tasks(db: Session, user_id: int = 1) -> list:
     ]
 
 
-def get_chat_history(db: Session, user_id: int = 1, limit: int = 10) -> list:
-    msgs = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.user_id == user_id)
-        .order_by(ChatMessage.created_at.desc())
-        .limit(limit).all()
+def _history_query(user_id: int, limit: int):
+    return (
+        select(ChatMessage.role, ChatMessage.content)
+        .where(ChatMessage.user_id == user_id)
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(limit)
     )
-    msgs.reverse()
-    history = [{"role": m.role, "content": m.content} for m in msgs]
+
+
+def _history_from_rows(rows) -> list:
+    history = [{"role": r.role, "content": r.content} for r in reversed(rows)]
     while history and history[0]["role"] != "user":
         history.pop(0)
     return history
 
 
-def save_message(db: Session, role: str, content: str, user_id: int = 1,
-                 msg_type: str = "text", meta: dict = None) -> ChatMessage:
-    msg = ChatMessage(
-        user_id=user_id, role=role, content=content,
-        message_type=msg_type, meta=meta or {},
-    )
-    db.add(msg)
-    db.commit()
-    db.refresh(msg)
-    return msg
+def get_chat_history(db: Session, user_id: int = 1, limit: int = 10) -> list:
+    return _history_from_rows(db.execute(_history_query(user_id, limit)).all())
+
+
+# ─── ASYNC DB HELPERS ─────────────────────────────────────────────────────────
+# Для async def эндпоинтов: запросы идут через aiosqlite и не блокируют event loop.
+# Сложные синхронные помощники (промпт, применение действий ИИ) вызываются через
+# AsyncSession.run_sync — тот же код, но ввод-вывод всё равно асинхронный.
+
+async def get_chat_history_async(db: AsyncSession, user_id: int = 1, limit: int = 10) -> list:
+    result = await db.execute(_history_query(user_id, limit))
+    return _history_from_rows(result.all())
+
+
+async def build_system_prompt_async(db: AsyncSession, user_id: int = 1) -> str:
+    return await db.run_sync(build_system_prompt, user_id)
+
+
+# ─── AGENT ACTIONS ────────────────────────────────────────────────────────────
+# Помощники ниже не коммитят: весь ход агента — одна транзакция (apply_agent_turn).
+# Задачи и память, на которые ссылается ответ ИИ, читаются одной выборкой IN (...).
+
+def _load_tasks(db: Session, task_ids, user_id: int) -> dict:
+    ids = set()
+    for tid in task_ids:
+        try:
+            ids.add(int(tid))
+        except (TypeError, ValueError):
+            continue
+    if not ids:
+        return {}
+    return {t.id: t for t in db.query(Task).filter(Task.user_id == user_id, Task.id.in_(ids))}
 
 
 def save_memories(db: Session, memories: list, user_id: int = 1):
+    keys = {mem.get("key", "") for mem in memories} - {""}
+    existing = {
+        m.key: m for m in db.query(AIMemory).filter(AIMemory.user_id == user_id, AIMemory.key.in_(keys))
+    } if keys else {}
     for mem in memories:
         key = mem.get("key", "")
         if not key:
             continue
-        ex = db.query(AIMemory).filter(AIMemory.user_id == user_id, AIMemory.key == key).first()
+        ex = existing.get(key)
         if ex:
             ex.value = mem.get("value", "")
             ex.updated_at = datetime.now()
         else:
-            db.add(AIMemory(
+            existing[key] = AIMemory(
                 user_id=user_id, memory_type=mem.get("type", "fact"),
                 key=key, value=mem.get("value", ""),
-            ))
-    db.commit()
+            )
+            db.add(existing[key])
 
 
 def _detect_delete_all(user_message: str) -> bool:
@@ -240,49 +282,18 @@ def _detect_tomorrow_in_message(user_message: str) -> bool:
 
 def compute_task_status(task) -> str:
     """
-    Вычисляет статус задачи на основе времени:
+    Вычисляет статус задачи на основе времени (правило — services/overdue_rule.py):
     - Если задача выполнена — оставляем completed
-    - Если start_datetime + duration_minutes < сейчас → overdue
-    - Если deadline < сейчас → overdue
+    - Если срок прошёл → overdue
     - Иначе → pending / in_progress
     """
     if task.status == "completed":
         return "completed"
-
-    now = datetime.now()
-
-    # Проверка: начало + длительность уже прошли
-    if task.start_datetime and task.duration_minutes:
-        end_time = task.start_datetime + timedelta(minutes=task.duration_minutes)
-        if end_time < now:
-            return "overdue"
-
-    # Проверка дедлайна
-    if task.deadline and task.deadline < now:
+    if is_past_due(task):
         return "overdue"
-
     return task.status or "pending"
 
 
-def refresh_overdue_tasks(db: Session, user_id: int = 1):
-    """Обновляет статус просроченных задач в БД."""
-    tasks = db.query(Task).filter(
-        Task.user_id == user_id,
-        Task.status.notin_(["completed", "overdue"])
-    ).all()
-
-    updated = False
-    for task in tasks:
-        new_status = compute_task_status(task)
-        if new_status != task.status:
-            task.status = new_status
-            task.updated_at = datetime.now()
-            updated = True
-
-    if updated:
-        db.commit()
-
-
 def create_tasks_from_ai(db: Session, tasks_data: list, user_id: int = 1,
                           user_message: str = "") -> list:
     created = []
@@ -325,23 +336,24 @@ def create_tasks_from_ai(db: Session, tasks_data: list, user_id: int = 1,
         db.add(task)
         created.append(task)
 
-    if created:
-        db.commit()
-        for t in created:
-            db.refresh(t)
+    # Одно обновление DailyStats на всю пачку
+    apply_stats_deltas(db, [(None, task_stats_snapshot(t)) for t in created], user_id)
+    # flush внутри record_task_changes выдаёт id — refresh после коммита не нужен
+    record_task_changes(db, created, user_id)
     return created
 
 
 def update_tasks_from_ai(db: Session, updates: list, user_id: int = 1) -> list:
-    updated = []
+    updated, changes = [], []
+    tasks = _load_tasks(db, [upd.get("id") for upd in updates], user_id)
     for upd in updates:
-        task_id = upd.get("id")
-        if not task_id:
+        try:
+            task = tasks.get(int(upd.get("id")))
+        except (TypeError, ValueError):
             continue
-
-        task = db.query(Task).filter(Task.id == task_id, Task.user_id == user_id).first()
         if not task:
             continue
+        before = task_stats_snapshot(task)
 
         for field in ("title", "description", "category", "priority", "status", "duration_minutes"):
             if field in upd and upd[field] is not None:
@@ -365,25 +377,23 @@ def update_tasks_from_ai(db: Session, updates: list, user_id: int = 1) -> list:
             if new_status != task.status:
                 task.status = new_status
 
+        changes.append((before, task_stats_snapshot(task)))
         updated.append(task)
 
-    if updated:
-        db.commit()
+    apply_stats_deltas(db, changes, user_id)
+    record_task_changes(db, updated, user_id)
     return updated
 
 
 def delete_tasks_from_ai(db: Session, task_ids: list, user_id: int = 1) -> list:
-    deleted = []
-    for tid in task_ids:
-        try:
-            task = db.query(Task).filter(Task.id == int(tid), Task.user_id == user_id).first()
-        except Exception:
-            continue
-        if task:
-            deleted.append(task.title)
-            db.delete(task)
-    if deleted:
-        db.commit()
+    deleted, changes = [], []
+    tasks = _load_tasks(db, task_ids, user_id)
+    for task in tasks.values():
+        deleted.append(task.title)
+        changes.append((task_stats_snapshot(task), None))
+        db.delete(task)
+    apply_stats_deltas(db, changes, user_id)
+    record_task_deletes(db, list(tasks), user_id)
     return deleted
 
 
@@ -391,8 +401,11 @@ def delete_all_tasks(db: Session, user_id: int = 1) -> list:
     """Удаляет ВСЕ задачи пользователя напрямую через БД."""
     tasks = db.query(Task).filter(Task.user_id == user_id).all()
     titles = [t.title for t in tasks]
+    snapshots = [task_stats_snapshot(t) for t in tasks]
+    record_task_deletes(db, [t.id for t in tasks], user_id)
+    db.query(TaskOccurrence).filter(TaskOccurrence.user_id == user_id).delete()
     db.query(Task).filter(Task.user_id == user_id).delete()
-    db.commit()
+    apply_stats_deltas(db, [(snap, None) for snap in snapshots], user_id)
     return titles
 
 
@@ -419,7 +432,8 @@ def parse_agent_response(text: str) -> dict:
 async def call_llm(system_prompt: str, history: list) -> str:
     if USE_OLLAMA:
         return await _call_ollama(system_prompt, history)
-    return _call_anthropic(system_prompt, history)
+    # Синхронный клиент Anthropic — в поток, чтобы не держать event loop
+    return await asyncio.to_thread(_call_anthropic, system_prompt, history)
 
 
 async def call_llm_with_retry(system_prompt: str, history: list) -> str:
@@ -482,14 +496,28 @@ async def _call_ollama(system_prompt: str, history: list) -> str:
         return resp.json()["message"]["content"]
 
 
-async def process_message(db: Session, user_id: int = 1) -> dict:
-    # Обновляем просроченные задачи перед каждым запросом к агенту
-    refresh_overdue_tasks(db, user_id)
+def _error_result(text: str) -> dict:
+    return {
+        "message": text,
+        "tasks_created": [], "tasks_updated": [], "tasks_deleted": [],
+        "clarifying_questions": [], "tips": [], "load_warning": None,
+    }
 
-    system_prompt = build_system_prompt(db, user_id)
-    history = get_chat_history(db, user_id, limit=10)
 
-    last_user = next((m["content"] for m in reversed(history) if m["role"] == "user"), "—")
+async def process_message(db: AsyncSession, message: str, user_id: int = 1, msg_type: str = "text") -> dict:
+    """
+    Один ход агента. Сообщение пользователя, действия ИИ и ответ пишутся одним
+    коммитом после ответа LLM (apply_agent_turn): на время вызова модели
+    транзакция не открыта, а план ИИ не может примениться наполовину.
+    """
+    # Просроченные задачи переводит фоновый overdue_scheduler
+    received_at = datetime.now(timezone.utc)
+    system_prompt = await build_system_prompt_async(db, user_id)
+    history = await get_chat_history_async(db, user_id, limit=9)
+    await db.rollback()   # чтение закончено — не держим транзакцию, пока ждём LLM
+    history.append({"role": "user", "content": message})
+
+    last_user = message
     print(f"\n{'='*60}")
     print(f"[Agent] msgs in history: {len(history)}")
     print(f"[Agent] last user msg: {last_user[:120]}")
@@ -503,11 +531,8 @@ async def process_message(db: Session, user_id: int = 1) -> dict:
         raw = await call_llm_with_retry(system_prompt, history)
     except Exception as e:
         print(f"[Agent] LLM ERROR: {e}")
-        return {
-            "message": f"Ошибка ИИ: {e}",
-            "tasks_created": [], "tasks_updated": [], "tasks_deleted": [],
-            "clarifying_questions": [], "tips": [], "load_warning": None,
-        }
+        return await db.run_sync(apply_agent_turn, None, user_id, message, msg_type,
+                                 received_at=received_at, error=f"Ошибка ИИ: {e}")
 
     print(f"[Agent] RAW RESPONSE:\n{raw}")
     print(f"{'='*60}\n")
@@ -517,6 +542,41 @@ async def process_message(db: Session, user_id: int = 1) -> dict:
           f"update={len(parsed.get('tasks_to_update', []))} "
           f"delete={parsed.get('tasks_to_delete', [])} ")
 
+    return await db.run_sync(apply_agent_turn, parsed, user_id, message, msg_type, force_delete_all, received_at)
+
+
+def apply_agent_turn(db: Session, parsed: dict, user_id: int = 1, message: str = "",
+                     msg_type: str = "text", force_delete_all: bool = False,
+                     received_at: datetime = None, error: str = None) -> dict:
+    """Сообщение пользователя + действия ИИ + ответ ассистента — один коммит."""
+    touched = []
+    if error is None:
+        try:
+            result, touched = apply_agent_actions(db, parsed, user_id, message, force_delete_all)
+        except Exception as e:
+            # План ИИ откатывается целиком; переписку всё равно сохраняем
+            db.rollback()
+            print(f"[Agent] APPLY ERROR: {e}")
+            result, touched = _error_result(f"Не удалось применить изменения: {e}"), []
+    else:
+        result = _error_result(error)
+
+    db.add(ChatMessage(user_id=user_id, role="user", content=message, message_type=msg_type, meta={},
+                       created_at=received_at or datetime.now(timezone.utc)))
+    db.add(ChatMessage(user_id=user_id, role="assistant", content=result.get("message") or "Готово.",
+                       message_type="text", meta=result))
+    db.commit()
+    for task in touched:
+        overdue_scheduler.schedule(task)
+    return result
+
+
+def apply_agent_actions(db: Session, parsed: dict, user_id: int = 1,
+                        last_user: str = "", force_delete_all: bool = False) -> tuple[dict, list]:
+    """
+    Применяет разобранный ответ ИИ (память, удаление, создание, правки) без коммита.
+    Возвращает результат для клиента и задачи, которые после коммита ставятся в overdue_scheduler.
+    """
     if parsed.get("memories_to_save"):
         save_memories(db, parsed["memories_to_save"], user_id)
 
@@ -545,6 +605,7 @@ async def process_message(db: Session, user_id: int = 1) -> dict:
         user_message=last_user,
     )
     updated = update_tasks_from_ai(db, parsed.get("tasks_to_update", []), user_id)
+    db.flush()
 
     return {
         "message": parsed.get("message") or "Готово.",
@@ -554,4 +615,4 @@ async def process_message(db: Session, user_id: int = 1) -> dict:
         "clarifying_questions": parsed.get("clarifying_questions", []),
         "tips": parsed.get("tips", []),
         "load_warning": parsed.get("load_warning"),
-    }
\ No newline at end of file
+    }, created + updated
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+Hot/cold archival of completed tasks and old chat.
+
+Горячие таблицы tasks и chat_messages читаются почти каждым запросом, поэтому
+в них остаётся только живое: фоновый архиватор раз в ARCHIVE_INTERVAL переносит
+выполненные задачи старше ARCHIVE_TASKS_AFTER_DAYS (по completed_at) и сообщения
+старше ARCHIVE_CHAT_AFTER_DAYS в tasks_archive / chat_messages_archive той же
+базы (при SHARD_MODE=per_user — того же шарда). Перенос — INSERT … SELECT +
+DELETE пачками по ARCHIVE_BATCH, каждая пачка — своя короткая транзакция.
+
+Что не меняется: task_counters и DailyStats продолжают учитывать архивные задачи
+(перенос идёт мимо ORM-хуков, а rebuild_task_counters считает обе таблицы), серии
+не архивируются никогда. Клиентам дельта-синхронизации уходит tombstone op="archive".
+
+Чтение архива — только по явному include_archived: task_source / chat_source
+отдают UNION ALL горячей и архивной таблицы под видом обычной модели.
+
+Запуск из папки backend:
+    python -m services.archive [--user 1] [--tasks-days 90] [--chat-days 180]
+"""
+import argparse
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, insert, delete, func, union_all, or_, literal
+from sqlalchemy.orm import aliased
+
+from database import Task, TaskArchive, TaskChange, TaskOccurrence, ChatMessage, ChatMessageArchive
+from services.cache import data_versions
+from services.shards import shard_directory
+
+ARCHIVE_TASKS_AFTER_DAYS = int(os.getenv("ARCHIVE_TASKS_AFTER_DAYS", "90"))
+ARCHIVE_CHAT_AFTER_DAYS = int(os.getenv("ARCHIVE_CHAT_AFTER_DAYS", "180"))
+ARCHIVE_INTERVAL = timedelta(hours=int(os.getenv("ARCHIVE_INTERVAL_HOURS", "24")))
+ARCHIVE_BATCH = 1000
+
+
+# ─── READ SIDE ────────────────────────────────────────────────────────────────
+
+def _with_archive(model, archive):
+    hot, cold = model.__table__, archive.__table__
+    both = union_all(select(*hot.c), select(*(cold.c[c.name] for c in hot.c)))
+    return aliased(model, both.subquery(f"{hot.name}_all"))
+
+
+TASKS_ALL = _with_archive(Task, TaskArchive)
+CHAT_ALL = _with_archive(ChatMessage, ChatMessageArchive)
+
+
+def task_source(include_archived: bool = False):
+    """Task или псевдомодель «tasks + tasks_archive» с теми же атрибутами."""
+    return TASKS_ALL if include_archived else Task
+
+
+def chat_source(include_archived: bool = False):
+    return CHAT_ALL if include_archived else ChatMessage
+
+
+# ─── MOVE ─────────────────────────────────────────────────────────────────────
+
+def _candidates(conn, hot, cold, user_id: int, condition, batch: int) -> list[int]:
+    # SQLite выдаёт новый rowid как max(id) + 1: строку с максимальным id не трогаем,
+    # иначе следующая вставка получит id уже архивной строки. id, занятые в архиве
+    # (переиспользованные после удалений), тоже остаются в горячей таблице.
+    return list(conn.execute(
+        select(hot.c.id).where(
+            hot.c.user_id == user_id,
+            condition,
+            hot.c.id < select(func.max(hot.c.id)).scalar_subquery(),
+            hot.c.id.notin_(select(cold.c.id).where(cold.c.user_id == user_id)),
+        ).order_by(hot.c.id).limit(batch)
+    ).scalars())
+
+
+def _move(conn, hot, cold, ids: list[int], now: datetime):
+    names = [c.name for c in hot.c]
+    conn.execute(insert(cold).from_select(
+        names + ["archived_at"],
+        select(*hot.c, literal(now, cold.c.archived_at.type)).where(hot.c.id.in_(ids)),
+    ))
+    conn.execute(delete(hot).where(hot.c.id.in_(ids)))
+
+
+def archive_user(engine, user_id: int, tasks_days: int = ARCHIVE_TASKS_AFTER_DAYS,
+                 chat_days: int = ARCHIVE_CHAT_AFTER_DAYS, batch: int = ARCHIVE_BATCH) -> dict:
+    """Переносит холодные строки пользователя; пачка — одна транзакция."""
+    tasks, chat = Task.__table__, ChatMessage.__table__
+    # completed_at — локальное время (datetime.now()), created_at чата — UTC
+    task_cutoff = datetime.now() - timedelta(days=tasks_days)
+    chat_cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=chat_days)
+    task_condition = (
+        (tasks.c.status == "completed")
+        & (tasks.c.completed_at < task_cutoff)
+        # серии живут вечно: их вхождения разворачиваются из горячей строки
+        & or_(tasks.c.is_recurring.isnot(True), tasks.c.recurrence_rule.is_(None))
+    )
+    moved = {"tasks": 0, "chat": 0}
+
+    while True:
+        with engine.begin() as conn:
+            ids = _candidates(conn, tasks, TaskArchive.__table__, user_id, task_condition, batch)
+            if not ids:
+                break
+            # блокировка версии пользователя — до записи в журнал (см. services/changelog.py)
+            data_versions.bump(conn, [user_id])
+            conn.execute(delete(TaskOccurrence.__table__).where(TaskOccurrence.__table__.c.task_id.in_(ids)))
+            _move(conn, tasks, TaskArchive.__table__, ids, datetime.now())
+            conn.execute(insert(TaskChange.__table__), [
+                {"user_id": user_id, "task_id": task_id, "op": "archive"} for task_id in ids
+            ])
+        moved["tasks"] += len(ids)
+
+    while True:
+        with engine.begin() as conn:
+            ids = _candidates(conn, chat, ChatMessageArchive.__table__, user_id,
+                              chat.c.created_at < chat_cutoff, batch)
+            if not ids:
+                break
+            _move(conn, chat, ChatMessageArchive.__table__, ids, datetime.now())
+        moved["chat"] += len(ids)
+
+    return moved
+
+
+def archive_all(**kwargs) -> dict:
+    total = {"users": 0, "tasks": 0, "chat": 0}
+    for user_id in shard_directory.user_ids():
+        moved = archive_user(shard_directory.shard(user_id).engine, user_id, **kwargs)
+        total["users"] += 1
+        total["tasks"] += moved["tasks"]
+        total["chat"] += moved["chat"]
+    return total
+
+
+# ─── BACKGROUND WORKER ────────────────────────────────────────────────────────
+
+class Archiver:
+    def __init__(self, interval: timedelta = ARCHIVE_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                total = archive_all()
+                if total["tasks"] or total["chat"]:
+                    print(f"[Archive] в архив: задач {total['tasks']}, сообщений {total['chat']}")
+            except Exception as e:
+                print(f"[Archive] ERROR: {e}")
+            self._stop.wait(self.interval.total_seconds())
+
+
+archiver = Archiver()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move completed tasks and old chat to archive tables")
+    parser.add_argument("--user", dest="user_id", default=None, type=int)
+    parser.add_argument("--tasks-days", default=ARCHIVE_TASKS_AFTER_DAYS, type=int)
+    parser.add_argument("--chat-days", default=ARCHIVE_CHAT_AFTER_DAYS, type=int)
+    args = parser.parse_args()
+
+    options = {"tasks_days": args.tasks_days, "chat_days": args.chat_days}
+    if args.user_id is None:
+        print(f"[Archive] {archive_all(**options)}")
+    else:
+        print(f"[Archive] {archive_user(shard_directory.shard(args.user_id).engine, args.user_id, **options)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Version-invalidated in-process cache for derived per-user data (tips, load).
+
+У каждого пользователя есть версия данных в таблице data_versions: её увеличивает
+(один раз за транзакцию) любой коммит, затронувший задачи, вхождения серий или
+профиль, — хуки сессии ниже пишут её в той же транзакции, что и саму правку.
+Версия живёт в базе, а не в памяти процесса, поэтому правка в одном воркере
+(или в архиваторе) инвалидирует кэши всех остальных. Запись кэша помнит версию
+и день, на которые посчитана, — после правки или смены суток она просто не
+совпадёт и будет пересчитана. Общий LRU на всех пользователей ограничен.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Hashable, Optional
+
+from sqlalchemy import event, update, insert, select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Task, TaskOccurrence, UserProfile, DataVersion, remember_bulk_users
+
+CACHE_SIZE = 1024
+
+
+class DataVersions:
+    @staticmethod
+    def get(db: Session, user_id: int) -> Optional[int]:
+        """
+        Версия данных пользователя, видимая сессии. None — в открытой транзакции сессии
+        уже есть незакоммиченные правки пользователя: посчитанное по ним класть в кэш нельзя.
+        """
+        if user_id in db.info.get("data_versions", ()):
+            return None
+        version = db.query(DataVersion.version).filter(DataVersion.user_id == user_id).scalar()
+        return version or 0
+
+    @staticmethod
+    def bump(conn, user_ids) -> dict[int, int]:
+        """Увеличивает версии в текущей транзакции conn; возвращает новые значения."""
+        versions = {}
+        for user_id in user_ids:
+            result = conn.execute(
+                update(DataVersion).where(DataVersion.user_id == user_id).values(version=DataVersion.version + 1)
+            )
+            if result.rowcount == 0:
+                conn.execute(insert(DataVersion).values(user_id=user_id, version=1))
+            versions[user_id] = conn.execute(
+                select(DataVersion.version).where(DataVersion.user_id == user_id)
+            ).scalar_one()
+        return versions
+
+    @staticmethod
+    def bump_all(conn):
+        conn.execute(update(DataVersion).values(version=DataVersion.version + 1))
+
+
+data_versions = DataVersions()
+
+
+class VersionedLRU:
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, db: Session, user_id: int, key: Hashable, compute: Callable):
+        """Значение из кэша, если версия данных и день не изменились; иначе compute()."""
+        version = data_versions.get(db, user_id)
+        if version is None:
+            return compute()
+        full_key = (user_id, key)
+        stamp = (version, date.today())
+        with self._lock:
+            hit = self._data.get(full_key)
+            if hit is not None and hit[0] == stamp:
+                self._data.move_to_end(full_key)
+                return hit[1]
+
+        # compute() читает в той же транзакции сессии, что и версия, — значение
+        # соответствует именно этой версии, даже если другой воркер уже её обогнал
+        value = compute()
+        with self._lock:
+            self._data[full_key] = (stamp, value)
+            self._data.move_to_end(full_key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+derived_cache = VersionedLRU()
+
+
+# ─── SESSION HOOKS ────────────────────────────────────────────────────────────
+# session.info["data_versions"] — {user_id: версия после этой транзакции}: версия
+# пользователя растёт на первой его правке в транзакции, дальше не трогается.
+# Его же читает services/schedule_index.py в after_commit; сбрасывается в конце транзакции.
+
+def _owner(obj):
+    if isinstance(obj, (Task, TaskOccurrence)):
+        return obj.user_id
+    if isinstance(obj, UserProfile):
+        return obj.id
+    return None
+
+
+def bump_versions(session, user_ids):
+    """
+    Сдвигает версии пользователей в транзакции сессии сейчас, не дожидаясь flush
+    (повторно в той же транзакции — ничего). UPDATE держит блокировку строки до
+    коммита: на серверных СУБД транзакции одного пользователя после этого идут
+    по очереди — на этом держится порядок версий журнала (services/changelog.py).
+    """
+    versions = session.info.setdefault("data_versions", {})
+    fresh = {user_id for user_id in user_ids if user_id is not None and user_id not in versions}
+    if fresh:
+        versions.update(data_versions.bump(session.connection(), fresh))
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_versions(session, flush_context):
+    bump_versions(session, {_owner(obj) for obj in list(session.new) + list(session.dirty) + list(session.deleted)})
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _remember_bulk_users(state):
+    remember_bulk_users(state, Task, "version_users")
+    remember_bulk_users(state, TaskOccurrence, "version_users")
+
+
+@event.listens_for(SessionLocal, "after_bulk_delete")
+@event.listens_for(SessionLocal, "after_bulk_update")
+def _bulk_write(context):
+    if context.mapper.class_ in (Task, TaskOccurrence):
+        bump_versions(context.session, context.session.info.pop("version_users", ()))
+    elif context.mapper.class_ is UserProfile:
+        # без user_id в строках — сдвигаем всех; записи кэшей просто пересчитаются
+        data_versions.bump_all(context.session.connection())
+
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _drop_versions(session, transaction):
+    # после after_commit — хуки коммита (schedule_index) успевают прочитать версии
+    if transaction.parent is not None:
+        return
+    session.info.pop("data_versions", None)
+    session.info.pop("version_users", None)
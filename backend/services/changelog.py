@@ -0,0 +1,75 @@
+"""
+Task change log for delta sync.
+
+Каждая мутация задач пишет строку в task_changes в той же транзакции.
+Версия — id строки журнала: монотонно растёт, а значит и для каждого пользователя.
+Клиент хранит последнюю версию и забирает только изменения после неё.
+
+Id раздаётся при вставке, а не при коммите: на PostgreSQL транзакция с меньшим id
+может закоммититься позже, и клиент, уже прочитавший since=N, её бы пропустил.
+Поэтому перед записью в журнал берётся блокировка строки пользователя в
+data_versions (bump_versions) — транзакции одного пользователя пишут журнал по
+очереди, и порядок id внутри пользователя совпадает с порядком коммитов.
+SQLite и так сериализует писателей.
+"""
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database import Task, TaskChange
+from services.cache import bump_versions
+
+
+def record_task_changes(db: Session, tasks: list, user_id: int = 1):
+    """Отмечает задачи как вставленные/обновлённые. Не коммитит."""
+    if not tasks:
+        return
+    if any(t.id is None for t in tasks):
+        db.flush()
+    bump_versions(db, [user_id])
+    db.add_all([TaskChange(user_id=user_id, task_id=t.id, op="upsert") for t in tasks])
+
+
+def record_task_deletes(db: Session, task_ids: list, user_id: int = 1):
+    """Пишет tombstone для удалённых задач. Не коммитит."""
+    if not task_ids:
+        return
+    bump_versions(db, [user_id])
+    db.add_all([TaskChange(user_id=user_id, task_id=tid, op="delete") for tid in task_ids])
+
+
+def current_version(db: Session, user_id: int = 1) -> int:
+    return db.query(func.max(TaskChange.id)).filter(TaskChange.user_id == user_id).scalar() or 0
+
+
+def changes_since(db: Session, since: int, user_id: int = 1, limit: int = 1000) -> dict:
+    """
+    Изменения после версии since: {"version", "tasks", "deleted", "has_more"}.
+    Несколько изменений одной задачи схлопываются в последнее.
+    """
+    rows = (
+        db.query(TaskChange.id, TaskChange.task_id, TaskChange.op)
+        .filter(TaskChange.user_id == user_id, TaskChange.id > since)
+        .order_by(TaskChange.id.asc())
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    last_op = {}
+    for _, task_id, op in rows:
+        last_op[task_id] = op
+
+    upsert_ids = [tid for tid, op in last_op.items() if op == "upsert"]
+    tasks = []
+    if upsert_ids:
+        tasks = db.query(Task).filter(Task.user_id == user_id, Task.id.in_(upsert_ids)).all()
+    found = {t.id for t in tasks}
+
+    return {
+        "version": rows[-1][0] if rows else since,
+        "tasks": tasks,
+        # задача могла быть удалена позже окна — для клиента это тоже удаление;
+        # op="archive" — задача ушла в архив (services/archive.py)
+        "deleted": [tid for tid, op in last_op.items() if op != "upsert" or tid not in found],
+        "has_more": has_more,
+    }
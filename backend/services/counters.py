@@ -0,0 +1,136 @@
+"""
+Materialized per-user task counters for /stats/overview.
+
+Счётчики (status / category / priority → count) обновляются в той же транзакции,
+что и сами задачи: хук before_flush считает разницу по новым, изменённым и
+удалённым Task и применяет её к task_counters. Так их поддерживают все пути
+мутаций — роутеры, агент, overdue_scheduler — без правок в каждом.
+Массовые query.delete()/update() по задачам пересобирают счётчики GROUP BY —
+только для пользователей, чьи строки они затронули.
+Архивные задачи (services/archive.py) в счётчиках остаются.
+"""
+from collections import Counter
+
+from sqlalchemy import event, func, inspect, update, insert, delete, select, union_all
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Task, TaskArchive, TaskCounter, remember_bulk_users
+
+DIMENSIONS = ("status", "category", "priority")
+DEFAULTS = {dim: Task.__table__.c[dim].default.arg for dim in DIMENSIONS}
+
+
+def _value(task: Task, dim: str):
+    value = getattr(task, dim)
+    return DEFAULTS[dim] if value is None else value
+
+
+def _apply(conn, delta: Counter):
+    for (user_id, dim, key), diff in delta.items():
+        if not diff:
+            continue
+        result = conn.execute(
+            update(TaskCounter)
+            .where(TaskCounter.user_id == user_id, TaskCounter.dimension == dim, TaskCounter.key == key)
+            .values(count=TaskCounter.count + diff)
+        )
+        if result.rowcount == 0:
+            conn.execute(insert(TaskCounter).values(user_id=user_id, dimension=dim, key=key, count=diff))
+
+
+def rebuild_task_counters(conn, user_id: int = None):
+    """Пересобирает счётчики GROUP BY по задачам — горячим и архивным (всех пользователей или одного)."""
+    stmt = delete(TaskCounter)
+    if user_id is not None:
+        stmt = stmt.where(TaskCounter.user_id == user_id)
+    conn.execute(stmt)
+    for dim in DIMENSIONS:
+        parts = []
+        for table in (Task.__table__, TaskArchive.__table__):
+            part = select(table.c.user_id, func.coalesce(table.c[dim], DEFAULTS[dim]).label("key"))
+            parts.append(part if user_id is None else part.where(table.c.user_id == user_id))
+        both = union_all(*parts).subquery()
+        rows = conn.execute(
+            select(both.c.user_id, both.c.key, func.count()).group_by(both.c.user_id, both.c.key)
+        ).all()
+        if rows:
+            conn.execute(insert(TaskCounter), [
+                {"user_id": uid, "dimension": dim, "key": key, "count": count} for uid, key, count in rows
+            ])
+
+
+def ensure_task_counters(engine):
+    """Первый запуск на существующей базе: счётчиков ещё нет, а задачи есть."""
+    with engine.begin() as conn:
+        has_counters = conn.execute(TaskCounter.__table__.select().limit(1)).first()
+        has_tasks = conn.execute(Task.__table__.select().limit(1)).first()
+        if has_tasks and not has_counters:
+            rebuild_task_counters(conn)
+
+
+def read_task_counters(db: Session, user_id: int) -> dict:
+    """{dimension: {key: count}} — одна выборка по уникальному индексу, не зависит от числа задач."""
+    result = {dim: {} for dim in DIMENSIONS}
+    for dim, key, count in db.query(TaskCounter.dimension, TaskCounter.key, TaskCounter.count).filter(
+        TaskCounter.user_id == user_id,
+    ):
+        if count:
+            result[dim][key] = count
+    return result
+
+
+# ─── SESSION HOOKS ────────────────────────────────────────────────────────────
+
+def _track_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+# active_history: при присваивании подгружается старое значение, даже если атрибут
+# был expired после коммита — иначе в history не будет, из какой корзины вычитать
+for _dim in DIMENSIONS:
+    event.listen(getattr(Task, _dim), "set", _track_old_value, active_history=True, retval=True)
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _count_changes(session, flush_context, instances):
+    delta = Counter()
+    for obj in session.new:
+        if isinstance(obj, Task):
+            for dim in DIMENSIONS:
+                delta[(obj.user_id or 1, dim, _value(obj, dim))] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Task):
+            state = inspect(obj)
+            for dim in DIMENSIONS:
+                hist = state.attrs[dim].history
+                old = hist.deleted[0] if hist.deleted else getattr(obj, dim)
+                delta[(obj.user_id, dim, DEFAULTS[dim] if old is None else old)] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Task) and obj not in session.deleted:
+            state = inspect(obj)
+            for dim in DIMENSIONS:
+                hist = state.attrs[dim].history
+                if not hist.added:
+                    continue
+                old = hist.deleted[0] if hist.deleted else None
+                old = DEFAULTS[dim] if old is None else old
+                new = _value(obj, dim)
+                if old != new:
+                    delta[(obj.user_id, dim, old)] -= 1
+                    delta[(obj.user_id, dim, new)] += 1
+    if any(delta.values()):
+        _apply(session.connection(), delta)
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _remember_bulk_users(state):
+    remember_bulk_users(state, Task, "counter_users")
+
+
+@event.listens_for(SessionLocal, "after_bulk_delete")
+@event.listens_for(SessionLocal, "after_bulk_update")
+def _bulk_recount(context):
+    if context.mapper.class_ is Task:
+        conn = context.session.connection()
+        for user_id in context.session.info.pop("counter_users", ()):
+            rebuild_task_counters(conn, user_id)
@@ -0,0 +1,108 @@
+"""
+In-process event broker for the task change feed.
+
+События собираются из сессии SQLAlchemy (after_flush: строки task_changes и
+DailyStats) и рассылаются подписчикам только после успешного коммита.
+Публикация идёт из любых потоков (sync-эндпоинты, overdue_scheduler),
+подписчики — asyncio-очереди WebSocket-соединений.
+"""
+import asyncio
+import threading
+
+from sqlalchemy import event
+
+from database import SessionLocal, TaskChange, DailyStats
+
+QUEUE_LIMIT = 1000
+
+
+class Subscription:
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_LIMIT)
+
+    def _put(self, events: list):
+        try:
+            self.queue.put_nowait(events)
+        except asyncio.QueueFull:
+            # Клиент не успевает — просим его пересинхронизироваться через /tasks/changes
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait([{"type": "resync"}])
+
+    async def next_batch(self) -> list:
+        """Ждёт события и забирает всё, что накопилось, одной пачкой."""
+        events = list(await self.queue.get())
+        while not self.queue.empty():
+            events.extend(self.queue.get_nowait())
+        return events
+
+
+class EventBroker:
+    def __init__(self):
+        self._subs: set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int = 1) -> Subscription:
+        sub = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def publish(self, user_id: int, events: list):
+        with self._lock:
+            subs = [s for s in self._subs if s.user_id == user_id]
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._put, events)
+            except RuntimeError:
+                # loop уже закрыт — соединение умерло
+                self.unsubscribe(sub)
+
+
+event_broker = EventBroker()
+
+
+# ─── SESSION HOOKS ────────────────────────────────────────────────────────────
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_events(session, flush_context):
+    pending = session.info.setdefault("pending_events", {})
+    for obj in session.new:
+        if isinstance(obj, TaskChange):
+            pending.setdefault(obj.user_id, []).append({
+                "type": "task", "op": obj.op, "id": obj.task_id, "version": obj.id,
+            })
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, DailyStats):
+            pending.setdefault(obj.user_id, []).append({
+                "type": "stats",
+                "date": obj.date,
+                "total": obj.tasks_total,
+                "completed": obj.tasks_completed,
+                "overdue": obj.tasks_overdue,
+                "load_score": round((obj.load_score or 0) * 100),
+                "all_done": obj.all_done,
+            })
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_events(session):
+    pending = session.info.pop("pending_events", None)
+    if not pending:
+        return
+    for user_id, events in pending.items():
+        if any(e["type"] == "task" for e in events):
+            # Советы зависят от загрузки и просроченных — клиент перезапрашивает /tasks/tips
+            events.append({"type": "tips"})
+        event_broker.publish(user_id, events)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_events(session):
+    session.info.pop("pending_events", None)
@@ -0,0 +1,260 @@
+"""
+Streaming export of tasks, chat history, AI memories and DailyStats.
+
+Выгрузка идёт генератором с постоянной памятью: строки читаются пачками по
+EXPORT_BATCH (keyset по id, column-projected запрос), сразу сериализуются и
+отдаются кусками ~64 КБ — в памяти не больше одной пачки. Транзакция чтения
+закрывается до отдачи пачки клиенту: медленный клиент не держит блокировку
+SQLite на всё время скачивания, как держал бы один открытый курсор.
+
+С include_archived после горячей таблицы тем же способом выгружается архив
+(services/archive.py).
+
+Генераторы открывают собственную сессию в шарде пользователя: сессия из
+Depends(get_user_db) закрывается раньше, чем StreamingResponse начинает отдавать тело.
+"""
+import csv
+import io
+from datetime import datetime, date, timezone
+from typing import Iterator, Optional
+
+from sqlalchemy import and_
+from sqlalchemy.sql.elements import Label
+
+from database import Task, TaskArchive, TaskOccurrence, ChatMessage, ChatMessageArchive, AIMemory, DailyStats
+from services.recurrence import SHORTCUTS, is_series
+from services.serialization import dumps
+from services.shards import open_session
+
+EXPORT_BATCH = 1000
+CHUNK_BYTES = 64 * 1024
+
+# Колонки выгрузки по наборам данных; порядок — порядок колонок CSV
+DATASETS = {
+    "tasks": (Task, (
+        Task.id, Task.title, Task.description, Task.category, Task.priority, Task.status,
+        Task.start_datetime, Task.end_datetime, Task.duration_minutes, Task.deadline,
+        Task.ai_generated, Task.ai_notes, Task.urgency_score, Task.subtasks, Task.attached_files,
+        Task.is_recurring, Task.recurrence_rule, Task.completed_at, Task.created_at, Task.updated_at,
+    )),
+    "chat": (ChatMessage, (
+        ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.message_type,
+        ChatMessage.file_path, ChatMessage.meta.label("metadata"), ChatMessage.created_at,
+    )),
+    "memories": (AIMemory, (
+        AIMemory.id, AIMemory.memory_type, AIMemory.key, AIMemory.value, AIMemory.confidence,
+        AIMemory.created_at, AIMemory.updated_at,
+    )),
+    "stats": (DailyStats, (
+        DailyStats.id, DailyStats.date, DailyStats.tasks_total, DailyStats.tasks_completed,
+        DailyStats.tasks_overdue, DailyStats.tasks_postponed, DailyStats.total_minutes_planned,
+        DailyStats.total_minutes_done, DailyStats.load_score, DailyStats.all_done,
+    )),
+}
+
+ARCHIVES = {"tasks": TaskArchive, "chat": ChatMessageArchive}
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ics": ("text/calendar; charset=utf-8", "ics"),
+}
+
+
+def _columns_on(model, columns) -> tuple:
+    """Те же колонки выгрузки на архивной модели (имена атрибутов совпадают)."""
+    return tuple(
+        getattr(model, c.element.key).label(c.name) if isinstance(c, Label) else getattr(model, c.key)
+        for c in columns
+    )
+
+
+def iter_batches(dataset: str, user_id: int = 1, batch: int = EXPORT_BATCH,
+                 include_archived: bool = False) -> Iterator[list]:
+    """Пачки Row по возрастанию id; каждая пачка — отдельное короткое чтение."""
+    model, columns = DATASETS[dataset]
+    sources = [(model, columns)]
+    if include_archived and dataset in ARCHIVES:
+        sources.append((ARCHIVES[dataset], _columns_on(ARCHIVES[dataset], columns)))
+    db = open_session(user_id)
+    try:
+        for model, columns in sources:
+            last_id = 0
+            while True:
+                rows = db.query(*columns).filter(
+                    model.user_id == user_id,
+                    model.id > last_id,
+                ).order_by(model.id).limit(batch).all()
+                # Закрываем транзакцию чтения до того, как пачка уйдёт клиенту
+                db.rollback()
+                if not rows:
+                    break
+                yield rows
+                last_id = rows[-1].id
+                if len(rows) < batch:
+                    break
+    finally:
+        db.close()
+
+
+def _chunked(pieces: Iterator[str]) -> Iterator[bytes]:
+    """Склеивает мелкие куски в блоки ~CHUNK_BYTES — меньше системных вызовов на запись."""
+    buf, size = [], 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= CHUNK_BYTES:
+            yield "".join(buf).encode("utf-8")
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+# ─── NDJSON / CSV ────────────────────────────────────────────────────────────
+
+def stream_ndjson(dataset: str, user_id: int = 1, include_archived: bool = False) -> Iterator[bytes]:
+    buf, size = [], 0
+    for rows in iter_batches(dataset, user_id, include_archived=include_archived):
+        for row in rows:
+            line = dumps(row._asdict()) + b"\n"
+            buf.append(line)
+            size += len(line)
+            if size >= CHUNK_BYTES:
+                yield b"".join(buf)
+                buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return dumps(value).decode("utf-8")
+    return value
+
+
+def stream_csv(dataset: str, user_id: int = 1, include_archived: bool = False) -> Iterator[bytes]:
+    _, columns = DATASETS[dataset]
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    def pieces():
+        writer.writerow([c.key for c in columns])
+        for rows in iter_batches(dataset, user_id, include_archived=include_archived):
+            for row in rows:
+                writer.writerow([_csv_value(v) for v in row])
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+
+    # BOM — чтобы Excel открыл кириллицу в UTF-8
+    yield "\ufeff".encode("utf-8")
+    yield from _chunked(pieces())
+
+
+# ─── ICALENDAR ───────────────────────────────────────────────────────────────
+
+ICS_STATUS = {"completed": "COMPLETED", "in_progress": "IN-PROCESS"}
+ICS_PRIORITY = {"critical": 1, "high": 3, "medium": 5, "low": 9}
+
+
+def _ics_text(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _ics_dt(value: datetime) -> str:
+    # Время в базе — локальное без зоны, в календаре отдаём его «плавающим»
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+def _fold(line: str) -> str:
+    """RFC 5545: строки не длиннее 75 октетов, продолжение — с пробела."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line + "\r\n"
+    parts, start, limit = [], 0, 75
+    while start < len(raw):
+        end = min(start + limit, len(raw))
+        while end < len(raw) and (raw[end] & 0xC0) == 0x80:   # не режем символ UTF-8
+            end -= 1
+        parts.append(raw[start:end].decode("utf-8"))
+        start, limit = end, 74
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _ics_rrule(rule: str) -> str:
+    text = rule.strip()
+    text = SHORTCUTS.get(text.lower(), text)
+    return text[6:] if text.upper().startswith("RRULE:") else text
+
+
+def task_to_vcalendar(row, stamp: str, exdates: Optional[list] = None) -> str:
+    """Задача с началом — VEVENT, без начала — VTODO (дедлайн уходит в DUE)."""
+    kind = "VEVENT" if row.start_datetime else "VTODO"
+    lines = [f"BEGIN:{kind}", f"UID:task-{row.id}@taskflow", f"DTSTAMP:{stamp}", f"SUMMARY:{_ics_text(row.title or '')}"]
+    if row.description:
+        lines.append(f"DESCRIPTION:{_ics_text(row.description)}")
+    if row.category:
+        lines.append(f"CATEGORIES:{_ics_text(row.category)}")
+    if row.priority in ICS_PRIORITY:
+        lines.append(f"PRIORITY:{ICS_PRIORITY[row.priority]}")
+    if kind == "VEVENT":
+        lines.append(f"DTSTART:{_ics_dt(row.start_datetime)}")
+        if row.end_datetime and row.end_datetime > row.start_datetime:
+            lines.append(f"DTEND:{_ics_dt(row.end_datetime)}")
+        elif row.duration_minutes:
+            lines.append(f"DURATION:PT{row.duration_minutes}M")
+        if is_series(row):
+            lines.append(f"RRULE:{_ics_rrule(row.recurrence_rule)}")
+            for day in exdates or ():
+                lines.append(f"EXDATE:{_ics_dt(datetime.combine(date.fromisoformat(day), row.start_datetime.time()))}")
+    else:
+        if row.deadline:
+            lines.append(f"DUE:{_ics_dt(row.deadline)}")
+        lines.append(f"STATUS:{ICS_STATUS.get(row.status, 'NEEDS-ACTION')}")
+        if row.completed_at:
+            lines.append(f"COMPLETED:{_ics_dt(row.completed_at)}")
+    lines.append(f"END:{kind}")
+    return "".join(_fold(line) for line in lines)
+
+
+def _skipped_dates(task_ids: list, user_id: int = 1) -> dict[int, list]:
+    """Пропущенные вхождения серий пачки — EXDATE; одна выборка на пачку."""
+    if not task_ids:
+        return {}
+    db = open_session(user_id)
+    try:
+        result: dict[int, list] = {}
+        for task_id, day in db.query(TaskOccurrence.task_id, TaskOccurrence.occurrence_date).filter(
+            and_(TaskOccurrence.task_id.in_(task_ids), TaskOccurrence.skipped == True)  # noqa: E712
+        ):
+            result.setdefault(task_id, []).append(day)
+        return result
+    finally:
+        db.close()
+
+
+def stream_ics(user_id: int = 1, include_archived: bool = False) -> Iterator[bytes]:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+    def pieces():
+        yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//TaskFlow//Export//RU\r\nCALSCALE:GREGORIAN\r\n"
+        for rows in iter_batches("tasks", user_id, include_archived=include_archived):
+            skipped = _skipped_dates([r.id for r in rows if is_series(r)], user_id)
+            for row in rows:
+                yield task_to_vcalendar(row, stamp, skipped.get(row.id))
+        yield "END:VCALENDAR\r\n"
+
+    yield from _chunked(pieces())
+
+
+def stream_export(dataset: str, fmt: str, user_id: int = 1, include_archived: bool = False) -> Iterator[bytes]:
+    if fmt == "ics":
+        return stream_ics(user_id, include_archived)
+    if fmt == "csv":
+        return stream_csv(dataset, user_id, include_archived)
+    return stream_ndjson(dataset, user_id, include_archived)
@@ -2,64 +2,120 @@
 Load analysis, tips generation, overdue detection.
 """
 from datetime import datetime, date, timedelta
+from sqlalchemy import and_, or_, case, func
 from sqlalchemy.orm import Session
 from database import Task, UserProfile, DailyStats
+from services.recurrence import expand_series, is_series, day_window
+from services.overdue_rule import is_overdue, overdue_clause
+from services.archive import task_source
 
 
-def calculate_day_load(db: Session, target_date: date, user_id: int = 1) -> dict:
-    """Returns load metrics for a given day."""
-    user = db.query(UserProfile).filter(UserProfile.id == user_id).first()
-    max_minutes = (user.max_daily_hours if user else 8.0) * 60
-
-    tasks = db.query(Task).filter(
-        Task.user_id == user_id,
-        Task.status != "completed",
-    ).all()
-
-    day_tasks = [
-        t for t in tasks
-        if t.start_datetime and t.start_datetime.date() == target_date
-    ]
-
-    planned_minutes = sum(t.duration_minutes or 30 for t in day_tasks)
-    critical = [t for t in day_tasks if t.priority == "critical"]
-    high = [t for t in day_tasks if t.priority == "high"]
-
+def load_metrics(target_date: date, tasks_count: int, planned_minutes: int,
+                 critical_count: int, high_count: int, max_minutes: float) -> dict:
     load_pct = min(planned_minutes / max_minutes, 1.5) if max_minutes else 0
     overloaded = load_pct > 1.0
 
     return {
         "date": str(target_date),
-        "tasks_count": len(day_tasks),
+        "tasks_count": tasks_count,
         "planned_minutes": planned_minutes,
         "max_minutes": int(max_minutes),
         "load_percent": round(load_pct * 100),
         "overloaded": overloaded,
-        "critical_count": len(critical),
-        "high_count": len(high),
+        "critical_count": critical_count,
+        "high_count": high_count,
     }
 
 
-def get_overdue_tasks(db: Session, user_id: int = 1) -> list:
-    now = datetime.utcnow()
+def day_load(day_tasks: list, target_date: date, max_minutes: float) -> dict:
+    """Load metrics from the day's open tasks (and occurrences' master tasks)."""
+    return load_metrics(
+        target_date,
+        len(day_tasks),
+        sum(t.duration_minutes or 30 for t in day_tasks),
+        sum(1 for t in day_tasks if t.priority == "critical"),
+        sum(1 for t in day_tasks if t.priority == "high"),
+        max_minutes,
+    )
+
+
+def calculate_day_load(db: Session, target_date: date, user_id: int = 1) -> dict:
+    """Returns load metrics for a given day."""
+    max_minutes = max_daily_minutes(db, user_id)
+
+    day_start, day_end = day_window(target_date)
     tasks = db.query(Task).filter(
         Task.user_id == user_id,
-        Task.status == "pending",
+        Task.status != "completed",
+        Task.start_datetime >= day_start,
+        Task.start_datetime < day_end,
     ).all()
-    overdue = []
-    for t in tasks:
-        if t.deadline and t.deadline < now:
-            overdue.append(t)
-        elif t.start_datetime and t.end_datetime and t.end_datetime < now:
-            overdue.append(t)
-    return overdue
+    day_tasks = [t for t in tasks if not is_series(t)]
+
+    # Вхождения повторяющихся задач считаются как обычные задачи дня
+    day_tasks += [o.task for o in expand_series(db, user_id, day_start, day_end) if o.status != "completed"]
+    return day_load(day_tasks, target_date, max_minutes)
+
+
+def calculate_range_load(db: Session, date_from: date, date_to: date, user_id: int = 1) -> list[dict]:
+    """
+    Загрузка по каждому дню [date_from, date_to] (включительно) одним GROUP BY
+    по дню начала; те же метрики, что и calculate_day_load. Серии — по вхождениям.
+    """
+    max_minutes = max_daily_minutes(db, user_id)
+    start, _ = day_window(date_from)
+    _, end = day_window(date_to)
+
+    day = func.date(Task.start_datetime).label("day")
+    rows = db.query(
+        day,
+        func.count(Task.id),
+        func.sum(func.coalesce(Task.duration_minutes, 30)),
+        func.sum(case((Task.priority == "critical", 1), else_=0)),
+        func.sum(case((Task.priority == "high", 1), else_=0)),
+    ).filter(
+        Task.user_id == user_id,
+        Task.status != "completed",
+        Task.start_datetime >= start,
+        Task.start_datetime < end,
+        or_(Task.is_recurring.isnot(True), Task.recurrence_rule.is_(None)),
+    ).group_by(day).all()
+
+    # [count, minutes, critical, high] по дням
+    # str(): на SQLite date() — строка, на PostgreSQL — datetime.date
+    acc = {str(d): [int(v or 0) for v in rest] for d, *rest in rows}
+    for occ in expand_series(db, user_id, start, end):
+        if occ.status == "completed":
+            continue
+        a = acc.setdefault(str(occ.start_datetime.date()), [0, 0, 0, 0])
+        a[0] += 1
+        a[1] += occ.task.duration_minutes or 30
+        a[2] += occ.task.priority == "critical"
+        a[3] += occ.task.priority == "high"
+
+    result = []
+    current = date_from
+    while current <= date_to:
+        result.append(load_metrics(current, *acc.get(str(current), (0, 0, 0, 0)), max_minutes))
+        current += timedelta(days=1)
+    return result
+
+
+def select_overdue(tasks: list, now: datetime = None) -> list:
+    """Overdue tasks among the given ones (same rule as get_overdue_tasks)."""
+    now = now or datetime.now()
+    return sorted((t for t in tasks if is_overdue(t, now)), key=lambda t: t.id)
+
+
+def get_overdue_tasks(db: Session, user_id: int = 1) -> list:
+    return db.query(Task).filter(
+        Task.user_id == user_id,
+        overdue_clause(),
+    ).order_by(Task.id).all()
 
 
-def generate_tips(db: Session, user_id: int = 1) -> list[str]:
+def build_tips(load: dict, tomorrow_load: dict, overdue: list) -> list[str]:
     tips = []
-    today = date.today()
-    load = calculate_day_load(db, today, user_id)
-    overdue = get_overdue_tasks(db, user_id)
 
     if load["overloaded"]:
         tips.append(
@@ -74,8 +130,6 @@ def generate_tips(db: Session, user_id: int = 1) -> list[str]:
     if load["critical_count"] > 0:
         tips.append(f"🔥 Сегодня {load['critical_count']} критических задач. Начните с них!")
 
-    tomorrow = today + timedelta(days=1)
-    tomorrow_load = calculate_day_load(db, tomorrow, user_id)
     if tomorrow_load["tasks_count"] == 0 and overdue:
         tips.append("💡 Завтра у вас свободно — можно перенести просроченные задачи туда.")
 
@@ -88,58 +142,273 @@ def generate_tips(db: Session, user_id: int = 1) -> list[str]:
     return tips
 
 
-def update_daily_stats(db: Session, user_id: int = 1, target_date: date = None):
-    """Snapshot today's stats into DailyStats table."""
-    if target_date is None:
-        target_date = date.today()
-    date_str = str(target_date)
+def generate_tips(db: Session, user_id: int = 1, load: dict = None) -> list[str]:
+    today = date.today()
+    if load is None:
+        load = calculate_day_load(db, today, user_id)
+    tomorrow_load = calculate_day_load(db, today + timedelta(days=1), user_id)
+    return build_tips(load, tomorrow_load, get_overdue_tasks(db, user_id))
+
+
+# ─── DAILY STATS ──────────────────────────────────────────────────────────────
+# DailyStats поддерживается инкрементально: каждая мутация применяет разницу
+# вклада задачи «до» и «после» к затронутым дням. update_daily_stats — полный
+# пересчёт дня, оставлен как ремонтная операция.
+
+def task_stats_snapshot(task: Task) -> dict | None:
+    """Поля задачи, от которых зависит её вклад в DailyStats."""
+    if task is None:
+        return None
+    return {
+        "start_datetime": task.start_datetime,
+        "deadline": task.deadline,
+        "status": task.status,
+        "duration_minutes": task.duration_minutes,
+        "series": is_series(task),
+        "recurrence_rule": task.recurrence_rule,
+    }
+
+
+def day_contributions(snap: dict | None) -> dict:
+    """{date_str: (total, completed, overdue, planned_min, done_min)} для одной задачи."""
+    if not snap or snap.get("series"):
+        # Серии не имеют конечного набора дней — их вхождения учитываются при пересчёте дня
+        return {}
+    days = set()
+    if snap["start_datetime"]:
+        days.add(snap["start_datetime"].date())
+    if snap["deadline"]:
+        days.add(snap["deadline"].date())
+
+    minutes = snap["duration_minutes"] or 30
+    completed = snap["status"] == "completed"
+    result = {}
+    for day in days:
+        overdue = snap["status"] == "pending" and snap["deadline"] and snap["deadline"].date() < day
+        result[str(day)] = (
+            1,
+            int(completed),
+            int(bool(overdue)),
+            minutes,
+            minutes if completed else 0,
+        )
+    return result
+
 
-    all_tasks = db.query(Task).filter(Task.user_id == user_id).all()
-    day_tasks = [
-        t for t in all_tasks
-        if (t.start_datetime and t.start_datetime.date() == target_date)
-        or (t.deadline and t.deadline.date() == target_date)
-    ]
-
-    completed = [t for t in day_tasks if t.status == "completed"]
-    overdue = [
-        t for t in day_tasks
-        if t.status == "pending" and t.deadline and t.deadline.date() < target_date
-    ]
-    planned_min = sum(t.duration_minutes or 30 for t in day_tasks)
-    done_min = sum(t.duration_minutes or 30 for t in completed)
-
-    # Правильный расчёт load_score: отношение запланированного к максимуму (0.0 - 1.5+)
+def max_daily_minutes(db: Session, user_id: int) -> float:
     user = db.query(UserProfile).filter(UserProfile.id == user_id).first()
-    max_minutes = (user.max_daily_hours if user else 8.0) * 60
-    load_score = min(planned_min / max_minutes, 1.5) if max_minutes > 0 else 0.0
+    return (user.max_daily_hours if user else 8.0) * 60
 
-    all_done = len(day_tasks) > 0 and len(completed) == len(day_tasks)
 
-    existing = db.query(DailyStats).filter(
+def _finalize_day(row: DailyStats, max_minutes: float):
+    row.load_score = min(row.total_minutes_planned / max_minutes, 1.5) if max_minutes > 0 else 0.0
+    row.all_done = row.tasks_total > 0 and row.tasks_completed == row.tasks_total
+
+
+def _recompute_day(db: Session, user_id: int, target_date: date, max_minutes: float) -> DailyStats:
+    """
+    Пересчитывает один день с нуля; выборка только задач этого дня (по индексам).
+    Архивные задачи входят в день так же, как в stats_backfill.
+    """
+    date_str = str(target_date)
+    day_start, day_end = day_window(target_date)
+
+    T = task_source(include_archived=True)
+    day_tasks = db.query(
+        T.start_datetime, T.deadline, T.status, T.duration_minutes,
+        T.is_recurring, T.recurrence_rule,
+    ).filter(
+        T.user_id == user_id,
+        or_(
+            and_(T.start_datetime >= day_start, T.start_datetime < day_end),
+            and_(T.deadline >= day_start, T.deadline < day_end),
+        ),
+    ).all()
+
+    totals = [0, 0, 0, 0, 0]
+    for t in day_tasks:
+        contrib = day_contributions(task_stats_snapshot(t)).get(date_str)
+        if contrib:
+            totals = [a + b for a, b in zip(totals, contrib)]
+    for occ in expand_series(db, user_id, day_start, day_end):
+        minutes = occ.task.duration_minutes or 30
+        completed = occ.status == "completed"
+        totals = [a + b for a, b in zip(totals, (1, int(completed), 0, minutes, minutes if completed else 0))]
+
+    row = db.query(DailyStats).filter(
         DailyStats.user_id == user_id,
         DailyStats.date == date_str,
     ).first()
+    if not row:
+        row = DailyStats(user_id=user_id, date=date_str)
+        db.add(row)
+
+    (row.tasks_total, row.tasks_completed, row.tasks_overdue,
+     row.total_minutes_planned, row.total_minutes_done) = totals
+    _finalize_day(row, max_minutes)
+    return row
+
+
+def apply_stats_delta(db: Session, before: dict | None, after: dict | None, user_id: int = 1):
+    """
+    Применяет изменение одной задачи (снимки до/после) к DailyStats.
+    Затрагивает только дни задачи — оба, если её перенесли. Не коммитит:
+    вызывается в той же транзакции, что и сама мутация.
+    """
+    apply_stats_deltas(db, [(before, after)], user_id)
+
+
+def range_day_totals(db: Session, user_id: int, date_from: date, date_to: date) -> tuple[dict, int]:
+    """
+    Вклад всех задач (горячих и архивных) и вхождений серий в дни [date_from, date_to]
+    одним проходом: {date_str: [total, completed, overdue, planned_min, done_min]}
+    и число просмотренных задач. Общая основа stats_backfill и пересчёта по сериям.
+    """
+    start, _ = day_window(date_from)
+    _, end = day_window(date_to)
+
+    T = task_source(include_archived=True)
+    rows = db.query(
+        T.start_datetime, T.deadline, T.status, T.duration_minutes,
+        T.is_recurring, T.recurrence_rule,
+    ).filter(
+        T.user_id == user_id,
+        or_(
+            and_(T.start_datetime >= start, T.start_datetime < end),
+            and_(T.deadline >= start, T.deadline < end),
+        ),
+    ).all()
+
+    first, last = str(date_from), str(date_to)
+    totals: dict[str, list] = {}
+    for row in rows:
+        for day, contrib in day_contributions(task_stats_snapshot(row)).items():
+            if first <= day <= last:
+                acc = totals.setdefault(day, [0, 0, 0, 0, 0])
+                for i, v in enumerate(contrib):
+                    acc[i] += v
+    for occ in expand_series(db, user_id, start, end):
+        minutes = occ.task.duration_minutes or 30
+        completed = occ.status == "completed"
+        acc = totals.setdefault(str(occ.start_datetime.date()), [0, 0, 0, 0, 0])
+        for i, v in enumerate((1, int(completed), 0, minutes, minutes if completed else 0)):
+            acc[i] += v
+    return totals, len(rows)
 
-    if existing:
-        existing.tasks_total = len(day_tasks)
-        existing.tasks_completed = len(completed)
-        existing.tasks_overdue = len(overdue)
-        existing.total_minutes_planned = planned_min
-        existing.total_minutes_done = done_min
-        existing.load_score = load_score
-        existing.all_done = all_done
-    else:
-        stats = DailyStats(
-            user_id=user_id,
-            date=date_str,
-            tasks_total=len(day_tasks),
-            tasks_completed=len(completed),
-            tasks_overdue=len(overdue),
-            total_minutes_planned=planned_min,
-            total_minutes_done=done_min,
-            load_score=load_score,
-            all_done=all_done,
+
+def _series_window_start(db: Session, user_id: int, changes: list) -> date | None:
+    """
+    Первый день, который могли затронуть изменения серий в пачке; None — серии не менялись
+    (правка названия и т.п. вклад вхождений не меняет).
+    """
+    starts = []
+    for before, after in changes:
+        if before == after:
+            continue
+        for snap in (before, after):
+            if snap and snap.get("series"):
+                starts.append(snap["start_datetime"].date() if snap["start_datetime"] else None)
+    if not starts:
+        return None
+    if None not in starts:
+        return min(starts)
+    first = db.query(func.min(DailyStats.date)).filter(DailyStats.user_id == user_id).scalar()
+    return min([d for d in starts if d] + ([date.fromisoformat(first)] if first else [date.today()]))
+
+
+def _recompute_series_window(db: Session, user_id: int, date_from: date):
+    """
+    Пересчёт существующих строк DailyStats с date_from до последнего записанного дня
+    (и сегодняшней) одним проходом range_day_totals. Строки — ORM-объекты, чтобы
+    серии дней (services/streaks.py) обновились хуками сессии.
+    """
+    db.flush()
+    today = date.today()
+    last = db.query(func.max(DailyStats.date)).filter(DailyStats.user_id == user_id).scalar()
+    date_to = max(today, date.fromisoformat(last)) if last else today
+    if date_from > date_to:
+        return
+    totals, _ = range_day_totals(db, user_id, date_from, date_to)
+    max_minutes = max_daily_minutes(db, user_id)
+
+    rows = {
+        r.date: r
+        for r in db.query(DailyStats).filter(
+            DailyStats.user_id == user_id,
+            DailyStats.date >= str(date_from),
+            DailyStats.date <= str(date_to),
         )
-        db.add(stats)
-    db.commit()
\ No newline at end of file
+    }
+    if date_from <= today and str(today) not in rows:
+        rows[str(today)] = DailyStats(user_id=user_id, date=str(today))
+        db.add(rows[str(today)])
+    for day, row in rows.items():
+        (row.tasks_total, row.tasks_completed, row.tasks_overdue,
+         row.total_minutes_planned, row.total_minutes_done) = totals.get(day, (0, 0, 0, 0, 0))
+        _finalize_day(row, max_minutes)
+
+
+def apply_stats_deltas(db: Session, changes: list, user_id: int = 1):
+    """То же для пачки изменений [(before, after), ...] — одно обновление DailyStats на всю пачку."""
+    delta = {}
+    for before, after in changes:
+        for sign, snap in ((-1, before), (1, after)):
+            for day, contrib in day_contributions(snap).items():
+                acc = delta.setdefault(day, [0, 0, 0, 0, 0])
+                for i, v in enumerate(contrib):
+                    acc[i] += sign * v
+    delta = {day: d for day, d in delta.items() if any(d)}
+    series_from = _series_window_start(db, user_id, changes)
+    _apply_day_delta(db, user_id, delta)
+    # Серия вкладывается в неограниченный набор дней: существующие строки от её начала
+    # пересчитываются целиком (поверх дельты — та же транзакция, данные уже изменены)
+    if series_from is not None:
+        _recompute_series_window(db, user_id, series_from)
+
+
+def _apply_day_delta(db: Session, user_id: int, delta: dict):
+    if not delta:
+        return
+
+    max_minutes = max_daily_minutes(db, user_id)
+    rows = {
+        r.date: r
+        for r in db.query(DailyStats).filter(
+            DailyStats.user_id == user_id,
+            DailyStats.date.in_(list(delta)),
+        ).all()
+    }
+
+    missing = [day for day in delta if day not in rows]
+    if missing:
+        # Дня ещё нет в DailyStats — считаем его целиком по уже изменённым данным
+        db.flush()
+        for day in missing:
+            _recompute_day(db, user_id, date.fromisoformat(day), max_minutes)
+
+    for day, row in rows.items():
+        total, completed, overdue, planned, done = delta[day]
+        row.tasks_total = max((row.tasks_total or 0) + total, 0)
+        row.tasks_completed = max((row.tasks_completed or 0) + completed, 0)
+        row.tasks_overdue = max((row.tasks_overdue or 0) + overdue, 0)
+        row.total_minutes_planned = max((row.total_minutes_planned or 0) + planned, 0)
+        row.total_minutes_done = max((row.total_minutes_done or 0) + done, 0)
+        _finalize_day(row, max_minutes)
+
+
+def recompute_days(db: Session, user_id: int, days):
+    """Полный пересчёт набора дней (строки дат) в текущей транзакции. Не коммитит."""
+    if not days:
+        return
+    db.flush()
+    max_minutes = max_daily_minutes(db, user_id)
+    for day in days:
+        _recompute_day(db, user_id, date.fromisoformat(day), max_minutes)
+
+
+def update_daily_stats(db: Session, user_id: int = 1, target_date: date = None):
+    """Full recompute of one day's DailyStats row (repair job)."""
+    if target_date is None:
+        target_date = date.today()
+    _recompute_day(db, user_id, target_date, max_daily_minutes(db, user_id))
+    db.commit()
@@ -0,0 +1,65 @@
+"""
+Единое правило просрочки задачи.
+
+Задача просрочена, если она не выполнена, не является серией и наступил её
+срок — самый ранний из deadline, end_datetime и start_datetime + duration_minutes.
+Статус overdue, уже проставленный overdue_scheduler, тоже считается просрочкой.
+
+Одно и то же правило в двух формах:
+- Python (due_at / is_past_due / is_overdue) — для одной задачи в памяти;
+- SQL (overdue_clause) — для выборок; каждая ветка OR идёт по своему частичному
+  индексу из database.py, поэтому поиск — range scan, а не загрузка всех задач.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, or_, literal_column
+
+from database import Task, TASK_NOT_COMPLETED, TASK_DURATION_END
+
+OPEN_STATUSES = ("pending", "in_progress")
+
+
+def _recurring(task) -> bool:
+    # То же, что SQL-условие ниже: серии не просрочиваются, просрочиваются их вхождения
+    return bool(task.is_recurring and task.recurrence_rule)
+
+
+def due_at(task) -> Optional[datetime]:
+    """Момент, когда задача станет просроченной; None — если срока нет."""
+    if _recurring(task):
+        return None
+    moments = [m for m in (task.deadline, task.end_datetime) if m]
+    if task.start_datetime and task.duration_minutes:
+        moments.append(task.start_datetime + timedelta(minutes=task.duration_minutes))
+    return min(moments) if moments else None
+
+
+def is_past_due(task, now: Optional[datetime] = None) -> bool:
+    """Срок прошёл, а задача не выполнена (без учёта текущего статуса overdue)."""
+    if task.status == "completed":
+        return False
+    due = due_at(task)
+    return due is not None and due < (now or datetime.now())
+
+
+def is_overdue(task, now: Optional[datetime] = None) -> bool:
+    if task.status == "overdue":
+        return not _recurring(task)
+    return task.status in OPEN_STATUSES and is_past_due(task, now)
+
+
+def overdue_clause(now: Optional[datetime] = None):
+    """SQL-форма is_overdue. Ветки OR разнесены так, чтобы каждая шла по своему индексу."""
+    now = now or datetime.now()
+    is_open = Task.status.in_([literal_column(f"'{s}'") for s in OPEN_STATUSES])
+    return and_(
+        TASK_NOT_COMPLETED,
+        or_(Task.is_recurring.isnot(True), Task.recurrence_rule.is_(None)),
+        or_(
+            Task.status == literal_column("'overdue'"),
+            and_(Task.deadline < now, is_open),
+            and_(Task.end_datetime < now, is_open),
+            and_(TASK_DURATION_END < now, is_open),
+        ),
+    )
@@ -0,0 +1,161 @@
+"""
+Background overdue scheduler.
+
+Держит очередь (heap) моментов, когда открытые задачи становятся просроченными
+(срок — по правилу services/overdue_rule.py), и переводит их в overdue пачками в одной транзакции.
+При SHARD_MODE=per_user очередь общая, а запись идёт в шард владельца задачи.
+Читающие эндпоинты больше не пересчитывают статусы и не коммитят.
+"""
+import heapq
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import Task
+from services.load_analyzer import apply_stats_delta, task_stats_snapshot
+from services.changelog import record_task_changes
+from services.overdue_rule import OPEN_STATUSES, due_at
+from services.shards import shard_directory, open_session
+RESYNC_INTERVAL = timedelta(hours=1)   # полная пересборка очереди на случай внешних записей
+BATCH_SIZE = 500
+
+
+class OverdueScheduler:
+    def __init__(self):
+        self._heap: list[tuple[datetime, int, int]] = []   # (срок, user_id, task_id)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._next_resync = datetime.min
+
+    # ─── public API ───────────────────────────────────────────────────────────
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._next_resync = datetime.min
+        self._thread = threading.Thread(target=self._run, name="overdue-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def schedule(self, task: Task):
+        """Вызывается после коммита мутации. Устаревшие записи в очереди безвредны —
+        при срабатывании задача перечитывается из БД."""
+        if task.status not in OPEN_STATUSES:
+            return
+        due = due_at(task)
+        if due is None:
+            return
+        with self._cond:
+            entry = (due, task.user_id, task.id)
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] == entry:
+                self._cond.notify()
+
+    # ─── worker ───────────────────────────────────────────────────────────────
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = datetime.now()
+                if now >= self._next_resync:
+                    wait = 0
+                else:
+                    wake_at = self._next_resync
+                    if self._heap and self._heap[0][0] < wake_at:
+                        wake_at = self._heap[0][0]
+                    wait = (wake_at - now).total_seconds()
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+
+            try:
+                if datetime.now() >= self._next_resync:
+                    self._resync()
+                self._flush_due()
+            except Exception as e:
+                print(f"[Overdue] ERROR: {e}")
+                with self._cond:
+                    self._cond.wait(timeout=30)
+
+    def _resync(self):
+        """Пересобирает очередь по всем открытым задачам всех пользователей."""
+        heap = []
+        for user_id in shard_directory.user_ids():
+            db = open_session(user_id)
+            try:
+                rows = db.query(
+                    Task.id, Task.start_datetime, Task.end_datetime, Task.duration_minutes, Task.deadline,
+                    Task.is_recurring, Task.recurrence_rule,
+                ).filter(
+                    Task.user_id == user_id,
+                    Task.status.in_(OPEN_STATUSES),
+                ).all()
+            finally:
+                db.close()
+            for row in rows:
+                due = due_at(row)
+                if due is not None:
+                    heap.append((due, user_id, row.id))
+        heapq.heapify(heap)
+
+        with self._cond:
+            self._heap = heap
+            self._next_resync = datetime.now() + RESYNC_INTERVAL
+
+    def _flush_due(self):
+        now = datetime.now()
+        with self._cond:
+            due_ids: dict[int, set] = defaultdict(set)
+            taken = 0
+            while self._heap and self._heap[0][0] <= now and taken < BATCH_SIZE:
+                _, user_id, task_id = heapq.heappop(self._heap)
+                due_ids[user_id].add(task_id)
+                taken += 1
+
+        for user_id, task_ids in due_ids.items():
+            self._flush_user(user_id, task_ids, now)
+
+    def _flush_user(self, user_id: int, task_ids: set, now: datetime):
+        db = open_session(user_id)
+        try:
+            tasks = db.query(Task).filter(
+                Task.id.in_(task_ids),
+                Task.user_id == user_id,
+                Task.status.in_(OPEN_STATUSES),
+            ).all()
+            flipped = 0
+            for task in tasks:
+                due = due_at(task)
+                if due is None:
+                    continue
+                if due <= now:
+                    before = task_stats_snapshot(task)
+                    task.status = "overdue"
+                    task.updated_at = now
+                    apply_stats_delta(db, before, task_stats_snapshot(task), user_id=task.user_id)
+                    record_task_changes(db, [task], user_id=task.user_id)
+                    flipped += 1
+                else:
+                    # Задачу перенесли — ставим в очередь на новый момент
+                    with self._cond:
+                        heapq.heappush(self._heap, (due, user_id, task.id))
+            if flipped:
+                db.commit()
+                print(f"[Overdue] {flipped} задач(и) переведены в overdue")
+        finally:
+            db.close()
+
+
+overdue_scheduler = OverdueScheduler()
@@ -0,0 +1,75 @@
+"""
+Keyset (cursor) pagination по (created_at, id).
+
+Курсор — непрозрачная строка с created_at и id граничной строки.
+Стоимость страницы не зависит от объёма истории: выборка идёт по индексу
+(user_id, created_at, id) без OFFSET.
+"""
+import base64
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, or_
+
+CURSOR_HEADERS = ["X-Cursor-Before", "X-Cursor-After"]
+
+
+def encode_cursor(row) -> str:
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+
+def copy_cursor_headers(src: Response, dst: Response) -> Response:
+    """Переносит курсоры на ответ, который эндпоинт возвращает сам (например FastJSONResponse)."""
+    for name in CURSOR_HEADERS:
+        if name in src.headers:
+            dst.headers[name] = src.headers[name]
+    return dst
+
+
+def keyset_page(query, model, limit: int, before: Optional[str] = None, after: Optional[str] = None,
+                newest_first: bool = False, response: Optional[Response] = None) -> list:
+    """
+    Одна страница query в порядке (created_at, id).
+    - before=<cursor> — строки старше курсора (ближайшие к нему)
+    - after=<cursor>  — строки новее курсора
+    - без курсора     — самые новые строки
+    Курсоры соседних страниц кладутся в заголовки X-Cursor-Before / X-Cursor-After.
+    """
+    if before and after:
+        raise HTTPException(400, "Use either 'before' or 'after', not both")
+
+    if after:
+        ts, row_id = decode_cursor(after)
+        query = query.filter(or_(
+            model.created_at > ts,
+            and_(model.created_at == ts, model.id > row_id),
+        ))
+        rows = query.order_by(model.created_at.asc(), model.id.asc()).limit(limit).all()
+    else:
+        if before:
+            ts, row_id = decode_cursor(before)
+            query = query.filter(or_(
+                model.created_at < ts,
+                and_(model.created_at == ts, model.id < row_id),
+            ))
+        rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit).all()
+        rows.reverse()
+
+    if response is not None and rows:
+        response.headers["X-Cursor-Before"] = encode_cursor(rows[0])
+        response.headers["X-Cursor-After"] = encode_cursor(rows[-1])
+
+    if newest_first:
+        rows.reverse()
+    return rows
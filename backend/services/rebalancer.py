@@ -0,0 +1,187 @@
+"""
+Auto-rebalancing of overloaded days.
+
+Жадное распределение без LLM: для каждого дня диапазона считается ёмкость
+(max_daily_hours) и список свободных промежутков (бодрствование минус рабочий/
+учебный график, закреплённые задачи и вхождения серий). С перегруженных дней
+снимаются наименее важные задачи, к ним добавляются просроченные по времени
+начала — и всё это раскладывается по дням в порядке срочности: ближайший
+дедлайн, приоритет, urgency_score. Задача встаёт в первый день с остатком
+ёмкости и в первый подходящий по длине промежуток (first fit).
+
+Стоимость — O(задачи × дни) проверок ёмкости по массиву плюс поиск промежутка
+только в дне, где ёмкость позволяет; месяц с тысячами задач — десятки мс.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, date, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from database import Task, UserProfile
+from services.overdue_rule import OPEN_STATUSES, is_past_due
+from services.recurrence import expand_series, day_window
+from services.schedule_index import awake_window, schedule_blocks, task_minutes, task_span
+
+DEFAULT_MINUTES = 30
+PRIORITY_RANK = {"critical": 3, "high": 2, "medium": 1, "low": 0}
+MOVABLE_STATUSES = ("pending", "overdue")   # in_progress уже начата — не трогаем
+
+
+@dataclass
+class Day:
+    day: date
+    limit: int                         # max_daily_hours в минутах
+    capacity: int                      # остаток минут
+    gaps: list = field(default_factory=list)   # свободные [start, end) по возрастанию
+    planned_before: int = 0
+    planned_after: int = 0
+
+    def reserve(self, start: datetime, end: datetime):
+        """Вычитает занятый интервал из свободных промежутков."""
+        gaps = []
+        for g_start, g_end in self.gaps:
+            if g_end <= start or g_start >= end:
+                gaps.append((g_start, g_end))
+                continue
+            if g_start < start:
+                gaps.append((g_start, start))
+            if end < g_end:
+                gaps.append((end, g_end))
+        self.gaps = gaps
+
+    def first_fit(self, minutes: int) -> Optional[datetime]:
+        need = timedelta(minutes=minutes)
+        for g_start, g_end in self.gaps:
+            if g_end - g_start >= need:
+                return g_start
+        return None
+
+
+def _keep_order(task):
+    """Чем больше — тем важнее оставить задачу на месте."""
+    deadline_today = task.deadline is not None and task.deadline.date() <= task.start_datetime.date()
+    return (deadline_today, PRIORITY_RANK.get(task.priority, 1), task.urgency_score or 0)
+
+
+def _place_order(task):
+    """Порядок раскладки: ближайший дедлайн, затем приоритет и срочность."""
+    return (task.deadline or datetime.max, -PRIORITY_RANK.get(task.priority, 1), -(task.urgency_score or 0), task.id)
+
+
+def build_days(profile: Optional[UserProfile], date_from: date, date_to: date, now: datetime) -> dict[date, Day]:
+    max_minutes = int((profile.max_daily_hours if profile and profile.max_daily_hours else 8.0) * 60)
+    days = {}
+    current = date_from
+    while current <= date_to:
+        start, end = awake_window(profile, current)
+        start = max(start, now)
+        d = Day(current, max_minutes, max_minutes, [(start, end)] if end > start else [])
+        if profile:
+            for block in schedule_blocks(profile.work_schedule, current) + schedule_blocks(profile.study_schedule, current):
+                d.reserve(*block)
+        days[current] = d
+        current += timedelta(days=1)
+    return days
+
+
+def plan_rebalance(tasks: list, fixed: list, days: dict[date, Day], now: datetime) -> dict:
+    """
+    tasks — открытые задачи с началом в диапазоне и просроченные по времени начала;
+    fixed — интервалы (start, end, minutes), которые двигать нельзя (вхождения серий).
+    Возвращает {"moves": [(task, new_start, reason)], "unplaced": [task], "days": {...}}.
+    """
+    by_day: dict[date, list] = {}
+    to_place = []
+    fixed = list(fixed)
+    for t in tasks:
+        day = t.start_datetime.date()
+        if day in days and t.start_datetime >= now:
+            by_day.setdefault(day, []).append(t)
+        elif (t.status in MOVABLE_STATUSES and is_past_due(t, now)
+              and (t.deadline is None or t.deadline >= now)):
+            # Просрочена по времени начала, а дедлайн ещё впереди — есть куда переставить
+            to_place.append((t, "overdue"))
+        else:
+            fixed.append((t.start_datetime, t.start_datetime + task_span(t), task_minutes(t)))
+
+    for start, end, minutes in fixed:
+        d = days.get(start.date())
+        if d:
+            d.capacity -= minutes
+            d.planned_before += minutes
+            d.reserve(start, end)
+
+    for day, day_tasks in by_day.items():
+        d = days[day]
+        d.planned_before += sum(task_minutes(t) for t in day_tasks)
+        # Самые важные — остаются; лишнее сверх ёмкости уходит в раскладку
+        for t in sorted(day_tasks, key=_keep_order, reverse=True):
+            movable = t.status in MOVABLE_STATUSES and not _keep_order(t)[0]
+            if movable and task_minutes(t) > d.capacity:
+                to_place.append((t, "overloaded"))
+                continue
+            d.capacity -= task_minutes(t)
+            d.reserve(t.start_datetime, t.start_datetime + task_span(t))
+
+    for d in days.values():
+        d.planned_after = d.planned_before
+    ordered_days = sorted(days)
+    moves, unplaced = [], []
+    for t, reason in sorted(to_place, key=lambda p: _place_order(p[0])):
+        minutes = task_minutes(t)
+        last_day = t.deadline.date() if t.deadline else ordered_days[-1]
+        placed = None
+        for day in ordered_days:
+            if day > last_day:
+                break
+            d = days[day]
+            if d.capacity < minutes or (reason == "overloaded" and day == t.start_datetime.date()):
+                continue
+            slot = d.first_fit(minutes)
+            if slot is None:
+                continue
+            if t.deadline and slot + timedelta(minutes=minutes) > t.deadline:
+                continue
+            placed = slot
+            d.capacity -= minutes
+            d.planned_after += minutes
+            d.reserve(slot, slot + timedelta(minutes=minutes))
+            break
+        if placed is None:
+            unplaced.append(t)
+        else:
+            moves.append((t, placed, reason))
+            if reason == "overloaded":
+                days[t.start_datetime.date()].planned_after -= minutes
+
+    return {"moves": moves, "unplaced": unplaced, "days": days}
+
+
+def propose_rebalance(db: Session, date_from: date, date_to: date, user_id: int = 1) -> dict:
+    """Загружает задачи диапазона и просроченные одной выборкой и строит план."""
+    now = datetime.now().replace(second=0, microsecond=0)
+    date_from = max(date_from, now.date())
+    if date_to < date_from:
+        return {"moves": [], "unplaced": [], "days": {}}
+
+    profile = db.query(UserProfile).filter(UserProfile.id == user_id).first()
+    days = build_days(profile, date_from, date_to, now)
+    start, _ = day_window(date_from)
+    _, end = day_window(date_to)
+
+    tasks = db.query(Task).filter(
+        Task.user_id == user_id,
+        Task.status.in_(OPEN_STATUSES + ("overdue",)),
+        Task.start_datetime.isnot(None),
+        or_(Task.is_recurring.isnot(True), Task.recurrence_rule.is_(None)),
+        or_(and_(Task.start_datetime >= start, Task.start_datetime < end), Task.status == "overdue"),
+    ).all()
+
+    fixed = [
+        (o.start_datetime, o.end_datetime or o.start_datetime + timedelta(minutes=DEFAULT_MINUTES), task_minutes(o.task))
+        for o in expand_series(db, user_id, start, end)
+        if o.status != "completed"
+    ]
+    return plan_rebalance(tasks, fixed, days, now)
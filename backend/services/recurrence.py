@@ -0,0 +1,246 @@
+"""
+Lazy recurrence expansion for is_recurring / recurrence_rule tasks.
+
+Серия — задача-мастер с start_datetime и правилом в духе RRULE
+(FREQ=DAILY|WEEKLY|MONTHLY|YEARLY; INTERVAL; BYDAY; COUNT; UNTIL) или
+сокращением daily / weekly / weekdays / monthly / yearly.
+Вхождения не хранятся: они генерируются только внутри запрошенного окна,
+а отличия отдельных вхождений (выполнено, перенесено, пропущено) лежат
+разреженно в task_occurrences.
+"""
+import calendar
+from collections import namedtuple
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from database import Task, TaskOccurrence
+
+WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+SHORTCUTS = {
+    "daily": "FREQ=DAILY",
+    "weekly": "FREQ=WEEKLY",
+    "weekdays": "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR",
+    "monthly": "FREQ=MONTHLY",
+    "yearly": "FREQ=YEARLY",
+}
+
+Occurrence = namedtuple("Occurrence", "task occurrence_date start_datetime end_datetime status completed_at")
+
+
+@dataclass(frozen=True)
+class Rule:
+    freq: str
+    interval: int = 1
+    byday: tuple = ()
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+
+
+@lru_cache(maxsize=1024)
+def parse_rule(rule: Optional[str]) -> Optional[Rule]:
+    """Разбирает правило; None — если правило пустое или не поддерживается."""
+    if not rule:
+        return None
+    text = rule.strip()
+    text = SHORTCUTS.get(text.lower(), text)
+    if text.upper().startswith("RRULE:"):
+        text = text[6:]
+
+    parts = {}
+    for chunk in text.split(";"):
+        if "=" in chunk:
+            key, value = chunk.split("=", 1)
+            parts[key.strip().upper()] = value.strip().upper()
+
+    freq = parts.get("FREQ")
+    if freq not in ("DAILY", "WEEKLY", "MONTHLY", "YEARLY"):
+        return None
+    try:
+        interval = max(int(parts.get("INTERVAL", 1)), 1)
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+        byday = tuple(sorted({WEEKDAYS[d[-2:]] for d in parts["BYDAY"].split(",")})) if "BYDAY" in parts else ()
+        until = None
+        if "UNTIL" in parts:
+            raw = parts["UNTIL"].rstrip("Z")
+            until = datetime.strptime(raw, "%Y%m%dT%H%M%S") if "T" in raw else datetime.strptime(raw, "%Y%m%d").replace(hour=23, minute=59, second=59)
+    except (ValueError, KeyError):
+        return None
+    return Rule(freq, interval, byday, count, until)
+
+
+def is_series(task) -> bool:
+    """Задача разворачивается в серию (работает и для ORM-объектов, и для Row)."""
+    return bool(task.is_recurring and task.start_datetime and parse_rule(task.recurrence_rule))
+
+
+def _add_months(dt: datetime, months: int) -> Optional[datetime]:
+    """dt + months; None, если такого дня в месяце нет (31 февраля — пропускается, как в RRULE)."""
+    month_index = dt.month - 1 + months
+    year, month = dt.year + month_index // 12, month_index % 12 + 1
+    if dt.day > calendar.monthrange(year, month)[1]:
+        return None
+    return dt.replace(year=year, month=month)
+
+
+def _generate(rule: Rule, dtstart: datetime, window_start: datetime):
+    """Вхождения по возрастанию начиная примерно с window_start (пара (номер, момент))."""
+    if rule.freq == "DAILY":
+        step = timedelta(days=rule.interval)
+        k = 0
+        if window_start > dtstart:
+            k = -(-(window_start - dtstart) // step)  # ceil
+        while True:
+            yield k, dtstart + k * step
+            k += 1
+
+    elif rule.freq == "WEEKLY":
+        days = rule.byday or (dtstart.weekday(),)
+        monday = dtstart - timedelta(days=dtstart.weekday())
+        skipped_first = sum(1 for d in days if d < dtstart.weekday())
+        w = 0
+        if window_start > dtstart:
+            w = max((window_start - monday).days // (7 * rule.interval), 0)
+        n = w * len(days) - (skipped_first if w > 0 else 0)
+        while True:
+            week = monday + timedelta(weeks=w * rule.interval)
+            for d in days:
+                occ = week + timedelta(days=d)
+                if occ < dtstart:
+                    continue
+                yield n, occ
+                n += 1
+            w += 1
+
+    else:
+        step = 12 * rule.interval if rule.freq == "YEARLY" else rule.interval
+        m = 0
+        if window_start > dtstart and rule.count is None:
+            months = (window_start.year - dtstart.year) * 12 + window_start.month - dtstart.month
+            m = max(months // step - 1, 0)
+        n = 0
+        while True:
+            occ = _add_months(dtstart, m * step)
+            if occ is not None:
+                yield n, occ
+                n += 1
+            m += 1
+
+
+@lru_cache(maxsize=4096)
+def expand(rule_text: str, dtstart: datetime, window_start: datetime, window_end: datetime) -> tuple:
+    """Моменты начала вхождений в [window_start, window_end). Кэшируется по окну."""
+    rule = parse_rule(rule_text)
+    if rule is None or dtstart >= window_end:
+        return ()
+    result = []
+    for n, occ in _generate(rule, dtstart, window_start):
+        if occ >= window_end:
+            break
+        if rule.count is not None and n >= rule.count:
+            break
+        if rule.until is not None and occ > rule.until:
+            break
+        if occ >= window_start:
+            result.append(occ)
+    return tuple(result)
+
+
+def expand_series(db: Session, user_id: int, window_start: datetime, window_end: datetime,
+                  category: Optional[str] = None, masters: Optional[list] = None) -> list:
+    """
+    Все вхождения серий пользователя в окне с учётом переопределений.
+    Две выборки: мастера серий, начавшихся до конца окна, и переопределения
+    (по исходной дате или по новому времени, если вхождение перенесли в окно).
+    masters — уже загруженные задачи (ORM или Row), чтобы не запрашивать их повторно.
+    """
+    if masters is None:
+        query = db.query(Task).filter(
+            Task.user_id == user_id,
+            Task.is_recurring == True,  # noqa: E712
+            Task.recurrence_rule.isnot(None),
+            Task.start_datetime.isnot(None),
+            Task.start_datetime < window_end,
+        )
+        if category:
+            query = query.filter(Task.category == category)
+        masters = query.all()
+    masters = {
+        t.id: t for t in masters
+        if is_series(t) and t.start_datetime < window_end and (not category or t.category == category)
+    }
+    if not masters:
+        return []
+
+    overrides = {
+        (o.task_id, o.occurrence_date): o
+        for o in db.query(TaskOccurrence).filter(
+            TaskOccurrence.task_id.in_(list(masters)),
+            or_(
+                and_(TaskOccurrence.occurrence_date >= str(window_start.date()),
+                     TaskOccurrence.occurrence_date < str(window_end.date())),
+                and_(TaskOccurrence.start_datetime >= window_start,
+                     TaskOccurrence.start_datetime < window_end),
+            ),
+        ).all()
+    }
+
+    now = datetime.now()
+    result = []
+    seen = set()
+    for task in masters.values():
+        for occ_start in expand(task.recurrence_rule, task.start_datetime, window_start, window_end):
+            key = (task.id, str(occ_start.date()))
+            seen.add(key)
+            result.append(resolve_occurrence(task, occ_start, overrides.get(key), now))
+    # Вхождения, перенесённые в окно из-за его пределов
+    for key, ov in overrides.items():
+        if key not in seen and ov.start_datetime and window_start <= ov.start_datetime < window_end:
+            result.append(resolve_occurrence(masters[ov.task_id], ov.start_datetime, ov, now))
+
+    return [o for o in result if o is not None and window_start <= o.start_datetime < window_end]
+
+
+def find_occurrence_start(task: Task, occurrence_date: date) -> Optional[datetime]:
+    """Момент вхождения серии в указанный день по правилу (без переопределений)."""
+    occs = expand(task.recurrence_rule, task.start_datetime, *day_window(occurrence_date))
+    return occs[0] if occs else None
+
+
+def resolve_occurrence(task: Task, occ_start: datetime, ov: Optional[TaskOccurrence],
+                       now: Optional[datetime] = None) -> Optional[Occurrence]:
+    """Вхождение с применённым переопределением; None — если оно пропущено."""
+    now = now or datetime.now()
+    if ov is not None and ov.skipped:
+        return None
+    occurrence_date = str(occ_start.date()) if ov is None else ov.occurrence_date
+    start = ov.start_datetime if ov is not None and ov.start_datetime else occ_start
+    duration = task.duration_minutes
+    end = start + timedelta(minutes=duration) if duration else None
+
+    status = ov.status if ov is not None and ov.status else None
+    if status is None:
+        status = "overdue" if end and end < now else "pending"
+    return Occurrence(task, occurrence_date, start, end, status, ov.completed_at if ov is not None else None)
+
+
+def occurrence_to_dict(occ: Occurrence, base: dict) -> dict:
+    """base — task_to_dict мастера; поверх — поля вхождения (datetime, для FastJSONResponse)."""
+    return {
+        **base,
+        "status": occ.status,
+        "start_datetime": occ.start_datetime,
+        "end_datetime": occ.end_datetime,
+        "completed_at": occ.completed_at,
+        "occurrence_date": occ.occurrence_date,
+        "series_id": occ.task.id,
+    }
+
+
+def day_window(target_date: date) -> tuple[datetime, datetime]:
+    start = datetime.combine(target_date, datetime.min.time())
+    return start, start + timedelta(days=1)
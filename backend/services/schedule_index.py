@@ -0,0 +1,319 @@
+"""
+Per-user interval index over task start/end times.
+
+Для каждого пользователя держится массив интервалов (start, end, task_id),
+отсортированный по началу, и максимальная длина интервала. Пересечение с окном
+[a, b) — это бинарный поиск по началу в [a - max_len, b) и проверка end > a:
+O(log n + k) без прохода по всем задачам.
+
+Индекс строится лениво одним column-запросом и дальше обновляется
+инкрементально из хуков сессии (после успешного коммита) — так его видят все
+пути мутаций: роутеры, агент, overdue_scheduler.
+Серии в индекс не попадают: их вхождения разворачиваются по окну запроса.
+
+Индекс пользователя помечен версией его данных из services/cache.py (таблица
+data_versions). Перед чтением версия сверяется с базой: правки другого воркера
+или архиватора её сдвигают, и индекс строится заново. Свой коммит применяется
+инкрементально, только если индекс отставал ровно на эту транзакцию.
+Индексы держатся в LRU на INDEX_USERS пользователей.
+"""
+import bisect
+import heapq
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, date, time, timedelta
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Task, UserProfile
+from services.cache import data_versions
+from services.recurrence import is_series, expand_series, day_window
+
+INDEX_USERS = 256
+DEFAULT_MINUTES = 30   # длительность задачи без duration/end — как в плановой загрузке
+WEEKDAY_KEYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+_RANGE_RE = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*-\s*(\d{1,2})(?::(\d{2}))?\s*$")
+
+
+def task_span(task) -> timedelta:
+    """Сколько задача занимает в календаре: end − start, иначе duration_minutes (или 30 минут)."""
+    if task.start_datetime and task.end_datetime and task.end_datetime > task.start_datetime:
+        return task.end_datetime - task.start_datetime
+    return timedelta(minutes=task.duration_minutes or DEFAULT_MINUTES)
+
+
+def task_minutes(task) -> int:
+    """task_span в целых минутах с округлением вверх — для планирования по промежуткам."""
+    return -(-task_span(task) // timedelta(minutes=1))
+
+
+def task_interval(task) -> Optional[tuple[datetime, datetime]]:
+    """Занятый интервал задачи; None — если задача не занимает время в календаре."""
+    if task.status == "completed" or not task.start_datetime or is_series(task):
+        return None
+    return task.start_datetime, task.start_datetime + task_span(task)
+
+
+class UserIntervals:
+    def __init__(self, version: int = 0):
+        self.version = version   # версия данных пользователя, по которой построен индекс
+        self.items: list[tuple[datetime, datetime, int]] = []   # по (start, end, id)
+        self.by_id: dict[int, tuple[datetime, datetime, int]] = {}
+        self.max_len = timedelta(0)
+
+    def add(self, task_id: int, start: datetime, end: datetime):
+        self.remove(task_id)
+        item = (start, end, task_id)
+        bisect.insort(self.items, item)
+        self.by_id[task_id] = item
+        # max_len только растёт — после удалений граница остаётся верной, хоть и с запасом
+        self.max_len = max(self.max_len, end - start)
+
+    def remove(self, task_id: int):
+        item = self.by_id.pop(task_id, None)
+        if item is not None:
+            i = bisect.bisect_left(self.items, item)
+            del self.items[i]
+
+    def overlapping(self, start: datetime, end: datetime) -> list[tuple[datetime, datetime, int]]:
+        """Интервалы, пересекающие [start, end), по возрастанию начала."""
+        lo = bisect.bisect_left(self.items, (start - self.max_len,))
+        hi = bisect.bisect_left(self.items, (end,))
+        return [item for item in self.items[lo:hi] if item[1] > start]
+
+
+def series_intervals(db: Session, user_id: int, start: datetime, end: datetime) -> list:
+    """
+    Занятые интервалы открытых вхождений серий, пересекающие [start, end):
+    (start, end, (series_id, occurrence_date)). Вхождения, начавшиеся в предыдущие
+    сутки и ещё идущие в окне, тоже входят.
+    """
+    lookback, _ = day_window(start.date() - timedelta(days=1))
+    result = []
+    for occ in expand_series(db, user_id, lookback, end):
+        if occ.status == "completed":
+            continue
+        occ_end = occ.end_datetime or occ.start_datetime + timedelta(minutes=DEFAULT_MINUTES)
+        if occ_end > start:
+            result.append((occ.start_datetime, occ_end, (occ.task.id, occ.occurrence_date)))
+    return result
+
+
+def find_conflicts(items: list[tuple]) -> list[tuple]:
+    """
+    Пары пересекающихся интервалов заметанием: O(n log n + k). items — (start, end, key),
+    отсортированы по началу; результат — (key_a, key_b, start, end) пересечения.
+    """
+    conflicts = []
+    active: list[tuple[datetime, datetime, int]] = []   # heap по концу
+    for start, end, task_id in items:
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for other_end, other_start, other_id in active:
+            conflicts.append((other_id, task_id, start, min(end, other_end)))
+        heapq.heappush(active, (end, start, task_id))
+    return conflicts
+
+
+class IntervalIndex:
+    def __init__(self, maxsize: int = INDEX_USERS):
+        self.maxsize = maxsize
+        self._users: OrderedDict[int, UserIntervals] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, user_id: int) -> UserIntervals:
+        version = data_versions.get(db, user_id)
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None and index.version == version:
+                self._users.move_to_end(user_id)
+                return index
+
+        rows = db.query(
+            Task.id, Task.status, Task.start_datetime, Task.end_datetime, Task.duration_minutes,
+            Task.is_recurring, Task.recurrence_rule,
+        ).filter(
+            Task.user_id == user_id,
+            Task.status != "completed",
+            Task.start_datetime.isnot(None),
+        ).all()
+        index = UserIntervals(version)
+        for row in rows:
+            interval = task_interval(row)
+            if interval:
+                index.add(row.id, *interval)
+        if version is None:
+            # построен по незакоммиченным правкам сессии — только для этого запроса
+            return index
+        with self._lock:
+            current = self._users.get(user_id)
+            # параллельный запрос мог успеть положить индекс по более новой версии
+            if current is None or current.version < version:
+                self._users[user_id] = index
+                self._users.move_to_end(user_id)
+                while len(self._users) > self.maxsize:
+                    self._users.popitem(last=False)
+        return index
+
+    def apply(self, changes: list[tuple[int, int, Optional[tuple[datetime, datetime]]]], versions: dict[int, int]):
+        """
+        changes: (user_id, task_id, interval | None); versions: версии пользователей после коммита.
+        Индекс, отстававший ровно на эту транзакцию, догоняем; иначе (правки других
+        воркеров между ними) выбрасываем — следующий get построит заново.
+        """
+        with self._lock:
+            current = {}
+            for user_id, version in versions.items():
+                index = self._users.get(user_id)
+                if index is None:
+                    continue
+                if index.version == version - 1:
+                    index.version = version
+                    current[user_id] = index
+                else:
+                    del self._users[user_id]
+            for user_id, task_id, interval in changes:
+                index = current.get(user_id)
+                if index is None:
+                    continue
+                if interval is None:
+                    index.remove(task_id)
+                else:
+                    index.add(task_id, *interval)
+
+    def invalidate(self, user_ids=None):
+        with self._lock:
+            if user_ids is None:
+                self._users.clear()
+            else:
+                for user_id in user_ids:
+                    self._users.pop(user_id, None)
+
+    def overlapping(self, db: Session, user_id: int, start: datetime, end: datetime) -> list:
+        index = self.get(db, user_id)
+        with self._lock:
+            return index.overlapping(start, end)
+
+    def conflicts(self, db: Session, user_id: int, start: datetime, end: datetime) -> list:
+        """
+        Пересечения в окне: задачи из индекса и вхождения серий (как в free_slots).
+        Ключ интервала — (task_id, occurrence_date); у обычной задачи дата — "".
+        """
+        items = [(s, e, (task_id, "")) for s, e, task_id in self.overlapping(db, user_id, start, end)]
+        items += series_intervals(db, user_id, start, end)
+        items.sort()
+        return find_conflicts(items)
+
+
+interval_index = IntervalIndex()
+
+
+# ─── FREE SLOTS ───────────────────────────────────────────────────────────────
+
+def _parse_hhmm(value: Optional[str], default: time) -> time:
+    try:
+        hours, minutes = (value or "").split(":")
+        return time(int(hours), int(minutes))
+    except ValueError:
+        return default
+
+
+def schedule_blocks(schedule: Optional[dict], target_date: date) -> list[tuple[datetime, datetime]]:
+    """Блок из work_schedule / study_schedule ({"mon": "09-18"} или "09:00-18:00") на день."""
+    raw = (schedule or {}).get(WEEKDAY_KEYS[target_date.weekday()])
+    match = _RANGE_RE.match(raw or "")
+    if not match:
+        return []
+    h1, m1, h2, m2 = (int(g or 0) for g in match.groups())
+    if h1 > 23 or h2 > 24 or m1 > 59 or m2 > 59:
+        return []
+    start = datetime.combine(target_date, time(h1, m1))
+    end = datetime.combine(target_date, time(0)) + timedelta(hours=h2, minutes=m2)
+    return [(start, end)] if end > start else []
+
+
+def awake_window(profile: Optional[UserProfile], target_date: date) -> tuple[datetime, datetime]:
+    """[wake_time, sleep_time) дня; sleep_time раньше wake_time — значит после полуночи."""
+    wake = _parse_hhmm(profile.wake_time if profile else None, time(8, 0))
+    sleep = _parse_hhmm(profile.sleep_time if profile else None, time(23, 0))
+    start = datetime.combine(target_date, wake)
+    end = datetime.combine(target_date, sleep)
+    if end <= start:
+        end += timedelta(days=1)
+    return start, end
+
+
+def free_slots(db: Session, target_date: date, min_minutes: int = 30, user_id: int = 1) -> dict:
+    """
+    Свободные окна дня: бодрствование минус задачи, вхождения серий и рабочий/учебный
+    график. Для сегодняшнего дня окна начинаются не раньше текущего момента.
+    """
+    profile = db.query(UserProfile).filter(UserProfile.id == user_id).first()
+    day_start, day_end = awake_window(profile, target_date)
+    day_start = min(max(day_start, datetime.now().replace(second=0, microsecond=0)), day_end)
+
+    busy = [(s, e) for s, e, _ in interval_index.overlapping(db, user_id, day_start, day_end)]
+    busy += [(s, e) for s, e, _ in series_intervals(db, user_id, day_start, day_end)]
+    if profile:
+        busy += schedule_blocks(profile.work_schedule, target_date)
+        busy += schedule_blocks(profile.study_schedule, target_date)
+
+    slots = []
+    cursor = day_start
+    for start, end in sorted(busy):
+        if start - cursor >= timedelta(minutes=min_minutes):
+            slots.append((cursor, min(start, day_end)))
+        cursor = max(cursor, end)
+        if cursor >= day_end:
+            break
+    if day_end - cursor >= timedelta(minutes=min_minutes):
+        slots.append((cursor, day_end))
+
+    return {
+        "date": str(target_date),
+        "day_start": day_start,
+        "day_end": day_end,
+        "slots": [
+            {"start": s, "end": e, "minutes": int((e - s).total_seconds() // 60)}
+            for s, e in slots if e - s >= timedelta(minutes=min_minutes)
+        ],
+    }
+
+
+# ─── SESSION HOOKS ────────────────────────────────────────────────────────────
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_intervals(session, flush_context):
+    pending = session.info.setdefault("pending_intervals", [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Task) and obj.id is not None:
+            pending.append((obj.user_id, obj.id, task_interval(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Task):
+            pending.append((obj.user_id, obj.id, None))
+
+
+@event.listens_for(SessionLocal, "after_bulk_delete")
+@event.listens_for(SessionLocal, "after_bulk_update")
+def _bulk_task_write(context):
+    if context.mapper.class_ is Task:
+        context.session.info["intervals_stale"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_intervals(session):
+    pending = session.info.pop("pending_intervals", None)
+    versions = session.info.get("data_versions") or {}
+    if session.info.pop("intervals_stale", False):
+        interval_index.invalidate(versions)
+    elif versions:
+        interval_index.apply(pending or [], versions)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_intervals(session):
+    session.info.pop("pending_intervals", None)
+    session.info.pop("intervals_stale", None)
@@ -0,0 +1,48 @@
+"""
+Fast JSON serialization for list endpoints.
+
+orjson сериализует datetime сам (тот же формат, что и isoformat()), поэтому
+строки из column-projected запросов отдаются без промежуточного jsonable_encoder.
+Без orjson — откат на стандартный json.
+"""
+import json
+from datetime import date, datetime
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse на orjson. Возвращать явно — тогда FastAPI пропускает jsonable_encoder."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def rows_to_dicts(rows, defaults: dict = None) -> list[dict]:
+    """Row-кортежи column-projected запроса → словари; defaults заменяют NULL (например subtasks → [])."""
+    result = []
+    for row in rows:
+        d = row._asdict()
+        if defaults:
+            for key, value in defaults.items():
+                if d.get(key) is None:
+                    d[key] = value
+        result.append(d)
+    return result
@@ -0,0 +1,286 @@
+"""
+Per-user shard directory.
+
+SHARD_MODE=single (по умолчанию) — все пользователи живут в основной базе
+DATABASE_URL, как раньше. SHARD_MODE=per_user — у каждого пользователя свой
+файл SQLite (SHARD_DIR/user_<id>.db) с задачами, чатом, памятью и статистикой:
+писатели разных пользователей не делят одну блокировку, а данные одного
+пользователя малы и остаются в page cache.
+
+Каталог — таблица shard_directory в основной базе: user_id → URL шарда. Шард
+можно перенести (другой путь, другой сервер), поменяв строку каталога. Открытые
+движки шардов держатся в LRU на SHARD_ENGINE_CACHE штук; вытесненный движок
+закрывает свой пул. Шард создаётся при регистрации пользователя: схема,
+индексы, профиль, счётчики и серии.
+
+Пользователь запроса — current_user_id: заголовок X-User-Id (или ?user_id= для
+WebSocket, где заголовок из браузера не задать), по умолчанию 1. Сам по себе
+создаётся только пользователь по умолчанию; остальных заводят явно, незнакомый
+id получает 404 — иначе перебор id плодил бы файлы и строки каталога:
+    python -m services.shards register 2
+"""
+import argparse
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import Depends, HTTPException
+from fastapi.requests import HTTPConnection
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select, insert
+from sqlalchemy.engine import URL
+
+from database import (
+    BASE_DIR, SessionLocal, AsyncSessionLocal, UserProfile, engine, get_async_engine,
+    build_engine, async_url, resolve_url, create_tables, ensure_user,
+)
+from services.counters import ensure_task_counters
+from services.streaks import ensure_streaks
+
+SHARD_MODE = os.getenv("SHARD_MODE", "single").lower()
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")   # относительный путь — от BASE_DIR, как DATABASE_URL
+SHARD_ENGINE_CACHE = int(os.getenv("SHARD_ENGINE_CACHE", "64"))
+DEFAULT_USER_ID = 1
+
+directory_table = Table(
+    "shard_directory", MetaData(),
+    Column("user_id", Integer, primary_key=True),
+    Column("url", String(500), nullable=False),
+    Column("created_at", DateTime, default=lambda: datetime.now(timezone.utc)),
+)
+
+
+class UnknownUser(LookupError):
+    """Пользователь не зарегистрирован (нет профиля / строки каталога)."""
+
+
+class Shard:
+    def __init__(self, url: URL, sync_engine=None, shared_async_engine=None):
+        self.url = url
+        self.engine = sync_engine or build_engine(url)
+        self._shared_async_engine = shared_async_engine   # фабрика общего движка основной базы
+        self._async_engine = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._owned = sync_engine is None
+
+    @property
+    def async_engine(self):
+        # Создаётся лениво и только из async-кода: соединения aiosqlite привязаны к loop
+        if self._shared_async_engine is not None:
+            return self._shared_async_engine()
+        if self._async_engine is None:
+            self._async_engine = build_engine(async_url(self.url), use_async=True)
+            self._async_loop = asyncio.get_running_loop()
+        return self._async_engine
+
+    def dispose(self):
+        if not self._owned:
+            return
+        self.engine.dispose()
+        if self._async_engine is not None and self._async_loop is not None and not self._async_loop.is_closed():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is self._async_loop:
+                running.create_task(self._async_engine.dispose())
+            else:
+                asyncio.run_coroutine_threadsafe(self._async_engine.dispose(), self._async_loop)
+
+
+class ShardDirectory:
+    def __init__(self, mode: str = SHARD_MODE, shard_dir: str = SHARD_DIR, capacity: int = SHARD_ENGINE_CACHE):
+        self.mode = mode
+        # Один абсолютный путь и для makedirs, и для URL шардов — не зависит от cwd процесса
+        self.shard_dir = os.path.normpath(os.path.join(BASE_DIR, shard_dir))
+        self.capacity = capacity
+        self._main = Shard(engine.url, engine, get_async_engine)
+        self._shards: OrderedDict[int, Shard] = OrderedDict()
+        self._urls: dict[int, URL] = {}
+        self._provisioned: set[int] = set()
+        self._lock = threading.Lock()
+        self._provision_lock = threading.Lock()   # только для первого открытия пользователя
+        self._directory_ready = False
+
+    @property
+    def sharded(self) -> bool:
+        return self.mode == "per_user"
+
+    # ─── directory ───────────────────────────────────────────────────────────
+
+    def default_url(self, user_id: int) -> str:
+        return f"sqlite:///{os.path.join(self.shard_dir, f'user_{user_id}.db')}"
+
+    def _ensure_directory(self):
+        if not self._directory_ready:
+            directory_table.create(engine, checkfirst=True)
+            os.makedirs(self.shard_dir, exist_ok=True)
+            self._directory_ready = True
+
+    def lookup(self, user_id: int, create: bool = False) -> Optional[URL]:
+        """URL шарда из каталога; None — пользователя нет. create — назначить файл по умолчанию."""
+        url = self._urls.get(user_id)
+        if url is not None:
+            return url
+        self._ensure_directory()
+        with engine.begin() as conn:
+            raw = conn.execute(select(directory_table.c.url).where(directory_table.c.user_id == user_id)).scalar()
+            if raw is None:
+                if not create:
+                    return None
+                raw = self.default_url(user_id)
+                conn.execute(insert(directory_table).values(user_id=user_id, url=raw))
+        url = resolve_url(raw)
+        self._urls[user_id] = url
+        return url
+
+    def exists(self, user_id: int) -> bool:
+        """Зарегистрирован ли пользователь. Отрицательный ответ не кэшируется — память не растёт."""
+        if user_id in self._provisioned:
+            return True
+        if self.sharded:
+            return self.lookup(user_id) is not None
+        db = SessionLocal()
+        try:
+            return db.query(UserProfile.id).filter(UserProfile.id == user_id).first() is not None
+        finally:
+            db.close()
+
+    def register(self, user_id: int) -> Shard:
+        """Явно заводит пользователя: строка каталога, шард, профиль."""
+        if self.sharded:
+            self.lookup(user_id, create=True)
+        else:
+            self._provision(self._main, user_id)
+        return self.shard(user_id)
+
+    def user_ids(self) -> list[int]:
+        """Все известные пользователи — для фоновых задач, обходящих шарды."""
+        if not self.sharded:
+            db = SessionLocal()
+            try:
+                return [uid for (uid,) in db.query(UserProfile.id)]
+            finally:
+                db.close()
+        self._ensure_directory()
+        with engine.connect() as conn:
+            return [uid for (uid,) in conn.execute(select(directory_table.c.user_id))]
+
+    # ─── engines ─────────────────────────────────────────────────────────────
+
+    def _provision(self, shard: Shard, user_id: int):
+        with self._provision_lock:
+            if user_id in self._provisioned:
+                return
+            if self.sharded:
+                create_tables(shard.engine, user_id)
+                ensure_task_counters(shard.engine)
+                ensure_streaks(shard.engine)
+            else:
+                ensure_user(shard.engine, user_id)
+            self._provisioned.add(user_id)
+
+    def shard(self, user_id: int) -> Shard:
+        if user_id not in self._provisioned and user_id != DEFAULT_USER_ID and not self.exists(user_id):
+            raise UnknownUser(user_id)
+        if not self.sharded:
+            if user_id not in self._provisioned:
+                self._provision(self._main, user_id)
+            return self._main
+
+        with self._lock:
+            shard = self._shards.get(user_id)
+            if shard is not None:
+                self._shards.move_to_end(user_id)
+                return shard
+
+        # Открытие и создание шарда — вне общей блокировки, чтобы не тормозить горячих пользователей
+        shard = Shard(self.lookup(user_id, create=user_id == DEFAULT_USER_ID))
+        self._provision(shard, user_id)
+
+        evicted = []
+        with self._lock:
+            existing = self._shards.get(user_id)
+            if existing is not None:
+                evicted.append(shard)
+                shard = existing
+            else:
+                self._shards[user_id] = shard
+            self._shards.move_to_end(user_id)
+            while len(self._shards) > self.capacity:
+                _, old = self._shards.popitem(last=False)
+                evicted.append(old)
+        for old in evicted:
+            old.dispose()
+        return shard
+
+    def session(self, user_id: int):
+        """Синхронная сессия шарда пользователя (класс тот же — хуки работают)."""
+        return SessionLocal(bind=self.shard(user_id).engine)
+
+    def async_session(self, user_id: int):
+        return AsyncSessionLocal(bind=self.shard(user_id).async_engine)
+
+    def dispose_all(self):
+        with self._lock:
+            shards = list(self._shards.values())
+            self._shards.clear()
+        for shard in shards:
+            shard.dispose()
+
+
+shard_directory = ShardDirectory()
+
+
+def open_session(user_id: int = DEFAULT_USER_ID):
+    return shard_directory.session(user_id)
+
+
+# ─── FASTAPI DEPENDENCIES ─────────────────────────────────────────────────────
+
+def current_user_id(conn: HTTPConnection) -> int:
+    """Пользователь запроса. Аутентификации пока нет: X-User-Id, по умолчанию 1."""
+    raw = conn.headers.get("x-user-id") or conn.query_params.get("user_id")
+    if raw is None:
+        return DEFAULT_USER_ID
+    try:
+        user_id = int(raw)
+    except ValueError:
+        raise HTTPException(400, "Invalid user id")
+    if user_id < 1:
+        raise HTTPException(400, "Invalid user id")
+    if user_id != DEFAULT_USER_ID and not shard_directory.exists(user_id):
+        raise HTTPException(404, "Unknown user")
+    return user_id
+
+
+def get_user_db(user_id: int = Depends(current_user_id)):
+    db = shard_directory.session(user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_user_async_db(user_id: int = Depends(current_user_id)):
+    async with shard_directory.async_session(user_id) as db:
+        yield db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-user shard directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    register = commands.add_parser("register", help="Create a user (profile and, in per_user mode, a shard)")
+    register.add_argument("user_id", type=int)
+    args = parser.parse_args()
+
+    if args.user_id < 1:
+        parser.error("user_id must be positive")
+    shard = shard_directory.register(args.user_id)
+    print(f"[Shards] Пользователь {args.user_id}: {shard.url.render_as_string(hide_password=True)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+DailyStats backfill / range recompute.
+
+Пересчитывает DailyStats за произвольный диапазон одним проходом: одна выборка
+задач диапазона (по start_datetime или deadline), раскладка вкладов по дням в
+памяти, одна развёртка серий на весь диапазон и пакетная запись строк —
+вместо отдельного пересчёта каждого дня.
+
+Запуск из папки backend:
+    python -m services.stats_backfill --from 2021-01-01 [--to 2026-01-01] [--user 1]
+"""
+import argparse
+import time
+from datetime import date
+
+from sqlalchemy.orm import Session
+
+from database import DailyStats
+from services.load_analyzer import range_day_totals, max_daily_minutes
+from services.streaks import rebuild_streaks
+from services.shards import open_session
+
+
+def backfill_daily_stats(db: Session, date_from: date, date_to: date, user_id: int = 1) -> dict:
+    """Пересчитывает дни [date_from, date_to] и коммитит. Дни без задач и без строк не создаются."""
+    max_minutes = max_daily_minutes(db, user_id)
+    # Архивные задачи тоже вклад дня — иначе пересчёт старого диапазона их «потеряет»
+    totals, scanned = range_day_totals(db, user_id, date_from, date_to)
+    first, last = str(date_from), str(date_to)
+
+    existing = {}
+    duplicates = []
+    for stat in db.query(DailyStats.id, DailyStats.date).filter(
+        DailyStats.user_id == user_id,
+        DailyStats.date >= first,
+        DailyStats.date <= last,
+    ).order_by(DailyStats.id):
+        if stat.date in existing:
+            duplicates.append(stat.id)
+        else:
+            existing[stat.date] = stat.id
+
+    def values(day: str) -> dict:
+        total, completed, overdue, planned, done = totals.get(day, (0, 0, 0, 0, 0))
+        return {
+            "tasks_total": total,
+            "tasks_completed": completed,
+            "tasks_overdue": overdue,
+            "total_minutes_planned": planned,
+            "total_minutes_done": done,
+            "load_score": min(planned / max_minutes, 1.5) if max_minutes > 0 else 0.0,
+            "all_done": total > 0 and completed == total,
+        }
+
+    updates = [{"id": stat_id, **values(day)} for day, stat_id in existing.items()]
+    inserts = [{"user_id": user_id, "date": day, **values(day)} for day in totals if day not in existing]
+    if updates:
+        db.bulk_update_mappings(DailyStats, updates)
+    if inserts:
+        db.bulk_insert_mappings(DailyStats, inserts)
+    if duplicates:
+        db.query(DailyStats).filter(DailyStats.id.in_(duplicates)).delete(synchronize_session=False)
+    # bulk-маппинги идут мимо хуков сессии — серии пересобираем явно
+    rebuild_streaks(db.connection(), user_id)
+    db.commit()
+
+    return {
+        "from": first,
+        "to": last,
+        "tasks_scanned": scanned,
+        "days_updated": len(updates),
+        "days_created": len(inserts),
+        "duplicates_removed": len(duplicates),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute DailyStats for a date range")
+    parser.add_argument("--from", dest="date_from", required=True, type=date.fromisoformat)
+    parser.add_argument("--to", dest="date_to", default=date.today(), type=date.fromisoformat)
+    parser.add_argument("--user", dest="user_id", default=1, type=int)
+    args = parser.parse_args()
+
+    db = open_session(args.user_id)
+    try:
+        started = time.perf_counter()
+        result = backfill_daily_stats(db, args.date_from, args.date_to, args.user_id)
+        print(f"[Backfill] {result} за {time.perf_counter() - started:.2f} с")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Incremental streak state.
+
+Дни с all_done хранятся как непрерывные серии (streak_runs), а самая длинная —
+в user_streaks. Когда у дня меняется all_done (хук after_flush по DailyStats),
+затрагиваются только соседние серии: слияние с сериями, кончающейся вчера
+и начинающейся завтра, или разрез серии, содержащей день. Чтение — одна
+индексная выборка последней серии плюс строка user_streaks, без прохода по дням
+и без ограничения длины.
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import event, inspect, select, insert, update, delete
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, DailyStats, StreakRun, UserStreak, remember_bulk_users
+
+runs = StreakRun.__table__
+streaks = UserStreak.__table__
+
+
+def _length(start: str, end: str) -> int:
+    return (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+
+
+def _save_longest(conn, user_id: int, start: str, end: str, length: int):
+    row = conn.execute(select(streaks.c.longest).where(streaks.c.user_id == user_id)).first()
+    if row is None:
+        conn.execute(insert(streaks).values(user_id=user_id, longest=length, longest_start=start, longest_end=end))
+    elif length > (row.longest or 0):
+        conn.execute(update(streaks).where(streaks.c.user_id == user_id)
+                     .values(longest=length, longest_start=start, longest_end=end))
+
+
+def _recompute_longest(conn, user_id: int):
+    best = (0, None, None)
+    for start, end in conn.execute(select(runs.c.start_date, runs.c.end_date).where(runs.c.user_id == user_id)):
+        length = _length(start, end)
+        if length > best[0]:
+            best = (length, start, end)
+    conn.execute(delete(streaks).where(streaks.c.user_id == user_id))
+    conn.execute(insert(streaks).values(user_id=user_id, longest=best[0], longest_start=best[1], longest_end=best[2]))
+
+
+def _containing(conn, user_id: int, day: str):
+    # Серии не пересекаются: первая с end_date >= day — единственный кандидат
+    return conn.execute(
+        select(runs.c.id, runs.c.start_date, runs.c.end_date)
+        .where(runs.c.user_id == user_id, runs.c.end_date >= day)
+        .order_by(runs.c.end_date).limit(1)
+    ).first()
+
+
+def mark_day(conn, user_id: int, day: date, done: bool):
+    """Применяет смену all_done одного дня к сериям (в текущей транзакции)."""
+    day_str = str(day)
+    run = _containing(conn, user_id, day_str)
+    inside = run is not None and run.start_date <= day_str
+
+    if done:
+        if inside:
+            return
+        prev_day, next_day = str(day - timedelta(days=1)), str(day + timedelta(days=1))
+        left = conn.execute(select(runs.c.id, runs.c.start_date)
+                            .where(runs.c.user_id == user_id, runs.c.end_date == prev_day)).first()
+        right = run if run is not None and run.start_date == next_day else None
+        start = left.start_date if left else day_str
+        end = right.end_date if right else day_str
+        stale = [r.id for r in (left, right) if r is not None]
+        if stale:
+            conn.execute(delete(runs).where(runs.c.id.in_(stale)))
+        conn.execute(insert(runs).values(user_id=user_id, start_date=start, end_date=end))
+        _save_longest(conn, user_id, start, end, _length(start, end))
+    else:
+        if not inside:
+            return
+        conn.execute(delete(runs).where(runs.c.id == run.id))
+        if run.start_date < day_str:
+            conn.execute(insert(runs).values(user_id=user_id, start_date=run.start_date,
+                                             end_date=str(day - timedelta(days=1))))
+        if run.end_date > day_str:
+            conn.execute(insert(runs).values(user_id=user_id, start_date=str(day + timedelta(days=1)),
+                                             end_date=run.end_date))
+        longest = conn.execute(select(streaks.c.longest).where(streaks.c.user_id == user_id)).scalar()
+        if longest is not None and _length(run.start_date, run.end_date) >= longest:
+            _recompute_longest(conn, user_id)
+
+
+def rebuild_streaks(conn, user_id: int = None):
+    """Пересобирает серии по DailyStats целиком (после пакетного backfill или на старой базе)."""
+    stats = DailyStats.__table__
+    query = select(stats.c.user_id, stats.c.date).where(stats.c.all_done == True)  # noqa: E712
+    if user_id is not None:
+        query = query.where(stats.c.user_id == user_id)
+        conn.execute(delete(runs).where(runs.c.user_id == user_id))
+        conn.execute(delete(streaks).where(streaks.c.user_id == user_id))
+    else:
+        conn.execute(delete(runs))
+        conn.execute(delete(streaks))
+
+    by_user: dict[int, list] = {}
+    for uid, day in conn.execute(query.order_by(stats.c.user_id, stats.c.date)):
+        user_runs = by_user.setdefault(uid, [])
+        if user_runs and date.fromisoformat(user_runs[-1][1]) + timedelta(days=1) == date.fromisoformat(day):
+            user_runs[-1][1] = day
+        else:
+            user_runs.append([day, day])
+
+    for uid, user_runs in by_user.items():
+        conn.execute(insert(runs), [{"user_id": uid, "start_date": s, "end_date": e} for s, e in user_runs])
+        start, end = max(user_runs, key=lambda r: _length(*r))
+        conn.execute(insert(streaks).values(user_id=uid, longest=_length(start, end),
+                                            longest_start=start, longest_end=end))
+
+
+def ensure_streaks(engine):
+    with engine.begin() as conn:
+        has_runs = conn.execute(select(runs.c.id).limit(1)).first()
+        has_done = conn.execute(select(DailyStats.__table__.c.id)
+                                .where(DailyStats.__table__.c.all_done == True).limit(1)).first()  # noqa: E712
+        if has_done and not has_runs:
+            rebuild_streaks(conn)
+
+
+def read_streak(db: Session, user_id: int, today: date = None) -> dict:
+    """
+    Текущая серия (содержит сегодня) и рекорд; будущие дни не считаются ни туда, ни туда.
+    Обычно — две индексные выборки; проход по сериям нужен, только если рекорд
+    заходит в будущее (выполнены задачи на завтра и дальше).
+    """
+    today = today or date.today()
+    today_str = str(today)
+    run = _containing(db, user_id, today_str)
+    current_start = run.start_date if run is not None and run.start_date <= today_str else None
+    current = _length(current_start, today_str) if current_start else 0
+
+    best = db.execute(select(streaks.c.longest, streaks.c.longest_start, streaks.c.longest_end)
+                      .where(streaks.c.user_id == user_id)).first()
+    longest, longest_start, longest_end = (best.longest or 0, best.longest_start, best.longest_end) if best else (0, None, None)
+    if longest_end and longest_end > today_str:
+        # Рекорд учитывает будущие дни — пересчитываем по сериям, обрезанным сегодняшним днём
+        longest, longest_start, longest_end = 0, None, None
+        for start, end in db.execute(select(runs.c.start_date, runs.c.end_date)
+                                     .where(runs.c.user_id == user_id, runs.c.start_date <= today_str)):
+            end = min(end, today_str)
+            length = _length(start, end)
+            if length > longest:
+                longest, longest_start, longest_end = length, start, end
+
+    return {
+        "current": current,
+        "current_start": current_start,
+        "longest": longest,
+        "longest_start": longest_start,
+        "longest_end": longest_end,
+    }
+
+
+# ─── SESSION HOOKS ────────────────────────────────────────────────────────────
+
+@event.listens_for(DailyStats.all_done, "set", active_history=True, retval=True)
+def _load_old_all_done(target, value, oldvalue, initiator):
+    # active_history — чтобы старое значение было в history и после expire
+    return value
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _track_all_done(session, flush_context):
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, DailyStats) and obj.all_done:
+            changes.append((obj.user_id, obj.date, True))
+    for obj in session.dirty:
+        if isinstance(obj, DailyStats):
+            hist = inspect(obj).attrs.all_done.history
+            if hist.added and bool(hist.added[0]) != bool(hist.deleted[0] if hist.deleted else False):
+                changes.append((obj.user_id, obj.date, bool(hist.added[0])))
+    for obj in session.deleted:
+        if isinstance(obj, DailyStats) and obj.all_done:
+            changes.append((obj.user_id, obj.date, False))
+    if changes:
+        conn = session.connection()
+        for user_id, day, done in changes:
+            mark_day(conn, user_id, date.fromisoformat(day), done)
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _remember_bulk_users(state):
+    remember_bulk_users(state, DailyStats, "streak_users")
+
+
+@event.listens_for(SessionLocal, "after_bulk_delete")
+@event.listens_for(SessionLocal, "after_bulk_update")
+def _bulk_stats_write(context):
+    if context.mapper.class_ is DailyStats:
+        conn = context.session.connection()
+        for user_id in context.session.info.pop("streak_users", ()):
+            rebuild_streaks(conn, user_id)
@@ -0,0 +1,35 @@
+"""
+Общие фикстуры: приложение на временной SQLite-базе (рабочая taskflow.db не трогается).
+
+Запуск из папки backend:
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+# До импорта database: адрес базы читается при импорте модуля
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='taskflow-tests-'), 'test.db')}"
+os.environ["SHARD_MODE"] = "single"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import SessionLocal
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def db(client):
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
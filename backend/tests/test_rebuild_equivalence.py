@@ -0,0 +1,211 @@
+"""
+Инкрементальное состояние == полная пересборка.
+
+После каждой мутации (одиночные эндпоинты, пакетные, массовые query.update,
+действия агента, архивация) счётчики, DailyStats и серии дней сравниваются
+с тем, что дают rebuild_task_counters, backfill_daily_stats и rebuild_streaks.
+Пересборка идёт в транзакции, которая откатывается, — проверка ничего не чинит.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import engine, DailyStats, Task, TaskArchive, TaskCounter
+from services.agent import apply_agent_turn
+from services.archive import archive_user
+from services.counters import rebuild_task_counters
+from services.load_analyzer import day_contributions, task_stats_snapshot
+from services.stats_backfill import backfill_daily_stats
+from services.streaks import rebuild_streaks, runs, streaks
+
+USER_ID = 1
+# Все задачи тестов укладываются в ±REBUILD_DAYS от сегодня
+REBUILD_DAYS = 400
+
+
+def _counters(conn) -> dict:
+    t = TaskCounter.__table__
+    return {
+        (r.dimension, r.key): r.count
+        for r in conn.execute(select(t).where(t.c.user_id == USER_ID))
+        if r.count
+    }
+
+
+def _daily_stats(conn) -> dict:
+    t = DailyStats.__table__
+    return {
+        r.date: (r.tasks_total, r.tasks_completed, r.tasks_overdue, r.total_minutes_planned,
+                 r.total_minutes_done, round(r.load_score or 0.0, 6), bool(r.all_done))
+        for r in conn.execute(select(t).where(t.c.user_id == USER_ID))
+    }
+
+
+def _streaks(conn) -> tuple:
+    user_runs = {tuple(r) for r in conn.execute(
+        select(runs.c.start_date, runs.c.end_date).where(runs.c.user_id == USER_ID))}
+    longest = conn.execute(select(streaks.c.longest).where(streaks.c.user_id == USER_ID)).scalar()
+    return user_runs, longest or 0
+
+
+def _plain_task_days(conn) -> set:
+    """Дни, в которые вкладываются обычные (не серийные) задачи — горячие и архивные."""
+    days = set()
+    for table in (Task.__table__, TaskArchive.__table__):
+        for row in conn.execute(select(table).where(table.c.user_id == USER_ID)):
+            days.update(day_contributions(task_stats_snapshot(row)))
+    return days
+
+
+def assert_matches_rebuild():
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            counters, stats, streak_state = _counters(conn), _daily_stats(conn), _streaks(conn)
+
+            rebuild_task_counters(conn, USER_ID)
+            assert counters == _counters(conn)
+
+            rebuild_streaks(conn, USER_ID)
+            assert streak_state == _streaks(conn)
+
+            # commit() внутри backfill не выходит за пределы внешней транзакции
+            session = Session(bind=conn, join_transaction_mode="rollback_only")
+            today = date.today()
+            first = min([date.fromisoformat(d) for d in stats] + [today - timedelta(days=REBUILD_DAYS)])
+            last = max([date.fromisoformat(d) for d in stats] + [today + timedelta(days=REBUILD_DAYS)])
+            backfill_daily_stats(session, first, last, user_id=USER_ID)
+            session.close()
+            rebuilt = _daily_stats(conn)
+
+            # Записанные дни совпадают с пересчётом; пропущенными могут быть только
+            # дни одних лишь вхождений серий (строки для них не заводятся заранее)
+            assert stats == {day: rebuilt[day] for day in stats}
+            assert not (set(rebuilt) - set(stats)) & _plain_task_days(conn)
+        finally:
+            trans.rollback()
+
+
+def _at(days: int, hour: int = 10) -> str:
+    return (datetime.combine(date.today(), datetime.min.time())
+            + timedelta(days=days, hours=hour)).isoformat()
+
+
+def _create(client, **fields) -> int:
+    r = client.post("/tasks/", json={"title": "t", **fields})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+def test_single_mutations(client):
+    a = _create(client, start_datetime=_at(0), duration_minutes=45, category="work", priority="high")
+    assert_matches_rebuild()
+    b = _create(client, deadline=_at(-3), category="study")
+    c = _create(client, start_datetime=_at(-2), deadline=_at(1), duration_minutes=60)
+    d = _create(client, title="undated", priority="critical")
+    assert_matches_rebuild()
+
+    assert client.patch(f"/tasks/{a}", json={"start_datetime": _at(-1), "priority": "low"}).status_code == 200
+    assert_matches_rebuild()
+    for task_id in (a, c):
+        assert client.post(f"/tasks/{task_id}/complete").status_code == 200
+    assert_matches_rebuild()
+    assert client.post(f"/tasks/{b}/postpone", params={"new_date": _at(2)}).status_code == 200
+    assert_matches_rebuild()
+    assert client.patch(f"/tasks/{d}", json={"start_datetime": _at(-1, 12)}).status_code == 200
+    assert client.patch(f"/tasks/{d}", json={"status": "completed"}).status_code == 200
+    assert_matches_rebuild()
+    for task_id in (a, b):
+        assert client.delete(f"/tasks/{task_id}").status_code == 200
+    assert_matches_rebuild()
+
+
+def test_series_mutations(client):
+    _create(client, start_datetime=_at(-12), duration_minutes=20)
+    series = _create(client, title="series", start_datetime=_at(-10, 8), duration_minutes=15,
+                     is_recurring=True, recurrence_rule="daily")
+    assert_matches_rebuild()
+
+    occurrence = str(date.today() - timedelta(days=5))
+    assert client.post(f"/tasks/{series}/occurrences/{occurrence}/complete").status_code == 200
+    assert_matches_rebuild()
+    assert client.patch(f"/tasks/{series}", json={"duration_minutes": 40}).status_code == 200
+    assert_matches_rebuild()
+    assert client.patch(f"/tasks/{series}", json={"start_datetime": _at(-20, 8)}).status_code == 200
+    assert_matches_rebuild()
+    assert client.patch(f"/tasks/{series}", json={"title": "renamed"}).status_code == 200
+    assert_matches_rebuild()
+    assert client.delete(f"/tasks/{series}").status_code == 200
+    assert_matches_rebuild()
+
+
+def test_bulk_endpoints(client):
+    r = client.post("/tasks/bulk", json=[
+        {"title": "b1", "start_datetime": _at(3), "duration_minutes": 90, "category": "work"},
+        {"title": "b2", "deadline": _at(-4), "priority": "high"},
+        {"title": "b3", "start_datetime": _at(-6)},
+        {"title": "b4", "start_datetime": _at(4), "deadline": _at(6)},
+    ])
+    assert r.status_code == 200, r.text
+    ids = [t["id"] for t in r.json()]
+    assert_matches_rebuild()
+
+    r = client.patch("/tasks/bulk", json={
+        "update": [{"id": ids[0], "start_datetime": _at(-6), "category": "health"}],
+        "complete": [ids[2]],
+        "postpone": [{"id": ids[1], "new_date": _at(5)}],
+        "delete": [ids[3]],
+    })
+    assert r.status_code == 200, r.text
+    assert_matches_rebuild()
+
+    assert client.post("/tasks/rebalance", params={"apply": True}).status_code == 200
+    assert_matches_rebuild()
+
+
+def test_bulk_query_update(client, db):
+    ids = [_create(client, title=f"q{i}", start_datetime=_at(i), category="work") for i in range(3)]
+    db.query(Task).filter(Task.id.in_(ids)).update({"category": "study", "priority": "low"},
+                                                   synchronize_session=False)
+    db.commit()
+    assert_matches_rebuild()
+    db.query(Task).filter(Task.user_id == USER_ID, Task.category == "study").update(
+        {"priority": "critical"}, synchronize_session=False)
+    db.commit()
+    assert_matches_rebuild()
+
+
+def test_agent_actions(client, db):
+    keep = _create(client, title="agent-keep", start_datetime=_at(1))
+    drop = _create(client, title="agent-drop", deadline=_at(-1))
+    apply_agent_turn(db, {
+        "message": "ok",
+        "tasks_to_create": [
+            {"title": "ai1", "start_datetime": _at(2), "duration_minutes": 30, "category": "work"},
+            {"title": "ai2", "deadline": _at(-2), "priority": "high"},
+        ],
+        "tasks_to_update": [{"id": keep, "start_datetime": _at(-3), "status": "completed"}],
+        "tasks_to_delete": [drop],
+    }, USER_ID, "план")
+    assert_matches_rebuild()
+
+    apply_agent_turn(db, {"message": "ok", "tasks_to_delete": "all"}, USER_ID, "удали всё")
+    assert db.query(Task).filter(Task.user_id == USER_ID).count() == 0
+    assert_matches_rebuild()
+
+
+def test_archive(client, db):
+    old = [_create(client, title=f"old{i}", start_datetime=_at(-200 + i), duration_minutes=30, category="work")
+           for i in range(5)]
+    for task_id in old:
+        assert client.post(f"/tasks/{task_id}/complete").status_code == 200
+    _create(client, title="fresh", start_datetime=_at(0))
+    db.query(Task).filter(Task.id.in_(old)).update(
+        {"completed_at": datetime.now() - timedelta(days=200)}, synchronize_session=False)
+    db.commit()
+    assert_matches_rebuild()
+
+    moved = archive_user(engine, USER_ID, batch=2)
+    assert moved["tasks"] >= len(old)
+    assert_matches_rebuild()
@@ -1,24 +1,54 @@
 import axios from 'axios'
 
 const api = axios.create({ baseURL: 'http://127.0.0.1:8000' }) 
+// Пользователь (пока без авторизации): X-User-Id, для ссылок и WebSocket — ?user_id=
+const userId = () => localStorage.getItem('userId') || '1'
+api.interceptors.request.use((config) => {
+  config.headers['X-User-Id'] = userId()
+  return config
+})
 // Tasks
 export const getTasks    = (view, date, category, status) =>
   api.get('/tasks/', { params: { view, date_str: date, category, status } })
+// Дневные корзины для сетки месяца/года (без полных задач)
+export const getTaskSummary = (view, date, category, status) =>
+  api.get('/tasks/', { params: { view, date_str: date, category, status, summary: true } })
 export const getUndated  = () => api.get('/tasks/undated')
 export const getUnsorted = () => api.get('/tasks/unsorted')
 export const getOverdue  = () => api.get('/tasks/overdue')
 export const getTips     = () => api.get('/tasks/tips')
 export const getLoad     = (date) => api.get(`/tasks/load/${date}`)
+// Загрузка по дням диапазона (to включительно) — для полос недели/месяца
+export const getLoadRange = (from, to) => api.get('/tasks/load', { params: { from, to } })
+// Снимок главной страницы одним запросом: view, undated, unsorted, overdue, load, tips
+export const getDashboard = (view, date) => api.get('/dashboard/', { params: { view, date_str: date } })
+// since=0 — полный снимок; затем передавать полученный version
+export const getTaskChanges = (since = 0) => api.get('/tasks/changes', { params: { since } })
+// Push-канал изменений: { events: [{type: 'task'|'stats'|'tips'|'resync', ...}] }
+export const openTaskFeed = (view = 'day', date) =>
+  new WebSocket(api.defaults.baseURL.replace(/^http/, 'ws') + '/tasks/ws?' +
+    new URLSearchParams({ ...(date ? { view, date_str: date } : { view }), user_id: userId() }))
 export const createTask  = (data) => api.post('/tasks/', data)
 export const updateTask  = (id, data) => api.patch(`/tasks/${id}`, data)
 export const completeTask = (id) => api.post(`/tasks/${id}/complete`)
 export const postponeTask = (id, newDate) =>
   api.post(`/tasks/${id}/postpone`, null, { params: { new_date: newDate } })
 export const toggleSubtask = (id, idx) => api.patch(`/tasks/${id}/subtasks/${idx}`)
+// Вхождения повторяющихся задач (series_id + occurrence_date из списка задач)
+export const completeOccurrence = (id, occDate) => api.post(`/tasks/${id}/occurrences/${occDate}/complete`)
+export const updateOccurrence   = (id, occDate, data) => api.patch(`/tasks/${id}/occurrences/${occDate}`, data)
 export const deleteTask  = (id) => api.delete(`/tasks/${id}`)
+export const createTasksBulk = (tasks) => api.post('/tasks/bulk', tasks)
+// { update: [{id, ...}], complete: [id], postpone: [{id, new_date}], delete: [id] }
+export const patchTasksBulk  = (batch) => api.patch('/tasks/bulk', batch)
+// Разгрузка перегруженных дней: apply=false — только план переносов
+export const rebalanceTasks  = (from, to, apply = false) =>
+  api.post('/tasks/rebalance', null, { params: { from, to, apply } })
 
 // AI
-export const getChatHistory  = ()  => api.get('/ai/history')
+// Страница истории (по возрастанию); before — курсор из заголовка X-Cursor-Before предыдущей страницы
+export const CHAT_PAGE = 50
+export const getChatHistory  = (before) => api.get('/ai/history', { params: { limit: CHAT_PAGE, before } })
 export const clearChatHistory = () => api.delete('/ai/history')   // ← добавлено
 
 export const sendChat = async (message) => {
@@ -50,3 +80,7 @@ export const deleteMemory = (id) => api.delete(`/profile/memories/${id}`)
 export const getStatsOverview = () => api.get('/stats/overview')
 export const getDailyStats    = (days) => api.get('/stats/daily', { params: { days } })
 export const getHeatmap       = (year) => api.get('/stats/heatmap', { params: { year } })
+
+// Потоковая выгрузка — ссылка для скачивания (dataset: tasks | chat | memories | stats)
+export const exportUrl = (dataset, format = 'ndjson') =>
+  `${api.defaults.baseURL}/export/${dataset}?format=${format}&user_id=${userId()}`
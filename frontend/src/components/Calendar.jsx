@@ -2,7 +2,7 @@ import React, { useEffect, useCallback, useState, useRef } from 'react'
 import dayjs from 'dayjs'
 import 'dayjs/locale/ru'
 import { useStore } from '../store'
-import { getTasks, getTips, completeTask, deleteTask, updateTask } from '../api'
+import { getDashboard, completeTask, deleteTask, updateTask } from '../api'
 import toast from 'react-hot-toast'
 
 dayjs.locale('ru')
@@ -526,8 +526,8 @@ function YearView({ tasks, currentDate }) {
 }
 
 // ─── MAIN CALENDAR ────────────────────────────────────────────────────────────
-export default function Calendar({ onAddTask, onRefresh }) {
-  const { view, setView, currentDate, navigateDate, goToday, tasks, setTasks, undatedTasks, setUndatedTasks, setTips, setLoadInfo } = useStore()
+export default function Calendar({ onAddTask }) {
+  const { view, setView, currentDate, navigateDate, goToday, tasks, setTasks, undatedTasks, setUndatedTasks, setOverdueTasks, setTips, setLoadInfo } = useStore()
   const [selectedTask, setSelectedTask] = useState(null)
   const mountedRef = useRef(true)
 
@@ -536,19 +536,21 @@ export default function Calendar({ onAddTask, onRefresh }) {
     return () => { mountedRef.current = false }
   }, [])
 
+  // Один снимок /dashboard/ на вид: задачи окна, undated, overdue, советы и загрузка
   const load = useCallback(async () => {
     try {
-      const [tasksRes, tipsRes] = await Promise.all([getTasks(view, currentDate), getTips()])
+      const { data } = await getDashboard(view, currentDate)
       if (!mountedRef.current) return
-      setTasks(tasksRes.data.tasks || [])
-      if (tasksRes.data.undated) setUndatedTasks(tasksRes.data.undated)
-      setTips(tipsRes.data.tips)
-      setLoadInfo(tipsRes.data.load)
+      setTasks(data.view.tasks || [])
+      setUndatedTasks(data.undated)
+      setOverdueTasks(data.overdue)
+      setTips(data.tips)
+      setLoadInfo(data.load)
     } catch (e) {
       if (!mountedRef.current) return
       console.error('[Calendar] load error:', e)
     }
-  }, [view, currentDate, setTasks, setUndatedTasks, setTips, setLoadInfo])
+  }, [view, currentDate, setTasks, setUndatedTasks, setOverdueTasks, setTips, setLoadInfo])
 
   useEffect(() => {
     load()
@@ -566,7 +568,6 @@ export default function Calendar({ onAddTask, onRefresh }) {
       if (!mountedRef.current) return
       setSelectedTask(prev => prev?.id === id ? { ...prev, status: currentlyDone ? 'pending' : 'completed' } : prev)
       await load()
-      onRefresh?.()
     } catch {
       toast.error('Ошибка')
     }
@@ -579,7 +580,6 @@ export default function Calendar({ onAddTask, onRefresh }) {
       if (!mountedRef.current) return
       setSelectedTask(null)
       await load()
-      onRefresh?.()
     } catch {
       toast.error('Ошибка')
     }
@@ -590,7 +590,6 @@ export default function Calendar({ onAddTask, onRefresh }) {
     if (!mountedRef.current) return
     setSelectedTask(prev => prev?.id === id ? { ...prev, ...data } : prev)
     await load()
-    onRefresh?.()
   }
 
   const formatPeriod = () => {
@@ -1,5 +1,5 @@
 import React, { useState, useRef, useEffect, useCallback } from 'react'
-import { sendChat, sendVoice, uploadFile, getChatHistory, clearChatHistory } from '../api'
+import { sendChat, sendVoice, uploadFile, getChatHistory, clearChatHistory, CHAT_PAGE } from '../api'
 import { useStore } from '../store'
 import { Spinner } from './UI'
 import toast from 'react-hot-toast'
@@ -110,6 +110,58 @@ export default function ChatBox({ onTasksUpdated }) {
   const chunksRef   = useRef([])
   const recTimerRef = useRef(null)
   const mountedRef  = useRef(true)
+  const listRef     = useRef(null)
+  const olderRef    = useRef(null)    // курсор X-Cursor-Before; null — старше ничего нет
+  const loadingOlderRef = useRef(false)
+  const lastIdRef   = useRef(null)
+  const [loadingOlder, setLoadingOlder] = useState(false)
+
+  // Самая новая страница; курсор — только если страница полная. keepOlder — не терять
+  // уже подгруженные старые сообщения (перезагрузка после отправки)
+  const applyLatest = useCallback((res, keepOlder = false) => {
+    const page = (Array.isArray(res.data) ? res.data : []).map(normMsg)
+    const cursor = page.length >= CHAT_PAGE ? res.headers['x-cursor-before'] || null : null
+    setMessages(prev => {
+      if (!keepOlder || !page.length) {
+        olderRef.current = cursor
+        return page
+      }
+      const ids = new Set(page.map(m => m.id))
+      const older = prev.filter(m => typeof m.id === 'number' && !ids.has(m.id) && m.id < page[0].id)
+      if (!older.length) olderRef.current = cursor
+      return [...older, ...page]
+    })
+  }, [setMessages])
+
+  // Подгрузка более старых сообщений при прокрутке к началу; позиция прокрутки сохраняется
+  const loadOlder = useCallback(async () => {
+    const cursor = olderRef.current
+    if (!cursor || loadingOlderRef.current) return
+    loadingOlderRef.current = true
+    setLoadingOlder(true)
+    try {
+      const res = await getChatHistory(cursor)
+      if (!mountedRef.current) return
+      const raw = Array.isArray(res.data) ? res.data : []
+      olderRef.current = raw.length >= CHAT_PAGE ? res.headers['x-cursor-before'] || null : null
+      const el = listRef.current
+      const prevHeight = el ? el.scrollHeight : 0
+      setMessages(prev => [...raw.map(normMsg), ...prev])
+      requestAnimationFrame(() => {
+        if (el) el.scrollTop += el.scrollHeight - prevHeight
+      })
+    } catch (err) {
+      if (!mountedRef.current) return
+      console.error('[ChatBox] Failed to load older messages:', err)
+    } finally {
+      loadingOlderRef.current = false
+      if (mountedRef.current) setLoadingOlder(false)
+    }
+  }, [setMessages])
+
+  const handleScroll = useCallback((e) => {
+    if (e.currentTarget.scrollTop < 40) loadOlder()
+  }, [loadOlder])
 
   // Track mounted state to prevent setState on unmounted component
   useEffect(() => {
@@ -133,8 +185,7 @@ export default function ChatBox({ onTasksUpdated }) {
     getChatHistory()
       .then(res => {
         if (cancelled) return
-        const raw = res.data || []
-        setMessages(Array.isArray(raw) ? raw.map(normMsg) : [])
+        applyLatest(res)
       })
       .catch(err => {
         if (cancelled) return
@@ -144,8 +195,11 @@ export default function ChatBox({ onTasksUpdated }) {
     return () => { cancelled = true }
   }, []) // eslint-disable-line react-hooks/exhaustive-deps
 
-  // Scroll to bottom
+  // Scroll to bottom — только когда изменился хвост, а не при подгрузке старых сообщений
   useEffect(() => {
+    const lastId = messages.length ? messages[messages.length - 1].id : null
+    if (lastId === lastIdRef.current && !isAiTyping) return
+    lastIdRef.current = lastId
     bottomRef.current?.scrollIntoView({ behavior: 'smooth' })
   }, [messages, isAiTyping])
 
@@ -153,13 +207,12 @@ export default function ChatBox({ onTasksUpdated }) {
     try {
       const res = await getChatHistory()
       if (!mountedRef.current) return
-      const raw = res.data || []
-      setMessages(Array.isArray(raw) ? raw.map(normMsg) : [])
+      applyLatest(res, true)
     } catch (err) {
       if (!mountedRef.current) return
       console.error('[ChatBox] Failed to reload history:', err)
     }
-  }, [setMessages])
+  }, [applyLatest])
 
   const handleSend = useCallback(async (text = input.trim()) => {
     if (!text || isAiTyping) return
@@ -314,6 +367,7 @@ export default function ChatBox({ onTasksUpdated }) {
       console.error('[ChatBox] Clear error:', err)
     } finally {
       if (mountedRef.current) {
+        olderRef.current = null
         setMessages([])
         setShowClear(false)
         toast.success('История очищена')
@@ -351,7 +405,10 @@ export default function ChatBox({ onTasksUpdated }) {
       )}
 
       {/* Messages */}
-      <div className="flex-1 overflow-y-auto p-4 flex flex-col gap-3">
+      <div ref={listRef} onScroll={handleScroll} className="flex-1 overflow-y-auto p-4 flex flex-col gap-3">
+        {loadingOlder && (
+          <div className="text-center text-[10px] text-[var(--text3)]">Загрузка…</div>
+        )}
         {messages.length === 0 && !isAiTyping && (
           <div className="flex flex-col items-center justify-center h-full text-center">
             <div className="text-3xl mb-3 opacity-40">✦</div>